@@ -92,16 +92,11 @@ class BaseHardwareInterface(object):
 
         # prune history data if race is not running (keep last 60s)
         if self.race_status is BaseHardwareInterface.RACE_STATUS_READY:
-            if len(node.history_times):
-                while node.history_times[0] < (monotonic() - 60):
-                    node.history_values.pop(0)
-                    node.history_times.pop(0)
-                    if not len(node.history_times): #prevent while from destroying itself
-                        break
+            node.history.trim_before(monotonic() - 60)
 
         if pn_history and self.race_status != BaseHardwareInterface.RACE_STATUS_DONE:
             # get and process history data (except when race is over)
-            pn_history.addTo(readtime, node.history_values, node.history_times, self)
+            pn_history.addTo(readtime, node.history, self)
 
     def process_crossings(self, cross_list):
         if len(cross_list) > 0:
@@ -238,43 +233,43 @@ class PeakNadirHistory:
         self.nadirFirstTime = 0
         self.nadirLastTime = 0
 
-    def addTo(self, readtime, history_values, history_times, interface):
+    def addTo(self, readtime, history, interface):
         if self.peakRssi > 0:
             if self.nadirRssi > 0:
                 # both
                 if self.peakLastTime > self.nadirFirstTime:
                     # process peak first
                     if self.peakFirstTime > self.peakLastTime:
-                        self._addEntry(self.peakRssi, readtime - (self.peakFirstTime / 1000.0), history_values, history_times)
-                        self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history_values, history_times)
+                        self._addEntry(self.peakRssi, readtime - (self.peakFirstTime / 1000.0), history)
+                        self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history)
                     elif self.peakFirstTime == self.peakLastTime:
-                        self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history_values, history_times)
+                        self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history)
                     else:
                         interface.log('Ignoring corrupted peak history times ({0} < {1}) on node {2}'.format(self.peakFirstTime, self.peakLastTime, self.nodeIndex+1))
 
                     if self.nadirFirstTime > self.nadirLastTime:
-                        self._addEntry(self.nadirRssi, readtime - (self.nadirFirstTime / 1000.0), history_values, history_times)
-                        self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history_values, history_times)
+                        self._addEntry(self.nadirRssi, readtime - (self.nadirFirstTime / 1000.0), history)
+                        self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history)
                     elif self.nadirFirstTime == self.nadirLastTime:
-                        self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history_values, history_times)
+                        self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history)
                     else:
                         interface.log('Ignoring corrupted nadir history times ({0} < {1}) on node {2}'.format(self.nadirFirstTime, self.nadirLastTime, self.nodeIndex+1))
 
                 else:
                     # process nadir first
                     if self.nadirFirstTime > self.nadirLastTime:
-                        self._addEntry(self.nadirRssi, readtime - (self.nadirFirstTime / 1000.0), history_values, history_times)
-                        self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history_values, history_times)
+                        self._addEntry(self.nadirRssi, readtime - (self.nadirFirstTime / 1000.0), history)
+                        self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history)
                     elif self.nadirFirstTime == self.nadirLastTime:
-                        self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history_values, history_times)
+                        self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history)
                     else:
                         interface.log('Ignoring corrupted nadir history times ({0} < {1}) on node {2}'.format(self.nadirFirstTime, self.nadirLastTime, self.nodeIndex+1))
 
                     if self.peakFirstTime > self.peakLastTime:
-                        self._addEntry(self.peakRssi, readtime - (self.peakFirstTime / 1000.0), history_values, history_times)
-                        self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history_values, history_times)
+                        self._addEntry(self.peakRssi, readtime - (self.peakFirstTime / 1000.0), history)
+                        self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history)
                     elif self.peakFirstTime == self.peakLastTime:
-                        self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history_values, history_times)
+                        self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history)
                     else:
                         interface.log('Ignoring corrupted peak history times ({0} < {1}) on node {2}'.format(self.peakFirstTime, self.peakLastTime, self.nodeIndex+1))
 
@@ -282,10 +277,10 @@ class PeakNadirHistory:
                 # peak, no nadir
                 # process peak only
                 if self.peakFirstTime > self.peakLastTime:
-                    self._addEntry(self.peakRssi, readtime - (self.peakFirstTime / 1000.0), history_values, history_times)
-                    self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history_values, history_times)
+                    self._addEntry(self.peakRssi, readtime - (self.peakFirstTime / 1000.0), history)
+                    self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history)
                 elif self.peakFirstTime == self.peakLastTime:
-                    self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history_values, history_times)
+                    self._addEntry(self.peakRssi, readtime - (self.peakLastTime / 1000.0), history)
                 else:
                     interface.log('Ignoring corrupted peak history times ({0} < {1}) on node {2}'.format(self.peakFirstTime, self.peakLastTime, self.nodeIndex+1))
 
@@ -293,18 +288,16 @@ class PeakNadirHistory:
             # no peak, nadir
             # process nadir only
             if self.nadirFirstTime > self.nadirLastTime:
-                self._addEntry(self.nadirRssi, readtime - (self.nadirFirstTime / 1000.0), history_values, history_times)
-                self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history_values, history_times)
+                self._addEntry(self.nadirRssi, readtime - (self.nadirFirstTime / 1000.0), history)
+                self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history)
             elif self.nadirFirstTime == self.nadirLastTime:
-                self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history_values, history_times)
+                self._addEntry(self.nadirRssi, readtime - (self.nadirLastTime / 1000.0), history)
             else:
                 interface.log('Ignoring corrupted nadir history times ({0} < {1}) on node {2}'.format(self.nadirFirstTime, self.nadirLastTime, self.nodeIndex+1))
 
-    def _addEntry(self, entry_value, entry_time, history_values, history_times):
-        hist_len = len(history_values)
+    def _addEntry(self, entry_value, entry_time, history):
         # if previous two entries have same value then just extend time on last entry
-        if hist_len >= 2 and history_values[hist_len-1] == entry_value and history_values[hist_len-2] == entry_value:
-            history_times[hist_len-1] = entry_time
+        if len(history) >= 2 and history.last_value(1) == entry_value and history.last_value(2) == entry_value:
+            history.set_last_time(entry_time)
         else:
-            history_values.append(entry_value)
-            history_times.append(entry_time)
+            history.append(entry_value, entry_time)
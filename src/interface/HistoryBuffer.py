@@ -0,0 +1,95 @@
+'''RSSI history ring buffer for a node.'''
+
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+HISTORY_INITIAL_SIZE = 1024
+HISTORY_MAX_SIZE = 1 << 17  # about 1.5 MB per node; over 100 minutes at typical entry rates
+
+class HistoryBuffer():
+    '''
+    Array-backed ring buffer of (rssi, time) entries. Appending and trimming
+    old entries are O(1); storage doubles as needed up to a fixed capacity,
+    after which the oldest entries are overwritten.
+    '''
+    def __init__(self, capacity=HISTORY_MAX_SIZE, initial_size=HISTORY_INITIAL_SIZE):
+        self.capacity = capacity
+        self._initial_size = min(initial_size, capacity)
+        self.clear()
+
+    def clear(self):
+        self._values = array('f', bytes(4 * self._initial_size))
+        self._times = array('d', bytes(8 * self._initial_size))
+        self._head = 0  # index of oldest entry
+        self._count = 0
+        self._overwrite_logged = False
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value, time):
+        size = len(self._values)
+        if self._count == size:
+            if size < self.capacity:
+                self._resize(min(size * 2, self.capacity))
+                size = len(self._values)
+            else:
+                # full; drop oldest entry
+                if not self._overwrite_logged:
+                    logger.warning('RSSI history full ({} entries); discarding oldest entries'.format(size))
+                    self._overwrite_logged = True
+                self._head = (self._head + 1) % size
+                self._count -= 1
+        index = (self._head + self._count) % size
+        self._values[index] = value
+        self._times[index] = time
+        self._count += 1
+
+    def last_value(self, offset=1):
+        '''Returns value of the entry 'offset' from the end'''
+        return self._values[(self._head + self._count - offset) % len(self._values)]
+
+    def set_last_time(self, time):
+        self._times[(self._head + self._count - 1) % len(self._values)] = time
+
+    def trim_before(self, time):
+        '''Drops entries from the start of the history while they are older than the given time'''
+        size = len(self._values)
+        while self._count and self._times[self._head] < time:
+            self._head = (self._head + 1) % size
+            self._count -= 1
+        if not self._count:
+            self._head = 0
+
+    def view(self):
+        '''Returns (values, times) as memoryviews over the stored entries, without copying'''
+        if self._head + self._count > len(self._values):
+            self._resize(len(self._values))  # unwrap so entries are contiguous
+        end = self._head + self._count
+        return memoryview(self._values)[self._head:end], memoryview(self._times)[self._head:end]
+
+    @property
+    def values(self):
+        return self.view()[0].tolist()
+
+    @property
+    def times(self):
+        return self.view()[1].tolist()
+
+    def _resize(self, size):
+        '''Copies entries, oldest first, into new storage of the given size'''
+        end = self._head + self._count
+        if end <= len(self._values):
+            values = self._values[self._head:end]
+            times = self._times[self._head:end]
+        else:
+            end -= len(self._values)
+            values = self._values[self._head:] + self._values[:end]
+            times = self._times[self._head:] + self._times[:end]
+        values.extend(array('f', bytes(4 * (size - self._count))))
+        times.extend(array('d', bytes(8 * (size - self._count))))
+        self._values = values
+        self._times = times
+        self._head = 0
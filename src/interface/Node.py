@@ -1,5 +1,7 @@
 '''Node class for the RotorHazard interface.'''
 
+from HistoryBuffer import HistoryBuffer
+
 class Node:
     '''Node class represents the arduino/rx pair.'''
     def __init__(self):
@@ -51,8 +53,7 @@ class Node:
 
         self.under_min_lap_count = 0
 
-        self.history_values = []
-        self.history_times = []
+        self.history = HistoryBuffer() # RSSI history (peaks and nadirs)
 
         self.scan_enabled = False
         self.scan_interval = 0 # scanning frequency interval
@@ -110,6 +111,14 @@ class Node:
             'pass_nadir_rssi': self.pass_nadir_rssi
         }
 
+    @property
+    def history_values(self):
+        return self.history.values
+
+    @property
+    def history_times(self):
+        return self.history.times
+
     def is_valid_rssi(self, value):
         return value > 0 and value < self.max_rssi_value
 
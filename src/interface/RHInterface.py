@@ -2,6 +2,7 @@
 
 import os
 import logging
+import struct
 import gevent # For threads and timing
 from monotonic import monotonic # to capture read timing
 
@@ -119,6 +120,64 @@ def unpack_rssi(node, data):
         return unpack_16(data) / 2
 
 
+class LapStatsLayout():
+    '''Read command and precompiled (big-endian) struct for the lap stats polled at an API level'''
+    def __init__(self, command, size, fmt, fields, rssi_16bit=False):
+        self.command = command
+        self.size = size
+        self.struct = struct.Struct('>' + fmt)
+        self.fields = fields
+        # RSSI values are 16-bit (and doubled) before API level 18
+        self.rssi_fields = [field for field in fields if field.endswith('rssi')] if rssi_16bit else []
+
+    def read(self, interface, node):
+        return node.read_block(interface, self.command, self.size)
+
+    def unpack(self, data):
+        if len(data) < self.struct.size:
+            return None
+        values = dict(zip(self.fields, self.struct.unpack_from(bytes(data))))
+        for field in self.rssi_fields:
+            values[field] /= 2
+        return values
+
+PASS_STATS_FIELDS = ['lap_id', 'ms_since_lap', 'rssi', 'node_peak_rssi', 'pass_peak_rssi', 'loop_time']
+EXTREMUM_FIELDS = ['flags', 'pass_nadir_rssi', 'node_nadir_rssi', 'extremum_rssi', 'extremum_first_time']
+
+# by minimum API level, newest first
+LAPSTATS_LAYOUTS = [
+    (33, LapStatsLayout(READ_LAP_STATS, 16, 'BHBBBHBBBBHH',
+        PASS_STATS_FIELDS + EXTREMUM_FIELDS + ['extremum_duration'])),
+    (21, LapStatsLayout(READ_LAP_STATS, 16, 'BHBBBHBBBBHH',
+        PASS_STATS_FIELDS + EXTREMUM_FIELDS + ['extremum_last_time'])),
+    (18, LapStatsLayout(READ_LAP_STATS, 19, 'BHBBBHBBBBHHBH',
+        PASS_STATS_FIELDS + ['flags', 'pass_nadir_rssi', 'node_nadir_rssi',
+        'peak_rssi', 'peak_first_time', 'peak_last_time', 'nadir_rssi', 'nadir_first_time'])),
+    (17, LapStatsLayout(READ_LAP_STATS, 28, 'BIHHHH2xBHHHHHH',
+        ['lap_id', 'ms_since_lap', 'rssi', 'node_peak_rssi', 'pass_peak_rssi', 'loop_time', 'flags',
+        'pass_nadir_rssi', 'node_nadir_rssi', 'peak_rssi', 'peak_first_time', 'nadir_rssi', 'nadir_first_time'], True)),
+    (13, LapStatsLayout(READ_LAP_STATS, 20, 'BIHHHH2xBHH',
+        ['lap_id', 'ms_since_lap', 'rssi', 'node_peak_rssi', 'pass_peak_rssi', 'loop_time', 'flags',
+        'pass_nadir_rssi', 'node_nadir_rssi'], True)),
+    (0, LapStatsLayout(READ_LAP_STATS, 18, 'BIHHHH2xBH',
+        ['lap_id', 'ms_since_lap', 'rssi', 'node_peak_rssi', 'pass_peak_rssi', 'loop_time', 'flags',
+        'pass_nadir_rssi'], True)),
+]
+
+# nodes without the newer API functions
+LAPSTATS_LAYOUT_LEGACY = LapStatsLayout(READ_LAP_STATS, 18, 'BIH4xHI',
+    ['lap_id', 'ms_since_lap', 'rssi', 'pass_peak_rssi', 'loop_time'], True)
+LAPSTATS_LAYOUT_LEGACY_SHORT = LapStatsLayout(READ_LAP_STATS, 17, 'BIH4xHI',
+    ['lap_id', 'ms_since_lap', 'rssi', 'pass_peak_rssi', 'loop_time'], True)
+
+def get_lap_stats_layout(node):
+    if not node.api_valid_flag:
+        return LAPSTATS_LAYOUT_LEGACY if node.api_level >= 5 else LAPSTATS_LAYOUT_LEGACY_SHORT
+    for min_api_level, layout in LAPSTATS_LAYOUTS:
+        if node.api_level >= min_api_level:
+            return layout
+
+
 class RHInterface(BaseHardwareInterface):
     def __init__(self, *args, **kwargs):
         BaseHardwareInterface.__init__(self)
@@ -225,71 +284,20 @@ class RHInterface(BaseHardwareInterface):
         startThreshLowerNode = None
         for node in self.nodes:
             if node.frequency:
-                if node.api_valid_flag or node.api_level >= 5:
-                    if node.api_level >= 32:
-                        data = node.read_block(self, READ_LAP_PASS_STATS, 8)
-                        if data != None:
-                            data.extend(node.read_block(self, READ_LAP_EXTREMUMS, 8))
-                    elif node.api_level >= 21:
-                        data = node.read_block(self, READ_LAP_STATS, 16)
-                    elif node.api_level >= 18:
-                        data = node.read_block(self, READ_LAP_STATS, 19)
-                    elif node.api_level >= 17:
-                        data = node.read_block(self, READ_LAP_STATS, 28)
-                    elif node.api_level >= 13:
-                        data = node.read_block(self, READ_LAP_STATS, 20)
-                    else:
-                        data = node.read_block(self, READ_LAP_STATS, 18)
+                stats = None
+                layout = get_lap_stats_layout(node)
+                data = layout.read(self, node)
+                if data:
+                    stats = layout.unpack(data)
                     server_roundtrip = node.io_response - node.io_request
                     server_oneway = server_roundtrip / 2
                     readtime = node.io_response - server_oneway
-                else:
-                    data = node.read_block(self, READ_LAP_STATS, 17)
-
-                if data != None and len(data) > 0:
-                    lap_id = data[0]
-
-                    if node.api_level >= 18:
-                        offset_rssi = 3
-                        offset_nodePeakRssi = 4
-                        offset_passPeakRssi = 5
-                        offset_loopTime = 6
-                        offset_lapStatsFlags = 8
-                        offset_passNadirRssi = 9
-                        offset_nodeNadirRssi = 10
-                        if node.api_level >= 21:
-                            offset_peakRssi = 11
-                            offset_peakFirstTime = 12
-                            if node.api_level >= 33:
-                                offset_peakDuration = 14
-                            else:
-                                offset_peakLastTime = 14
-                            offset_nadirRssi = 11
-                            offset_nadirFirstTime = 12
-                            if node.api_level >= 33:
-                                offset_nadirDuration = 14
-                            else:
-                                offset_nadirLastTime = 14
-                        else:
-                            offset_peakRssi = 11
-                            offset_peakFirstTime = 12
-                            offset_peakLastTime = 14
-                            offset_nadirRssi = 16
-                            offset_nadirFirstTime = 17
-                    else:
-                        offset_rssi = 5
-                        offset_nodePeakRssi = 7
-                        offset_passPeakRssi = 9
-                        offset_loopTime = 11
-                        offset_lapStatsFlags = 15
-                        offset_passNadirRssi = 16
-                        offset_nodeNadirRssi = 18
-                        offset_peakRssi = 20
-                        offset_peakFirstTime = 22
-                        offset_nadirRssi = 24
-                        offset_nadirFirstTime = 26
-
-                    rssi_val = unpack_rssi(node, data[offset_rssi:])
+
+                if stats:
+                    lap_id = stats['lap_id']
+                    ms_val = stats['ms_since_lap']
+
+                    rssi_val = stats['rssi']
                     node.current_rssi = rssi_val  # save value (even if invalid so displayed in GUI)
                     if node.is_valid_rssi(rssi_val):
 
@@ -297,62 +305,57 @@ class RHInterface(BaseHardwareInterface):
                         pn_history = None
                         if node.api_valid_flag:  # if newer API functions supported
                             if node.api_level >= 18:
-                                ms_val = unpack_16(data[1:])
                                 pn_history = PeakNadirHistory(node.index)
                                 if node.api_level >= 21:
-                                    if data[offset_lapStatsFlags] & LAPSTATS_FLAG_PEAK:
-                                        rssi_val = unpack_rssi(node, data[offset_peakRssi:])
+                                    rssi_val = stats['extremum_rssi']
+                                    first_time = stats['extremum_first_time']  # ms *since* the first time
+                                    if 'extremum_duration' in stats:
+                                        last_time = first_time - stats['extremum_duration']  # ms *since* the last time
+                                    else:
+                                        last_time = stats['extremum_last_time']
+                                    if stats['flags'] & LAPSTATS_FLAG_PEAK:
                                         if node.is_valid_rssi(rssi_val):
                                             pn_history.peakRssi = rssi_val
-                                            pn_history.peakFirstTime = unpack_16(data[offset_peakFirstTime:]) # ms *since* the first peak time
-                                            if node.api_level >= 33:
-                                                pn_history.peakLastTime = pn_history.peakFirstTime - unpack_16(data[offset_peakDuration:])   # ms *since* the last peak time
-                                            else:
-                                                pn_history.peakLastTime = unpack_16(data[offset_peakLastTime:])   # ms *since* the last peak time
+                                            pn_history.peakFirstTime = first_time
+                                            pn_history.peakLastTime = last_time
                                         elif rssi_val > 0:
                                             self.log('History peak RSSI reading ({0}) out of range on Node {1}; rejected'.format(rssi_val, node.index+1))
                                     else:
-                                        rssi_val = unpack_rssi(node, data[offset_nadirRssi:])
                                         if node.is_valid_rssi(rssi_val):
                                             pn_history.nadirRssi = rssi_val
-                                            pn_history.nadirFirstTime = unpack_16(data[offset_nadirFirstTime:])
-                                            if node.api_level >= 33:
-                                                pn_history.nadirLastTime = pn_history.nadirFirstTime - unpack_16(data[offset_nadirDuration:])
-                                            else:
-                                                pn_history.nadirLastTime = unpack_16(data[offset_nadirLastTime:])
+                                            pn_history.nadirFirstTime = first_time
+                                            pn_history.nadirLastTime = last_time
                                         elif rssi_val > 0:
                                             self.log('History nadir RSSI reading ({0}) out of range on Node {1}; rejected'.format(rssi_val, node.index+1))
                                 else:
-                                    rssi_val = unpack_rssi(node, data[offset_peakRssi:])
+                                    rssi_val = stats['peak_rssi']
                                     if node.is_valid_rssi(rssi_val):
                                         pn_history.peakRssi = rssi_val
-                                        pn_history.peakFirstTime = unpack_16(data[offset_peakFirstTime:]) # ms *since* the first peak time
-                                        pn_history.peakLastTime = unpack_16(data[offset_peakLastTime:])   # ms *since* the last peak time
-                                    rssi_val = unpack_rssi(node, data[offset_nadirRssi:])
+                                        pn_history.peakFirstTime = stats['peak_first_time'] # ms *since* the first peak time
+                                        pn_history.peakLastTime = stats['peak_last_time']   # ms *since* the last peak time
+                                    rssi_val = stats['nadir_rssi']
                                     if node.is_valid_rssi(rssi_val):
                                         pn_history.nadirRssi = rssi_val
-                                        pn_history.nadirFirstTime = unpack_16(data[offset_nadirFirstTime:])
+                                        pn_history.nadirFirstTime = stats['nadir_first_time']
                                         pn_history.nadirLastTime = pn_history.nadirFirstTime
-                            else:
-                                ms_val = unpack_32(data[1:])
 
-                            rssi_val = unpack_rssi(node, data[offset_nodePeakRssi:])
+                            rssi_val = stats['node_peak_rssi']
                             if node.is_valid_rssi(rssi_val):
                                 node.node_peak_rssi = rssi_val
-                            rssi_val = unpack_rssi(node, data[offset_passPeakRssi:])
+                            rssi_val = stats['pass_peak_rssi']
                             if node.is_valid_rssi(rssi_val):
                                 node.pass_peak_rssi = rssi_val
-                            node.loop_time = unpack_16(data[offset_loopTime:])
-                            if data[offset_lapStatsFlags] & LAPSTATS_FLAG_CROSSING:
+                            node.loop_time = stats['loop_time']
+                            if stats['flags'] & LAPSTATS_FLAG_CROSSING:
                                 cross_flag = True
                             else:
                                 cross_flag = False
-                            rssi_val = unpack_rssi(node, data[offset_passNadirRssi:])
+                            rssi_val = stats['pass_nadir_rssi']
                             if node.is_valid_rssi(rssi_val):
                                 node.pass_nadir_rssi = rssi_val
 
-                            if node.api_level >= 13:
-                                rssi_val = unpack_rssi(node, data[offset_nodeNadirRssi:])
+                            if 'node_nadir_rssi' in stats:
+                                rssi_val = stats['node_nadir_rssi']
                                 if node.is_valid_rssi(rssi_val):
                                     node.node_nadir_rssi = rssi_val
 
@@ -362,9 +365,8 @@ class RHInterface(BaseHardwareInterface):
                                     data_logger.write("{0},{1},{2},{3},{4},{5},{6},{7},{8},{9},{10},{11},{12},{13},{14},{15}\n".format(readtime,lap_id, int(ms_val), node.current_rssi, node.node_peak_rssi, node.pass_peak_rssi, node.loop_time, 'T' if cross_flag else 'F', node.pass_nadir_rssi, node.node_nadir_rssi, pn_history.peakRssi, pn_history.peakFirstTime, pn_history.peakLastTime, pn_history.nadirRssi, pn_history.nadirFirstTime, pn_history.nadirLastTime))
 
                         else:  # if newer API functions not supported
-                            ms_val = unpack_32(data[1:])
-                            node.pass_peak_rssi = unpack_rssi(node, data[11:])
-                            node.loop_time = unpack_32(data[13:])
+                            node.pass_peak_rssi = stats['pass_peak_rssi']
+                            node.loop_time = stats['loop_time']
 
                         self.process_lap_stats(node, readtime, lap_id, ms_val, cross_flag, pn_history, cross_list, upd_list)
 
@@ -210,7 +210,7 @@ void Message::handleReadCommand(bool serialFlag)
             buffer.write16(cmdRssiNodePtr->getVtxFreq());
             break;
 
-        case READ_LAP_STATS:  // deprecated; use READ_LAP_PASS_STATS and READ_LAP_EXTREMUMS
+        case READ_LAP_STATS:  // pass stats and extremums in one transaction (polled by the server)
             {
                 mtime_t timeNowVal = millis();
                 handleReadLapPassStats(timeNowVal);
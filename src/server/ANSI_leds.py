@@ -19,6 +19,10 @@ class ANSIPixel:
     def setPixelColor(self, i, color):
         self.pixels[i] = color
 
+    def setPixels(self, colors, start=0):
+        end = min(start + len(colors), len(self.pixels))
+        self.pixels[start:end] = colors[:end - start]
+
     def getPixelColor(self, i):
         return self.pixels[i]
 
@@ -1,6 +1,7 @@
 # ClusterNodeSet:  Manages a set of secondary nodes
 
 import logging
+import random
 import gevent
 import json
 import socketio
@@ -8,9 +9,10 @@ from monotonic import monotonic
 import RHUtils
 from RHRace import RaceStatus
 from eventmanager import Evt
-from util.RunningMedian import RunningMedian
+from util.ClockSync import ClockOffsetEstimator
 from util.Averager import Averager
 from util.SendAckQueue import SendAckQueue
+from util.BatchSendQueue import BatchSendQueue, BatchReceiver, BATCH_MESSAGE, BATCH_ACK_MESSAGE
 
 logger = logging.getLogger(__name__)
 
@@ -27,8 +29,13 @@ class SecondaryNode:
     NONE_CALLOUT = "none"
 
     LATENCY_AVG_SIZE = 30
-    TIMEDIFF_MEDIAN_SIZE = 30
-    TIMEDIFF_CORRECTION_THRESH_MS = 250  # correct split times if secondary clock more off than this
+    TIMEDIFF_WARN_THRESH_MS = 250  # log when secondary clock is more off than this
+    CLOCK_QUERY_INTERVAL = 2  # seconds between clock-sync queries (if secondary supports them)
+    QUERY_RESPONSE_TIMEOUT = 3.9  # disconnect if no response to a query for this many seconds
+    HEALTH_CHECK_INTERVAL = 1  # seconds between connection checks
+    CONNECT_TIMEOUT_SECS = 5
+    RECONNECT_MIN_SECS = 1  # delay before reconnecting; doubles (up to max) after each failed attempt
+    RECONNECT_MAX_SECS = 30
 
     def __init__(self, idVal, info, RaceContext, monotonic_to_epoch_millis, server_release_version, prev_sec_obj=None):
         self.id = idVal
@@ -106,20 +113,31 @@ class SecondaryNode:
         self.latencyAveragerObj = Averager(self.LATENCY_AVG_SIZE)
         self.totalUpTimeSecs = 0
         self.totalDownTimeSecs = 0
-        self.timeDiffMedianObj = RunningMedian(self.TIMEDIFF_MEDIAN_SIZE)
-        self.timeDiffMedianMs = 0
-        self.timeCorrectionMs = 0
+        self.clockSyncObj = ClockOffsetEstimator()
+        self.timeDiffMs = 0
+        self.lastQueryTime = 0  # last heartbeat or clock-sync query
+        self.queryWaitStartTime = 0
+        self.clockQuerySupported = False
+        self.reconnectDelay = 0
+        self.nextConnectTime = 0
+        self.workerThread = None
         self.progStartEpoch = 0
         self.runningFlag = False
         self.parentNodeSet = None
         self.actionPassTimes = {}
         self.prevSecPassTStamps = {}
+        self.batchQueue = None  # set if secondary accepts batched messages
         self.sio = socketio.Client(reconnection=False, request_timeout=1)
+        self.batchReceiver = BatchReceiver(self.dispatch_batch_message, \
+                                           lambda ack: self.sio.emit(BATCH_ACK_MESSAGE, ack), \
+                                           logger, 'secondary {}'.format(self.id+1))
         self.sio.on('connect', self.on_connect)
         self.sio.on('disconnect', self.on_disconnect)
         self.sio.on('pass_record', self.on_pass_record)
         self.sio.on('check_secondary_response', self.on_check_secondary_response)
         self.sio.on('join_cluster_response', self.join_cluster_response)
+        self.sio.on(BATCH_MESSAGE, self.on_cluster_batch)
+        self.sio.on(BATCH_ACK_MESSAGE, self.on_cluster_batch_ack)
         self.start_connection()
 
     def start_connection(self):
@@ -136,119 +154,29 @@ class SecondaryNode:
             self.latencyAveragerObj = Averager(self.LATENCY_AVG_SIZE)
         self.totalUpTimeSecs = 0
         self.totalDownTimeSecs = 0
-        if (len(self.timeDiffMedianObj.sorted_) > 0):
-            self.timeDiffMedianObj = RunningMedian(self.TIMEDIFF_MEDIAN_SIZE)
-        self.timeDiffMedianMs = 0
-        self.timeCorrectionMs = 0
+        self.clockSyncObj.reset()
+        self.timeDiffMs = 0
+        self.lastQueryTime = 0
+        self.clockQuerySupported = False
         self.progStartEpoch = 0
-        gevent.spawn(self.secondary_worker_thread)
+        self.reconnectDelay = 0
+        self.nextConnectTime = 0
+        if self.workerThread and not self.workerThread.dead:
+            self.workerThread.kill(block=False)
         self.runningFlag = True
+        self.workerThread = gevent.spawn(self.secondary_worker_thread)
 
     def secondary_worker_thread(self):
         self.startConnectTime = monotonic()
-        gevent.sleep(0.1)
+        gevent.sleep(random.uniform(0, 0.1))  # stagger first connection attempts
         while self.runningFlag:
             try:
-                gevent.sleep(1)
                 if self.lastContactTime <= 0:  # if current status is not connected
-                    oldSecsSinceDis = self.secsSinceDisconnect
-                    self.secsSinceDisconnect = monotonic() - self.startConnectTime
-                    if self.secsSinceDisconnect >= 1.0:  # if disconnect just happened then wait a second before reconnect
-                        # if never connected then only retry if race not in progress
-                        if self.numDisconnects > 0 or (self._racecontext.race.race_status != RaceStatus.STAGING and \
-                                                        self._racecontext.race.race_status != RaceStatus.RACING):
-                            # if first-ever attempt or was previously connected then show log msg
-                            if oldSecsSinceDis == 0 or self.numDisconnects > 0:
-                                logger.log((logging.INFO if self.secsSinceDisconnect <= self.queryTimeout else logging.DEBUG), \
-                                           "Attempting to connect to secondary {0} at {1}...".format(self.id+1, self.address))
-                            try:
-                                self.sio.connect(self.address)
-                            except socketio.exceptions.ConnectionError as ex:
-                                if self.lastContactTime > 0:  # if current status is connected
-                                    logger.info("Error connecting to secondary {0} at {1}: {2}".format(self.id+1, self.address, ex))
-                                    if not self.sio.connected:  # if not connected then
-                                        self.on_disconnect()    # invoke disconnect function to update status
-                                else:
-                                    err_msg = "Unable to connect to secondary {0} at {1}: {2}".format(self.id+1, self.address, ex)
-                                    if monotonic() <= self.startConnectTime + self.queryTimeout:
-                                        if self.numDisconnects > 0:  # if previously connected then always log failure
-                                            logger.info(err_msg)
-                                        elif oldSecsSinceDis == 0:   # if not previously connected then only log once
-                                            err_msg += " (will continue attempts until timeout)"
-                                            logger.info(err_msg)
-                                    else:  # if beyond timeout period
-                                        if self.numDisconnects > 0:  # if was previously connected then keep trying
-                                            logger.debug(err_msg)    #  log at debug level and
-                                            gevent.sleep(29)         #  increase delay between attempts
-                                        else:
-                                            logger.warning(err_msg)     # if never connected then give up
-                                            logger.warning("Reached timeout; no longer trying to connect to secondary {0} at {1}".\
-                                                        format(self.id+1, self.address))
-                                            if self.runningFlag and self._racecontext.rhui.emit_cluster_connect_change:
-                                                self._racecontext.rhui.emit_cluster_connect_change(False)  # play one disconnect tone
-                                            self.runningFlag = False
-                                            return  # exit worker thread
+                    if not self.do_connect_attempt():
+                        return  # exit worker thread
                 else:  # if current status is connected
-                    now_time = monotonic()
-                    if not self.freqsSentFlag:
-                        try:
-                            self.freqsSentFlag = True
-                            if (not self.isMirrorMode) and self._racecontext.race.profile:
-                                logger.info("Sending node frequencies to secondary {0} at {1}".format(self.id+1, self.address))
-                                for idx, freq in enumerate(json.loads(self._racecontext.race.profile.frequencies)["f"]):
-                                    data = { 'node':idx, 'frequency':freq }
-                                    self.emit('set_frequency', data)
-                                    gevent.sleep(0.001)
-                        except (KeyboardInterrupt, SystemExit): #pylint disable=try-except-raise
-                            raise
-                        except Exception as ex:
-                            logger.error("Error sending node frequencies to secondary {0} at {1}: {2}".format(self.id+1, self.address, ex))
-                    else:
-                        try:
-                            if self.sio.connected:
-                                # send heartbeat-query every 'queryInterval' seconds, or that long since last contact
-                                if (now_time > self.lastContactTime + self.queryInterval and \
-                                            now_time > self.lastCheckQueryTime + self.queryInterval) or \
-                                            (self.lastCheckQueryTime == 0 and \
-                                             now_time > self.lastContactTime + self.firstQueryInterval):  # if first query do it sooner
-                                    self.lastCheckQueryTime = now_time
-                                    # timestamp not actually used by secondary, but send to make query and response symmetrical
-                                    payload = {
-                                        'timestamp': self.monotonic_to_epoch_millis(now_time) \
-                                                         if self.monotonic_to_epoch_millis else 0
-                                    }
-                                    # don't update 'lastContactTime' value until response received
-                                    self.sio.emit('check_secondary_query', payload)
-                                # if there was no response to last query then disconnect (and reconnect next loop)
-                                elif self.lastCheckQueryTime > self.lastContactTime:
-                                    if self.lastCheckQueryTime - self.lastContactTime > 3.9:
-                                        if len(self.timeDiffMedianObj.sorted_) > 0:
-                                            logger.warning("Disconnecting after no response for 'check_secondary_query'" \
-                                                     " received for secondary {0} at {1}".format(self.id+1, self.address))
-                                        else:  # if never any responses then may be old server version on secondary timer
-                                            logger.warning("Disconnecting after zero responses for 'check_secondary_query'" \
-                                                           " received for secondary {0} at {1} (may need upgrade)".\
-                                                           format(self.id+1, self.address))
-                                        # calling 'disconnect()' will usually invoke 'on_disconnect()', but
-                                        #  'disconnect()' can be slow to return, so force-update status if needed
-                                        gevent.spawn(self.do_sio_disconnect)
-                                        if self.wait_for_sio_disconnect(1.0):
-                                            logger.info("Forcing 'disconnected' status for stuck connection on" \
-                                                        " secondary {0} at {1}".format(self.id+1, self.address))
-                                            self.on_disconnect()
-                                    else:
-                                        logger.debug("No response for 'check_secondary_query' received "\
-                                                     "after {0:.1f} secs for secondary {1} at {2}".\
-                                                     format(self.lastCheckQueryTime - self.lastContactTime, \
-                                                            self.id+1, self.address))
-                            else:
-                                logger.info("Invoking 'on_disconnect()' fn for secondary {0} at {1}".\
-                                            format(self.id+1, self.address))
-                                self.on_disconnect()
-                        except (KeyboardInterrupt, SystemExit): #pylint disable=try-except-raise
-                            raise
-                        except Exception as ex:
-                            logger.error("Error sending check-query to secondary {0} at {1}: {2}".format(self.id+1, self.address, ex))
+                    self.do_health_check()
+                    gevent.sleep(self.HEALTH_CHECK_INTERVAL)
             except KeyboardInterrupt:
                 logger.info("SecondaryNode worker thread terminated by keyboard interrupt")
                 raise
@@ -263,15 +191,146 @@ class SecondaryNode:
                         logger.info("Forcing 'disconnected' status after sio-already-connected error on" \
                                     " secondary {0}".format(self.id+1))
                         self.on_disconnect()
+                    gevent.sleep(self.HEALTH_CHECK_INTERVAL)
                 else:
                     logger.exception("Exception in SecondaryNode worker thread for secondary {} (sio.conn={})".\
                                      format(self.id+1, self.sio.connected))
-                    gevent.sleep(9)
+                    self.schedule_reconnect()
+                    gevent.sleep(max(self.nextConnectTime - monotonic(), self.HEALTH_CHECK_INTERVAL))
+
+    def schedule_reconnect(self):
+        '''Sets time of next connection attempt, with exponential backoff and random jitter'''
+        self.reconnectDelay = min(max(self.reconnectDelay * 2, self.RECONNECT_MIN_SECS), self.RECONNECT_MAX_SECS)
+        self.nextConnectTime = monotonic() + random.uniform(0.5, 1.0) * self.reconnectDelay
+
+    def do_connect_attempt(self):
+        '''Waits for the next scheduled connection attempt and makes it; returns False if giving up'''
+        waitSecs = self.nextConnectTime - monotonic()
+        if waitSecs > 0:
+            gevent.sleep(waitSecs)
+            if not self.runningFlag or self.lastContactTime > 0:
+                return True
+        oldSecsSinceDis = self.secsSinceDisconnect
+        self.secsSinceDisconnect = monotonic() - self.startConnectTime
+        # if never connected then only retry if race not in progress
+        if self.numDisconnects <= 0 and (self._racecontext.race.race_status == RaceStatus.STAGING or \
+                                         self._racecontext.race.race_status == RaceStatus.RACING):
+            self.schedule_reconnect()
+            return True
+        # if first-ever attempt or was previously connected then show log msg
+        if oldSecsSinceDis == 0 or self.numDisconnects > 0:
+            logger.log((logging.INFO if self.secsSinceDisconnect <= self.queryTimeout else logging.DEBUG), \
+                       "Attempting to connect to secondary {0} at {1}...".format(self.id+1, self.address))
+        try:
+            self.sio.connect(self.address, wait_timeout=self.CONNECT_TIMEOUT_SECS)
+            self.reconnectDelay = 0
+            self.nextConnectTime = monotonic() + self.RECONNECT_MIN_SECS  # allow time for 'on_connect()'
+        except socketio.exceptions.ConnectionError as ex:
+            if self.lastContactTime > 0:  # if current status is connected
+                logger.info("Error connecting to secondary {0} at {1}: {2}".format(self.id+1, self.address, ex))
+                if not self.sio.connected:  # if not connected then
+                    self.on_disconnect()    # invoke disconnect function to update status
+            else:
+                err_msg = "Unable to connect to secondary {0} at {1}: {2}".format(self.id+1, self.address, ex)
+                if monotonic() <= self.startConnectTime + self.queryTimeout:
+                    if self.numDisconnects > 0:  # if previously connected then always log failure
+                        logger.info(err_msg)
+                    elif oldSecsSinceDis == 0:   # if not previously connected then only log once
+                        err_msg += " (will continue attempts until timeout)"
+                        logger.info(err_msg)
+                else:  # if beyond timeout period
+                    if self.numDisconnects > 0:  # if was previously connected then keep trying
+                        logger.debug(err_msg)    #  log at debug level (with backoff delay between attempts)
+                    else:
+                        logger.warning(err_msg)     # if never connected then give up
+                        logger.warning("Reached timeout; no longer trying to connect to secondary {0} at {1}".\
+                                    format(self.id+1, self.address))
+                        if self.runningFlag and self._racecontext.rhui.emit_cluster_connect_change:
+                            self._racecontext.rhui.emit_cluster_connect_change(False)  # play one disconnect tone
+                        self.runningFlag = False
+                        return False
+                self.schedule_reconnect()
+        return True
+
+    def do_health_check(self):
+        now_time = monotonic()
+        if not self.freqsSentFlag:
+            try:
+                self.freqsSentFlag = True
+                if (not self.isMirrorMode) and self._racecontext.race.profile:
+                    logger.info("Sending node frequencies to secondary {0} at {1}".format(self.id+1, self.address))
+                    for idx, freq in enumerate(json.loads(self._racecontext.race.profile.frequencies)["f"]):
+                        data = { 'node':idx, 'frequency':freq }
+                        self.emit('set_frequency', data)
+                        gevent.sleep(0.001)
+            except (KeyboardInterrupt, SystemExit): #pylint disable=try-except-raise
+                raise
+            except Exception as ex:
+                logger.error("Error sending node frequencies to secondary {0} at {1}: {2}".format(self.id+1, self.address, ex))
+            return
+        try:
+            if self.sio.connected:
+                # send heartbeat-query every 'queryInterval' seconds, or that long since last contact
+                if (now_time > self.lastContactTime + self.queryInterval and \
+                            now_time > self.lastCheckQueryTime + self.queryInterval) or \
+                            (self.lastCheckQueryTime == 0 and \
+                             now_time > self.lastContactTime + self.firstQueryInterval):  # if first query do it sooner
+                    self.send_query(now_time)
+                    self.lastCheckQueryTime = now_time
+                # if there was no response to queries then disconnect (and reconnect next loop)
+                elif self.lastQueryTime > self.lastContactTime:
+                    if now_time - self.queryWaitStartTime > self.QUERY_RESPONSE_TIMEOUT:
+                        if len(self.clockSyncObj) > 0:
+                            logger.warning("Disconnecting after no response for 'check_secondary_query'" \
+                                     " received for secondary {0} at {1}".format(self.id+1, self.address))
+                        else:  # if never any responses then may be old server version on secondary timer
+                            logger.warning("Disconnecting after zero responses for 'check_secondary_query'" \
+                                           " received for secondary {0} at {1} (may need upgrade)".\
+                                           format(self.id+1, self.address))
+                        # calling 'disconnect()' will usually invoke 'on_disconnect()', but
+                        #  'disconnect()' can be slow to return, so force-update status if needed
+                        gevent.spawn(self.do_sio_disconnect)
+                        if self.wait_for_sio_disconnect(1.0):
+                            logger.info("Forcing 'disconnected' status for stuck connection on" \
+                                        " secondary {0} at {1}".format(self.id+1, self.address))
+                            self.on_disconnect()
+                    else:
+                        logger.debug("No response for 'check_secondary_query' received "\
+                                     "after {0:.1f} secs for secondary {1} at {2}".\
+                                     format(now_time - self.queryWaitStartTime, self.id+1, self.address))
+                # send lightweight queries between heartbeat-queries, as pings and to gather clock-sync samples
+                #  (only to secondaries that echo query timestamps, so responses can be matched)
+                elif self.clockQuerySupported and \
+                            now_time >= self.lastQueryTime + self.CLOCK_QUERY_INTERVAL:
+                    self.send_query(now_time)
+            else:
+                logger.info("Invoking 'on_disconnect()' fn for secondary {0} at {1}".\
+                            format(self.id+1, self.address))
+                self.on_disconnect()
+        except (KeyboardInterrupt, SystemExit): #pylint disable=try-except-raise
+            raise
+        except Exception as ex:
+            logger.error("Error sending check-query to secondary {0} at {1}: {2}".format(self.id+1, self.address, ex))
+
+    def send_query(self, now_time):
+        if self.lastQueryTime <= self.lastContactTime:  # if not already waiting for a response
+            self.queryWaitStartTime = now_time
+        self.lastQueryTime = now_time
+        # timestamp is echoed back by secondary (as 'query_timestamp') to match response to query
+        payload = {
+            'timestamp': self.monotonic_to_epoch_millis(now_time) \
+                             if self.monotonic_to_epoch_millis else 0
+        }
+        # don't update 'lastContactTime' value until response received
+        self.sio.emit('check_secondary_query', payload)
 
     def emit(self, event, data = None):
         try:
             if self.lastContactTime > 0:
-                self.sio.emit(event, data)
+                if self.batchQueue:
+                    self.batchQueue.put(event, data)
+                else:
+                    self.sio.emit(event, data)
                 self.lastContactTime = monotonic()
                 self.numContacts += 1
             elif self.numDisconnects > 0:  # only warn if previously connected
@@ -298,7 +357,8 @@ class SecondaryNode:
                     logger.info("Reconnected to " + self.get_log_str(downSecs, False))
                     self.totalDownTimeSecs += downSecs
                 payload = {
-                    'mode': self.secondaryModeStr
+                    'mode': self.secondaryModeStr,
+                    'batch': True  # secondary may send batched messages
                 }
                 self.emit('join_cluster_ex', payload)
                 if (not self.isMirrorMode) and \
@@ -323,6 +383,13 @@ class SecondaryNode:
                 upSecs = int(round(self.startConnectTime - self.firstContactTime)) if self.firstContactTime > 0 else 0
                 logger.warning("Disconnected from " + self.get_log_str(upSecs))
                 self.totalUpTimeSecs += upSecs
+                self.reconnectDelay = 0
+                self.schedule_reconnect()
+                if self.batchQueue:
+                    numDiscarded = self.batchQueue.clear()
+                    if numDiscarded:
+                        logger.info("Discarded {0} unsent message(s) for secondary {1} at {2}".\
+                                    format(numDiscarded, self.id+1, self.address))
                 if self.runningFlag and self._racecontext.rhui.emit_cluster_connect_change:
                     self._racecontext.rhui.emit_cluster_connect_change(False)
             else:
@@ -369,17 +436,31 @@ class SecondaryNode:
                     format(self.id+1, self.address, self.latencyAveragerObj.minVal, \
                            self.latencyAveragerObj.getIntAvgVal(), self.latencyAveragerObj.maxVal, \
                            self.latencyAveragerObj.lastVal, self.numDisconnects, self.numContacts, \
-                           self.timeDiffMedianMs, upDownStr, timeSecs, totUpSecs, totDownSecs, \
+                           self.timeDiffMs, upDownStr, timeSecs, totUpSecs, totDownSecs, \
                            (float(totUpSecs)/upDownTotal if upDownTotal > 0 else 0),
                            ((", numDisconnsDuringRace=" + str(self.numDisconnsDuringRace)) if \
                                     (self.numDisconnsDuringRace > 0 and \
                                      (stoppedRaceFlag or self._racecontext.race.race_status == RaceStatus.RACING)) else ""))
 
     def on_pass_record(self, data):
+        self.lastContactTime = monotonic()
+        self.numContacts += 1
+        self.process_pass_record(data)
+
+        try:
+            # send message-ack back to secondary (but don't update 'lastContactTime' value)
+            payload = {
+                'messageType': 'pass_record',
+                'messagePayload': data
+            }
+            self.sio.emit('cluster_message_ack', payload)
+        except Exception:
+            logger.exception("Error sending pass-record message acknowledgement to secondary {0} at {1}".\
+                             format(self.id+1, self.address))
+
+    def process_pass_record(self, data):
         try:
             now_secs = monotonic()
-            self.lastContactTime = now_secs
-            self.numContacts += 1
             node_index = data['node']
 
             if self._racecontext.race.race_status is RaceStatus.RACING:
@@ -393,12 +474,10 @@ class SecondaryNode:
 
                     if not self.isActionMode:
 
-                        # convert split timestamp (epoch ms sine 1970-01-01) to equivalent local 'monotonic' time value
-                        split_ts = data['timestamp'] - self._racecontext.race.start_time_epoch_ms
-
-                        # if secondary-timer clock was detected as not synchronized then apply correction
-                        if self.timeCorrectionMs != 0:
-                            split_ts -= self.timeCorrectionMs
+                        # convert split timestamp (epoch ms since 1970-01-01, secondary-timer clock) to primary
+                        #  clock using current offset estimate, then to time since race start
+                        split_ts = self.clockSyncObj.toLocalMs(data['timestamp']) - \
+                                   self._racecontext.race.start_time_epoch_ms
 
                         act_laps_list = self._racecontext.race.get_active_laps(late_lap_flag=True)[node_index]
                         lap_count = max(0, len(act_laps_list) - 1)
@@ -522,16 +601,24 @@ class SecondaryNode:
         except Exception:
             logger.exception("Error processing pass record from secondary {0} at {1}".format(self.id+1, self.address))
 
+    def on_cluster_batch(self, data):
+        self.lastContactTime = monotonic()
+        self.numContacts += 1
         try:
-            # send message-ack back to secondary (but don't update 'lastContactTime' value)
-            payload = {
-                'messageType': 'pass_record',
-                'messagePayload': data
-            }
-            self.sio.emit('cluster_message_ack', payload)
+            self.batchReceiver.receive(data)
         except Exception:
-            logger.exception("Error sending pass-record message acknowledgement to secondary {0} at {1}".\
-                             format(self.id+1, self.address))
+            logger.exception("Error processing message batch from secondary {0} at {1}".format(self.id+1, self.address))
+
+    def dispatch_batch_message(self, messageType, messagePayload):
+        if messageType == 'pass_record':
+            self.process_pass_record(messagePayload)
+        else:
+            logger.warning("Unexpected message '{0}' in batch from secondary {1} at {2}".\
+                           format(messageType, self.id+1, self.address))
+
+    def on_cluster_batch_ack(self, data):
+        if self.batchQueue and data:
+            self.batchQueue.ack(data.get('seq', 0), data.get('sid'))
 
     def on_check_secondary_response(self, data):
         try:
@@ -539,20 +626,23 @@ class SecondaryNode:
                 nowTime = monotonic()
                 self.lastContactTime = nowTime
                 self.numContacts += 1
-                transitTime = nowTime - self.lastCheckQueryTime if self.lastCheckQueryTime > 0 else 0
-                if transitTime > 0:
-                    self.latencyAveragerObj.addItem(int(round(transitTime * 1000)))
-                    if data:
-                        secondaryTimestamp = data.get('timestamp', 0)
-                        if secondaryTimestamp:
-                            # calculate local-time value midway between before and after network query
-                            localTimestamp = self.monotonic_to_epoch_millis(\
-                                             self.lastCheckQueryTime + transitTime/2) \
-                                             if self.monotonic_to_epoch_millis else 0
-                            # calculate clock-time difference in ms and add to running median
-                            self.timeDiffMedianObj.insert(int(round(secondaryTimestamp - localTimestamp)))
-                            self.timeDiffMedianMs = self.timeDiffMedianObj.median()
-                            return
+                if not self.monotonic_to_epoch_millis:
+                    return
+                recvTimestamp = self.monotonic_to_epoch_millis(nowTime)
+                # newer secondaries echo the query timestamp; otherwise assume response is to last check-query
+                sendTimestamp = data.get('query_timestamp') if data else None
+                if sendTimestamp:
+                    self.clockQuerySupported = True
+                elif self.lastCheckQueryTime > 0:
+                    sendTimestamp = self.monotonic_to_epoch_millis(self.lastCheckQueryTime)
+                if sendTimestamp and recvTimestamp > sendTimestamp:
+                    self.latencyAveragerObj.addItem(int(round(recvTimestamp - sendTimestamp)))
+                    secondaryTimestamp = data.get('timestamp', 0) if data else 0
+                    if secondaryTimestamp:
+                        # add round trip to clock-offset estimate (secondary time assumed to be midway)
+                        self.clockSyncObj.addSample(sendTimestamp, secondaryTimestamp, recvTimestamp)
+                        self.timeDiffMs = int(round(self.clockSyncObj.getOffsetMs(recvTimestamp)))
+                        return
                     logger.debug("Received check_secondary_response with no timestamp from secondary {0} at {1}".\
                                  format(self.id+1, self.address))
             else:
@@ -580,9 +670,9 @@ class SecondaryNode:
                 elif prgStrtEpch != self.progStartEpoch:
                     self.progStartEpoch = prgStrtEpch
                     newPrgStrtEpch = True
-                    logger.info("New 'prog_start_epoch' value for secondary {0}: {1}; resetting 'timeDiff' median".\
+                    logger.info("New 'prog_start_epoch' value for secondary {0}: {1}; resetting clock-offset estimate".\
                                 format(self.id+1, prgStrtEpch))
-                    self.timeDiffMedianObj = RunningMedian(self.TIMEDIFF_MEDIAN_SIZE)
+                    self.clockSyncObj.reset()
             except ValueError as ex:
                 logger.warning("Error parsing 'prog_start_epoch' value from secondary {0}: {1}".\
                             format(self.id+1, ex))
@@ -596,6 +686,14 @@ class SecondaryNode:
                 else:
                     logger.warning("Unable to parse 'release_version' from secondary {0} at {1}".\
                                 format(self.id+1, self.address))
+            # newer secondaries accept batched messages
+            if data.get('batch'):
+                if not self.batchQueue:
+                    logger.debug("Using batched messages for secondary {0} at {1}".format(self.id+1, self.address))
+                    self.batchQueue = BatchSendQueue(self.sio.emit, logger, 'secondary {}'.format(self.id+1))
+            elif self.batchQueue:
+                self.batchQueue.stop()
+                self.batchQueue = None
         except Exception:
             logger.exception("Error processing join-cluster response from secondary {0} at {1}".\
                              format(self.id+1, self.address))
@@ -618,6 +716,8 @@ class ClusterNodeSet:
         self.Events = eventmanager
         self.eventActionsObj = None
         self.ClusterSendAckQueueObj = None
+        self.primaryBatchQueue = None  # set if primary accepts batched messages
+        self.primaryBatchReceiver = None
 
     def setEventActionsObj(self, eventActionsObj):
         self.eventActionsObj = eventActionsObj
@@ -634,6 +734,9 @@ class ClusterNodeSet:
 
     def emit_cluster_msg_to_primary(self, SOCKET_IO, messageType, messagePayload, waitForAckFlag=True):
         '''Emits cluster message to primary timer.'''
+        if waitForAckFlag and self.primaryBatchQueue:
+            self.primaryBatchQueue.put(messageType, messagePayload)
+            return
         if not self.ClusterSendAckQueueObj:
             self.ClusterSendAckQueueObj = SendAckQueue(20, SOCKET_IO, logger)
         self.ClusterSendAckQueueObj.put(messageType, messagePayload, waitForAckFlag)
@@ -645,10 +748,31 @@ class ClusterNodeSet:
         else:
             logger.warning("Received 'on_cluster_message_ack' message with no ClusterSendAckQueueObj setup")
 
+    def set_primary_batch_mode(self, SOCKET_IO, batchFlag):
+        '''Selects batched messages to primary timer (if primary accepts them).'''
+        if batchFlag:
+            if not self.primaryBatchQueue:
+                self.primaryBatchQueue = BatchSendQueue(SOCKET_IO.emit, logger, 'primary')
+        elif self.primaryBatchQueue:
+            self.primaryBatchQueue.stop()
+            self.primaryBatchQueue = None
+
+    def receive_batch_from_primary(self, data, dispatchFn, ackFn):
+        '''Processes message batch from primary timer, dispatching messages in order.'''
+        if not self.primaryBatchReceiver:
+            self.primaryBatchReceiver = BatchReceiver(dispatchFn, ackFn, logger, 'primary')
+        self.primaryBatchReceiver.receive(data)
+
+    def ack_batch_from_primary(self, data):
+        '''Processes batch acknowledge from primary timer.'''
+        if self.primaryBatchQueue and data:
+            self.primaryBatchQueue.ack(data.get('seq', 0), data.get('sid'))
+
     def emit_join_cluster_response(self, SOCKET_IO, serverInfoItems):
         '''Emits 'join_cluster_response' message to primary timer.'''
         payload = {
-            'server_info': json.dumps(serverInfoItems)
+            'server_info': json.dumps(serverInfoItems),
+            'batch': True  # primary may send batched messages
         }
         self.emit_cluster_msg_to_primary(SOCKET_IO, 'join_cluster_response', payload, False)
 
@@ -672,6 +796,8 @@ class ClusterNodeSet:
     def shutdown(self):
         for secondary in self.secondaries:
             secondary.runningFlag = False
+            if secondary.batchQueue:
+                secondary.batchQueue.stop()
 
     def addSecondary(self, secondary):
         self.secondaries.append(secondary)
@@ -713,17 +839,24 @@ class ClusterNodeSet:
             logger.error("Secondary ID value ({}) out of bounds in ClusterNodeSet 'retrySecondary()'".\
                          format(secondary_id+1))
 
+    @staticmethod
+    def emitToSecondary(secondary, event, data = None):
+        if secondary.batchQueue:  # queued without blocking, and sent in order
+            secondary.emit(event, data)
+        else:
+            gevent.spawn(secondary.emit, event, data)
+
     def emit(self, event, data = None):
         for secondary in self.secondaries:
-            gevent.spawn(secondary.emit, event, data)
+            self.emitToSecondary(secondary, event, data)
 
     def emitToSplits(self, event, data = None):
         for secondary in self.splitSecondaries:
-            gevent.spawn(secondary.emit, event, data)
+            self.emitToSecondary(secondary, event, data)
 
     def emitEventTrigger(self, data = None):
         for secondary in self.recEventsSecondaries:
-            gevent.spawn(secondary.emit, 'cluster_event_trigger', data)
+            self.emitToSecondary(secondary, 'cluster_event_trigger', data)
 
     def getClusterStatusInfo(self):
         nowTime = monotonic()
@@ -753,12 +886,15 @@ class ClusterNodeSet:
                  'lastLatencyMs': secondary.latencyAveragerObj.lastVal, \
                  'numDisconnects': secondary.numDisconnects, \
                  'numContacts': secondary.numContacts, \
-                 'timeDiffMs': secondary.timeDiffMedianMs, \
+                 'timeDiffMs': secondary.timeDiffMs, \
+                 'clockSync': secondary.clockSyncObj.getStats(secondary.monotonic_to_epoch_millis(nowTime) \
+                                                              if secondary.monotonic_to_epoch_millis else None), \
                  'upTimeSecs': upTimeSecs, \
                  'downTimeSecs': downTimeSecs, \
                  'availability': round((100.0*totalUpSecs/(totalUpSecs+totalDownSecs) \
                                        if totalUpSecs+totalDownSecs > 0 else 0), 1), \
-                 'last_contact': lastContactStr
+                 'last_contact': lastContactStr, \
+                 'transport': secondary.batchQueue.getStats() if secondary.batchQueue else None
                  })
         return {'secondaries': payload}
 
@@ -767,14 +903,17 @@ class ClusterNodeSet:
             secondary.numDisconnsDuringRace = 0
             if secondary.lastContactTime > 0:
                 logger.info("Connected at race start to " + secondary.get_log_str())
-                if abs(secondary.timeDiffMedianMs) > SecondaryNode.TIMEDIFF_CORRECTION_THRESH_MS:
-                    secondary.timeCorrectionMs = secondary.timeDiffMedianMs
-                    logger.info("Secondary {0} clock not synchronized with primary, timeDiff={1}ms".\
-                                format(secondary.id+1, secondary.timeDiffMedianMs))
+                clockStats = secondary.clockSyncObj.getStats()
+                if abs(secondary.timeDiffMs) > SecondaryNode.TIMEDIFF_WARN_THRESH_MS:
+                    logger.info("Secondary {0} clock not synchronized with primary, timeDiff={1}ms; " \
+                                "correcting split times (rtt={2}ms, jitter={3}ms, drift={4}ppm)".\
+                                format(secondary.id+1, secondary.timeDiffMs, clockStats['minRttMs'], \
+                                       clockStats['jitterMs'], clockStats['driftPpm']))
                 else:
-                    secondary.timeCorrectionMs = 0
-                    logger.debug("Secondary {0} clock synchronized OK with primary, timeDiff={1}ms".\
-                                 format(secondary.id+1, secondary.timeDiffMedianMs))
+                    logger.debug("Secondary {0} clock synchronized OK with primary, timeDiff={1}ms " \
+                                 "(rtt={2}ms, jitter={3}ms, drift={4}ppm)".\
+                                 format(secondary.id+1, secondary.timeDiffMs, clockStats['minRttMs'], \
+                                        clockStats['jitterMs'], clockStats['driftPpm']))
             elif secondary.numDisconnects > 0:
                 logger.warning("Secondary {0} not connected at race start".format(secondary.id+1))
 
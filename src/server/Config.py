@@ -28,6 +28,7 @@ LED['LED_STRIP']      = 'GRB'   # Strip type and colour ordering
 LED['LED_ROWS']       = 1       # Number of rows in LED array
 LED['PANEL_ROTATE']   = 0
 LED['INVERTED_PANEL_ROWS'] = False
+LED['LED_MAX_FPS']    = 30      # Max rate of frames sent to the strip (0 for no limit)
 
 # Video Receiver Configuration
 VRX_CONTROL['HOST']    = 'localhost'     # MQTT broker IP Address
@@ -51,6 +52,10 @@ GENERAL['DEF_NODE_FWUPDATE_URL'] = ''
 GENERAL['SHUTDOWN_BUTTON_GPIOPIN'] = 18
 GENERAL['SHUTDOWN_BUTTON_DELAYMS'] = 2500
 GENERAL['DB_AUTOBKP_NUM_KEEP'] = 30
+GENERAL['DB_BKP_COMPRESS'] = False  # gzip database backup files
+GENERAL['DB_WAL_MODE'] = False  # WAL journal with fewer disk syncs; faster writes on SD cards
+GENERAL['DB_COMMIT_WINDOW'] = 0  # seconds non-critical changes may wait to be committed together (0 to disable)
+GENERAL['EVENT_HANDLER_BUDGET_MS'] = 500  # log a warning when an event handler holds the event loop longer (0 to disable)
 GENERAL['RACE_START_DELAY_EXTRA_SECS'] = 0.9  # amount of extra time added to prestage time
 
 InitResultStr = None
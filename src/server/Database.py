@@ -126,7 +126,7 @@ class HeatNode(DB.Model):
     id = DB.Column(DB.Integer, primary_key=True)
     heat_id = DB.Column(DB.Integer, DB.ForeignKey("heat.id"), nullable=False)
     node_index = DB.Column(DB.Integer, nullable=True)
-    pilot_id = DB.Column(DB.Integer, DB.ForeignKey("pilot.id"), nullable=False)
+    pilot_id = DB.Column(DB.Integer, DB.ForeignKey("pilot.id"), nullable=False, index=True)
     color = DB.Column(DB.String(6), nullable=True)
     method = DB.Column(DB.Integer, nullable=False)
     seed_rank = DB.Column(DB.Integer, nullable=True)
@@ -230,7 +230,7 @@ class SavedRaceMeta(DB.Model):
     )
     id = DB.Column(DB.Integer, primary_key=True)
     round_id = DB.Column(DB.Integer, nullable=False)
-    heat_id = DB.Column(DB.Integer, DB.ForeignKey("heat.id"), nullable=False)
+    heat_id = DB.Column(DB.Integer, DB.ForeignKey("heat.id"), nullable=False, index=True)
     class_id = DB.Column(DB.Integer, DB.ForeignKey("race_class.id"), nullable=False)
     format_id = DB.Column(DB.Integer, DB.ForeignKey("race_format.id"), nullable=False)
     start_time = DB.Column(DB.Integer, nullable=False) # internal monotonic time
@@ -260,9 +260,10 @@ class SavedPilotRace(DB.Model):
     id = DB.Column(DB.Integer, primary_key=True)
     race_id = DB.Column(DB.Integer, DB.ForeignKey("saved_race_meta.id"), nullable=False)
     node_index = DB.Column(DB.Integer, nullable=False)
-    pilot_id = DB.Column(DB.Integer, DB.ForeignKey("pilot.id"), nullable=False)
-    history_values = DB.Column(DB.String, nullable=True)
-    history_times = DB.Column(DB.String, nullable=True)
+    pilot_id = DB.Column(DB.Integer, DB.ForeignKey("pilot.id"), nullable=False, index=True)
+    history_values = DB.deferred(DB.Column(DB.String, nullable=True)) # JSON, from older versions
+    history_times = DB.deferred(DB.Column(DB.String, nullable=True))
+    history_data = DB.deferred(DB.Column(DB.LargeBinary, nullable=True)) # packed by RssiHistory
     penalty_time = DB.Column(DB.Integer, nullable=False)
     penalty_desc = DB.Column(DB.String, nullable=True)
     enter_at = DB.Column(DB.Integer, nullable=False)
@@ -275,10 +276,10 @@ class SavedPilotRace(DB.Model):
 class SavedRaceLap(DB.Model):
     __tablename__ = 'saved_race_lap'
     id = DB.Column(DB.Integer, primary_key=True)
-    race_id = DB.Column(DB.Integer, DB.ForeignKey("saved_race_meta.id"), nullable=False)
-    pilotrace_id = DB.Column(DB.Integer, DB.ForeignKey("saved_pilot_race.id"), nullable=False)
+    race_id = DB.Column(DB.Integer, DB.ForeignKey("saved_race_meta.id"), nullable=False, index=True)
+    pilotrace_id = DB.Column(DB.Integer, DB.ForeignKey("saved_pilot_race.id"), nullable=False, index=True)
     node_index = DB.Column(DB.Integer, nullable=False)
-    pilot_id = DB.Column(DB.Integer, DB.ForeignKey("pilot.id"), nullable=False)
+    pilot_id = DB.Column(DB.Integer, DB.ForeignKey("pilot.id"), nullable=False, index=True)
     lap_time_stamp = DB.Column(DB.Integer, nullable=False)
     lap_time = DB.Column(DB.Integer, nullable=False)
     lap_time_formatted = DB.Column(DB.String, nullable=False)
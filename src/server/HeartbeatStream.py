@@ -0,0 +1,148 @@
+'''
+Compact heartbeat stream
+
+Clients may subscribe to packed binary heartbeat frames instead of the JSON
+'heartbeat' message. Each frame carries only the values that changed since
+the frame last sent to that client, so a per-client rate cap drops ticks
+without losing changes. A keyframe with absolute values is sent first and
+whenever the node count changes.
+
+Frame layout (little-endian), where n is the node count and m = ceil(n / 8):
+    uint8     flags (bit 0: keyframe)
+    uint8     n
+    uint8[m]  crossing flags, one bit per node
+    uint8[m]  current_rssi change mask, then int16 per changed node (delta; absolute in keyframes)
+    uint8[m]  frequency change mask, then uint16 per changed node
+    uint8[m]  loop_time change mask, then uint32 per changed node
+
+'''
+
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+
+FLAG_KEYFRAME = 0x01
+
+INT16_MIN = -0x8000
+INT16_MAX = 0x7FFF
+
+class HeartbeatStream():
+    DEFAULT_RATE = 5 # frames per second
+    MAX_RATE = 20
+
+    def __init__(self):
+        self._subscribers = {} # subscriber state, by socket sid
+
+    @property
+    def sids(self):
+        return list(self._subscribers.keys())
+
+    def subscribe(self, sid, rate=None):
+        '''Adds (or updates) a subscriber; the next frame sent to it is a keyframe'''
+        try:
+            rate = float(rate) if rate else self.DEFAULT_RATE
+        except (TypeError, ValueError):
+            rate = self.DEFAULT_RATE
+        rate = min(max(rate, 0.1), self.MAX_RATE)
+
+        self._subscribers[sid] = {
+            'interval': 1.0 / rate,
+            'next_time': None, # earliest time of next frame
+            'sent': None # values last sent to this client
+        }
+        logger.debug('Compact heartbeat subscribed: {} at {:.1f}/s'.format(sid, rate))
+
+    def unsubscribe(self, sid):
+        if self._subscribers.pop(sid, None):
+            logger.debug('Compact heartbeat unsubscribed: {}'.format(sid))
+
+    def get_frames(self, heartbeat, now):
+        '''Returns (sid, frame) pairs for subscribers due at time 'now' (seconds)'''
+        if not self._subscribers:
+            return []
+
+        values = {
+            'current_rssi': [min(max(int(value or 0), INT16_MIN), INT16_MAX) for value in heartbeat['current_rssi']],
+            'frequency': [int(value or 0) for value in heartbeat['frequency']],
+            'loop_time': [int(value or 0) for value in heartbeat['loop_time']],
+            'crossing_flag': [bool(value) for value in heartbeat['crossing_flag']]
+        }
+
+        frames = []
+        for sid, subscriber in self._subscribers.items():
+            if subscriber['next_time'] is None:
+                subscriber['next_time'] = now
+            elif now < subscriber['next_time']:
+                continue
+            # keep a steady rate; after a stall, resume without sending a burst
+            subscriber['next_time'] = max(subscriber['next_time'] + subscriber['interval'], now)
+
+            frames.append((sid, encode_frame(values, subscriber['sent'])))
+            subscriber['sent'] = values
+
+        return frames
+
+def pack_mask(flags):
+    mask = bytearray((len(flags) + 7) // 8)
+    for index, flag in enumerate(flags):
+        if flag:
+            mask[index // 8] |= 1 << (index % 8)
+    return bytes(mask)
+
+def encode_frame(values, previous=None):
+    '''Packs heartbeat values, relative to the previously sent values if given'''
+    node_count = len(values['current_rssi'])
+
+    keyframe = previous is None or len(previous['current_rssi']) != node_count
+    if not keyframe:
+        rssi_deltas = [value - last for value, last in zip(values['current_rssi'], previous['current_rssi'])]
+        if any(delta < INT16_MIN or delta > INT16_MAX for delta in rssi_deltas):
+            keyframe = True
+
+    if keyframe:
+        rssi_changes = [(True, value) for value in values['current_rssi']]
+        frequency_changes = [(True, value) for value in values['frequency']]
+        loop_time_changes = [(True, value) for value in values['loop_time']]
+    else:
+        rssi_changes = [(delta != 0, delta) for delta in rssi_deltas]
+        frequency_changes = [(value != last, value) for value, last in zip(values['frequency'], previous['frequency'])]
+        loop_time_changes = [(value != last, value) for value, last in zip(values['loop_time'], previous['loop_time'])]
+
+    frame = bytearray(struct.pack('<BB', FLAG_KEYFRAME if keyframe else 0, node_count))
+    frame += pack_mask(values['crossing_flag'])
+
+    for changes, value_format in [(rssi_changes, 'h'), (frequency_changes, 'H'), (loop_time_changes, 'I')]:
+        frame += pack_mask([changed for changed, _value in changes])
+        changed_values = [value for changed, value in changes if changed]
+        frame += struct.pack('<{}{}'.format(len(changed_values), value_format), *changed_values)
+
+    return bytes(frame)
+
+def decode_frame(frame, previous=None):
+    '''Unpacks a frame into heartbeat values (as sent to JSON clients), applying deltas to previous values'''
+    flags, node_count = struct.unpack_from('<BB', frame)
+    offset = 2
+    mask_size = (node_count + 7) // 8
+    keyframe = bool(flags & FLAG_KEYFRAME)
+
+    def unpack_mask():
+        nonlocal offset
+        mask = frame[offset:offset + mask_size]
+        offset += mask_size
+        return [bool(mask[index // 8] & (1 << (index % 8))) for index in range(node_count)]
+
+    values = {'crossing_flag': unpack_mask()}
+    for field, value_format, size in [('current_rssi', 'h', 2), ('frequency', 'H', 2), ('loop_time', 'I', 4)]:
+        changed = unpack_mask()
+        changed_values = iter(struct.unpack_from('<{}{}'.format(sum(changed), value_format), frame, offset))
+        offset += sum(changed) * size
+
+        if keyframe:
+            values[field] = [next(changed_values) for _index in range(node_count)]
+        elif field == 'current_rssi':
+            values[field] = [last + next(changed_values) if flag else last for flag, last in zip(changed, previous[field])]
+        else:
+            values[field] = [next(changed_values) if flag else last for flag, last in zip(changed, previous[field])]
+
+    return values
@@ -7,6 +7,16 @@ import io
 
 logger = logging.getLogger(__name__)
 
+class Translator():
+    """ Translates strings into a single language """
+
+    def __init__(self, lang, values):
+        self.lang = lang
+        self.values = values
+
+    def __call__(self, text):
+        return self.values.get(text, text)
+
 class Language():
     LANGUAGE_FILE_NAME = 'language.json'
 
@@ -14,6 +24,11 @@ class Language():
 
     def __init__(self, RHData):
         self._RHData = RHData
+        self._Languages = {}
+        self._translators = {}
+        self._translator = Translator(None, {}) # translator for the current language
+        self._languageList = None
+        self._bundles = {} # serialized language dictionaries, by language id (None for all)
 
         self._InitResultStr = None
         self._InitResultLogLevel = logging.INFO
@@ -36,27 +51,49 @@ class Language():
         if self._InitResultStr:
             logger.log(self._InitResultLogLevel, self._InitResultStr)
 
+    def getTranslator(self, lang=None):
+        '''Returns the translator for the given language (default: the current language)'''
+        if lang is None:
+            translator = self._translator
+            lang = self._RHData.get_option('currentLanguage', '')
+            if lang != translator.lang:
+                # swapped whole, so callers never see a partly updated translator
+                translator = self._translator = self.getTranslator(lang)
+            return translator
+
+        translator = self._translators.get(lang)
+        if translator is None:
+            if lang not in self._Languages:
+                return Translator(lang, {})
+            translator = self._translators[lang] = Translator(lang, self._Languages[lang]['values'])
+        return translator
+
     def __(self, text, domain=''):
         # return translated string
-        if not domain:
-            lang = self._RHData.get_option('currentLanguage')
-
-        if lang:
-            if lang in self._Languages:
-                if text in self._Languages[lang]['values']:
-                    return self._Languages[lang]['values'][text]
-        return text
+        if domain:
+            return self.getTranslator(domain)(text)
+        translator = self._translator
+        if self._RHData.get_option('currentLanguage', '') != translator.lang:
+            translator = self.getTranslator()
+        return translator.values.get(text, text)
 
     def getLanguages(self):
         # get list of available languages
-        langs = []
-        for lang in self._Languages:
-            l = {}
-            l['id'] = lang
-            l['name'] = self._Languages[lang]['name']
-            langs.append(l)
-        return langs
+        if self._languageList is None:
+            self._languageList = [{'id': lang, 'name': self._Languages[lang]['name']} for lang in self._Languages]
+        return self._languageList
 
     def getAllLanguages(self):
         # return full language dictionary
         return self._Languages
+
+    def getLanguageBundle(self, lang=None):
+        '''Returns the language dictionary for one language (or all) as UTF-8 JSON, serialized once'''
+        if lang is not None and lang not in self._Languages:
+            return b'{}'
+        bundle = self._bundles.get(lang)
+        if bundle is None:
+            languages = self._Languages if lang is None else {lang: self._Languages[lang]}
+            bundle = json.dumps(languages, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            self._bundles[lang] = bundle
+        return bundle
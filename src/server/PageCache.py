@@ -6,6 +6,12 @@ lap lists. If valid, served directly to results without rebuilding.
 buildToken is a monotonic timestamp so in-progress builds can be interrupted
 if new data becomes available during the build process.
 
+The cache is assembled from per-race round entries, per-heat entries,
+per-class entries and the event aggregate. Invalidating a single race
+(see invalidate_race) only rebuilds that race's round entry, its heat,
+its class and the event aggregate; all other entries are reused.
+set_valid(False) still forces a full rebuild.
+
 '''
 
 import logging
@@ -29,6 +35,18 @@ class PageCache:
         self._buildToken = False # Time of result generation or false if no results are being calculated
         self._valid = False # Whether cache is valid
 
+        # atomic entries used to assemble the page cache
+        self._rounds = {} # Round entries, by race id
+        self._heats = {} # Heat entries, by heat id
+        self._classes = {} # Class entries, by class id
+        self._event_leaderboard = None
+
+        # pending invalidations
+        self._full_rebuild = True # Whether all entries must be rebuilt
+        self._dirty_races = set() # Race ids with invalid round entries
+        self._dirty_heats = set() # Heat ids with invalid entries
+        self._dirty_classes = set() # Class ids with invalid entries
+
     def get_cache(self):
         if self.get_valid(): # Output existing calculated results
             logger.debug('Getting results from cache')
@@ -50,8 +68,26 @@ class PageCache:
         self._buildToken = buildToken
 
     def set_valid(self, valid):
+        if not valid:
+            self._full_rebuild = True
         self._valid = valid
 
+    def invalidate_race(self, race_id):
+        '''Marks a saved race (and the heat, class and event depending on it) for rebuild'''
+        self._dirty_races.add(race_id)
+        self._valid = False
+
+    def invalidate_heat(self, heat_id):
+        '''Marks a heat entry (and the event aggregate) for rebuild'''
+        self._dirty_heats.add(heat_id)
+        self._valid = False
+
+    def invalidate_raceClass(self, class_id):
+        '''Marks a class entry (and the event aggregate) for rebuild'''
+        if class_id != RHUtils.CLASS_ID_NONE:
+            self._dirty_classes.add(class_id)
+        self._valid = False
+
     def check_buildToken(self, timing):
         if self.get_buildToken():
             while True: # Pause this thread until calculations are completed
@@ -63,6 +99,67 @@ class PageCache:
                     self.set_buildToken(False)
                     break
 
+    def build_round(self, race, race_data):
+        '''Builds the results page entry for a single saved race from bulk-loaded race data'''
+        pilotraces = []
+        for pilotrace in race_data['pilotraces'][race.id]:
+            gevent.sleep()
+            laps = []
+            for lap in race_data['laps'][pilotrace.id]:
+                laps.append({
+                    'id': lap.id,
+                    'lap_time_stamp': lap.lap_time_stamp,
+                    'lap_time': lap.lap_time,
+                    'lap_time_formatted': lap.lap_time_formatted,
+                    'source': lap.source,
+                    'deleted': lap.deleted
+                })
+
+            pilot_data = race_data['pilots'].get(pilotrace.pilot_id)
+            if pilot_data:
+                nodepilot = pilot_data.callsign
+            else:
+                nodepilot = None
+
+            pilotraces.append({
+                'callsign': nodepilot,
+                'pilot_id': pilotrace.pilot_id,
+                'node_index': pilotrace.node_index,
+                'laps': laps
+            })
+
+        return {
+            'id': race.round_id,
+            'start_time_formatted': race.start_time_formatted,
+            'nodes': pilotraces,
+            'leaderboard': self._racecontext.rhdata.get_results_savedRaceMeta(race)
+        }
+
+    def build_heat(self, heat, race_data):
+        '''Builds the results page entry for a heat from its (cached) round entries'''
+        rounds = []
+        for race in race_data['races']:
+            if race.id not in self._rounds:
+                self._rounds[race.id] = self.build_round(race, race_data)
+            rounds.append(self._rounds[race.id])
+
+        return {
+            'heat_id': heat.id,
+            'displayname': heat.display_name,
+            'rounds': rounds,
+            'leaderboard': self._racecontext.rhdata.get_results_heat(heat)
+        }
+
+    def build_raceClass(self, race_class):
+        '''Builds the results page entry for a race class'''
+        rhdata = self._racecontext.rhdata
+        return {
+            'id': race_class.id,
+            'name': race_class.name,
+            'description': race_class.description,
+            'leaderboard': rhdata.get_results_raceClass(race_class),
+            'ranking': rhdata.get_ranking_raceClass(race_class)
+        }
 
     def update_cache(self):
         '''Builds any invalid atomic result caches and creates final output'''
@@ -72,7 +169,6 @@ class PageCache:
         logger.debug('T%d: Result data build started', timing['start'])
 
         error_flag = False
-        results = None
 
         self.check_buildToken(timing) # Don't restart calculation if another calculation thread exists
 
@@ -83,84 +179,76 @@ class PageCache:
             timing['build_start'] = monotonic()
             self.set_buildToken(monotonic())
 
+            rhdata = self._racecontext.rhdata
+
+            # take pending invalidations; any arriving during the build are kept for the next pass
+            full_rebuild = self._full_rebuild
+            dirty_races = self._dirty_races
+            dirty_heats = self._dirty_heats
+            dirty_classes = self._dirty_classes
+            self._full_rebuild = False
+            self._dirty_races = set()
+            self._dirty_heats = set()
+            self._dirty_classes = set()
+
+            if full_rebuild:
+                self._rounds = {}
+                self._heats = {}
+                self._classes = {}
+                self._event_leaderboard = None
+            else:
+                for race_id in dirty_races:
+                    self._rounds.pop(race_id, None)
+                    race = rhdata.get_savedRaceMeta(race_id)
+                    if race:
+                        dirty_heats.add(race.heat_id)
+                        if race.class_id != RHUtils.CLASS_ID_NONE:
+                            dirty_classes.add(race.class_id)
+
+                for heat_id in dirty_heats:
+                    self._heats.pop(heat_id, None)
+
+                for class_id in dirty_classes:
+                    self._classes.pop(class_id, None)
+
+                logger.debug('T%d: Rebuilding %d round(s), %d heat(s), %d class(es)', timing['start'],
+                    len(dirty_races), len(dirty_heats), len(dirty_classes))
+
             heats = {}
-            for heat in self._racecontext.rhdata.get_heats():
-                if self._racecontext.rhdata.savedRaceMetas_has_heat(heat.id):
-                    rounds = []
-                    for race in self._racecontext.rhdata.get_savedRaceMetas_by_heat(heat.id):    
-                        pilotraces = []
-                        for pilotrace in self._racecontext.rhdata.get_savedPilotRaces_by_savedRaceMeta(race.id):
-                            gevent.sleep()
-                            laps = []
-                            for lap in self._racecontext.rhdata.get_savedRaceLaps_by_savedPilotRace(pilotrace.id):
-                                laps.append({
-                                    'id': lap.id,
-                                    'lap_time_stamp': lap.lap_time_stamp,
-                                    'lap_time': lap.lap_time,
-                                    'lap_time_formatted': lap.lap_time_formatted,
-                                    'source': lap.source,
-                                    'deleted': lap.deleted
-                                })
-
-                            pilot_data = self._racecontext.rhdata.get_pilot(pilotrace.pilot_id)
-                            if pilot_data:
-                                nodepilot = pilot_data.callsign
-                            else:
-                                nodepilot = None
-
-                            pilotraces.append({
-                                'callsign': nodepilot,
-                                'pilot_id': pilotrace.pilot_id,
-                                'node_index': pilotrace.node_index,
-                                'laps': laps
-                            })
-
-                        results = self._racecontext.rhdata.get_results_savedRaceMeta(race)
-                        rounds.append({
-                            'id': race.round_id,
-                            'start_time_formatted': race.start_time_formatted,
-                            'nodes': pilotraces,
-                            'leaderboard': results
-                        })
-
-                    results = self._racecontext.rhdata.get_results_heat(heat)
-                    heats[heat.id] = {
-                        'heat_id': heat.id,
-                        'displayname': heat.display_name,
-                        'rounds': rounds,
-                        'leaderboard': results
-                    }
+            for heat in rhdata.get_heats():
+                if heat.id not in self._heats:
+                    race_data = rhdata.get_savedRaceData(heat_id=heat.id)
+                    if len(race_data['races']):
+                        self._heats[heat.id] = self.build_heat(heat, race_data)
+
+                if heat.id in self._heats:
+                    heats[heat.id] = self._heats[heat.id]
 
             timing['round_results'] = monotonic()
             logger.debug('T%d: heat_round results assembled in %.3fs', timing['start'], timing['round_results'] - timing['build_start'])
 
             gevent.sleep()
             heats_by_class = {}
-            heats_by_class[RHUtils.CLASS_ID_NONE] = [heat.id for heat in self._racecontext.rhdata.get_heats_by_class(RHUtils.CLASS_ID_NONE)]
-            for race_class in self._racecontext.rhdata.get_raceClasses():
-                heats_by_class[race_class.id] = [heat.id for heat in self._racecontext.rhdata.get_heats_by_class(race_class.id)]
+            heats_by_class[RHUtils.CLASS_ID_NONE] = [heat.id for heat in rhdata.get_heats_by_class(RHUtils.CLASS_ID_NONE)]
+            race_classes = rhdata.get_raceClasses()
+            for race_class in race_classes:
+                heats_by_class[race_class.id] = [heat.id for heat in rhdata.get_heats_by_class(race_class.id)]
 
             timing['by_class'] = monotonic()
 
             gevent.sleep()
             current_classes = {}
-            for race_class in self._racecontext.rhdata.get_raceClasses():
-                results = self._racecontext.rhdata.get_results_raceClass(race_class)
-                ranking = self._racecontext.rhdata.get_ranking_raceClass(race_class)
-                current_class = {}
-                current_class['id'] = race_class.id
-                current_class['name'] = race_class.name
-                current_class['description'] = race_class.description
-                current_class['leaderboard'] = results
-                current_class['ranking'] = ranking
-
-                current_classes[race_class.id] = current_class
+            for race_class in race_classes:
+                if race_class.id not in self._classes:
+                    self._classes[race_class.id] = self.build_raceClass(race_class)
+                current_classes[race_class.id] = self._classes[race_class.id]
 
             timing['event'] = monotonic()
             logger.debug('T%d: results by class assembled in %.3fs', timing['start'], timing['event'] - timing['by_class'])
 
             gevent.sleep()
-            results = self._racecontext.rhdata.get_results_event()
+            if full_rebuild or dirty_races or dirty_heats or dirty_classes or self._event_leaderboard is None:
+                self._event_leaderboard = rhdata.get_results_event()
 
             timing['event_end'] = monotonic()
             logger.debug('T%d: event results assembled in %.3fs', timing['start'], timing['event_end'] - timing['event'])
@@ -169,8 +257,8 @@ class PageCache:
                 'heats': heats,
                 'heats_by_class': heats_by_class,
                 'classes': current_classes,
-                'event_leaderboard': results,
-                'consecutives_count': self._racecontext.rhdata.get_optionInt('consecutivesCount', 3)
+                'event_leaderboard': self._event_leaderboard,
+                'consecutives_count': rhdata.get_optionInt('consecutivesCount', 3)
             }
 
             self.set_cache(payload)
@@ -179,9 +267,11 @@ class PageCache:
             if error_flag:
                 logger.warning('T%d: Cache results build failed; leaving page cache invalid', timing['start'])
                 # *** emit_priority_message(__("Results did not load completely. Please try again."), False)
+                self._full_rebuild = True
                 self._Events.trigger(Evt.CACHE_FAIL)
             else:
-                self.set_valid(True)
+                if not (self._full_rebuild or self._dirty_races or self._dirty_heats or self._dirty_classes):
+                    self._valid = True
                 self._Events.trigger(Evt.CACHE_READY)
 
             logger.debug('T%d: Page cache built in: %fs', timing['start'], monotonic() - timing['build_start'])
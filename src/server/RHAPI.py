@@ -537,6 +537,9 @@ class DatabaseAPI():
     def pilotruns_by_race(self, race_id):
         return self._racecontext.rhdata.get_savedPilotRaces_by_savedRaceMeta(race_id)
 
+    def pilotrun_history(self, run_or_id):
+        return self._racecontext.rhdata.get_savedPilotRace_history(run_or_id)
+
     # Race -> Pilot Run -> Laps
 
     @property
@@ -960,3 +963,21 @@ class EventsAPI():
     def trigger(self, event, args):
         self._racecontext.events.trigger(event, args)
 
+    @property
+    def handler_stats(self):
+        return self._racecontext.events.get_handler_stats()
+
+    @property
+    def event_stats(self):
+        return self._racecontext.events.get_event_stats()
+
+    @property
+    def latency_budget(self):
+        return self._racecontext.events.get_latency_budget()
+
+    def set_latency_budget(self, budget_ms):
+        self._racecontext.events.set_latency_budget(budget_ms)
+
+    def reset_handler_stats(self):
+        self._racecontext.events.reset_handler_stats()
+
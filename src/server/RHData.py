@@ -6,9 +6,12 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from sqlalchemy import create_engine, MetaData, Table, inspect
+from sqlalchemy import create_engine, MetaData, Table, inspect, event
 from datetime import datetime
 import os
+import gzip
+import sqlite3
+import gevent
 import traceback
 import shutil
 import json
@@ -18,11 +21,63 @@ import random
 from six import unichr
 import Database
 import Results
+import RssiHistory
 from monotonic import monotonic
 from eventmanager import Evt
 from RHRace import RaceStatus, WinCondition, StagingTones
 from Database import ProgramMethod, HeatAdvanceType, HeatStatus
 
+BACKUP_STEP_PAGES = 64 # pages copied between yields by online backups
+BACKUP_CHUNK_SIZE = 1 << 16 # bytes compressed between yields
+BACKUP_TEMP_EXT = '.tmp' # suffix of backup files still being written
+
+class CommitCoalescer():
+    '''
+    Holds deferred session commits and performs them together once a short
+    window has passed, so bursts of non-critical writes cost one commit (and
+    one disk sync) per session instead of one per change.
+    '''
+    def __init__(self, window):
+        self.window = window
+        self._pending = {} # sessions with deferred commits, in order deferred
+        self._timer = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def defer(self, session):
+        self._pending[session] = True
+        if self._timer is None:
+            self._timer = gevent.spawn_later(self.window, self._on_timer)
+
+    def discard(self, session):
+        self._pending.pop(session, None)
+
+    def commit_pending(self, exclude=None):
+        '''Commits all deferred sessions (except 'exclude'); returns False if any commit failed'''
+        sessions = [session for session in self._pending if session is not exclude]
+        for session in sessions:
+            del self._pending[session]
+        if not self._pending and self._timer is not None:
+            if self._timer is not gevent.getcurrent():
+                self._timer.kill(block=False)
+            self._timer = None
+
+        success = True
+        for session in sessions:
+            try:
+                session.commit()
+            except Exception as ex:
+                logger.error('Error writing deferred changes to database: ' + str(ex))
+                session.rollback()
+                success = False
+        return success
+
+    def _on_timer(self):
+        self._timer = None
+        self.commit_pending()
+
+
 class RHData():
     _OptionsCache = {} # Local Python cache for global settings
     TEAM_NAMES_LIST = [str(unichr(i)) for i in range(65, 91)]  # list of 'A' to 'Z' strings
@@ -35,6 +90,16 @@ class RHData():
         self._DB_FILE_NAME = DB_FILE_NAME
         self._DB_BKP_DIR_NAME = DB_BKP_DIR_NAME
 
+        self._generations = {} # data change counters, by table name
+        self._generation_epoch = 0 # changed when the whole database is replaced
+        event.listen(self._Database.DB.session, 'after_flush', self._on_flush)
+        event.listen(self._Database.DB.session, 'after_bulk_update', self._on_bulk_change)
+        event.listen(self._Database.DB.session, 'after_bulk_delete', self._on_bulk_change)
+
+        self._wal_mode = False
+        self._wal_connection = None # kept open in WAL mode
+        self._commit_coalescer = None # set when deferred commits are enabled
+
     def __(self, *args, **kwargs):
         return self._racecontext.language.__(*args, **kwargs)
 
@@ -70,6 +135,108 @@ class RHData():
         for setting in settings:
             self._OptionsCache[setting.option_name] = setting.option_value
 
+    # Data generations
+    def get_generation(self, *table_names):
+        '''Returns a key that changes whenever data in any of the given tables changes'''
+        return (self._generation_epoch,) + tuple(self._generations.get(name, 0) for name in table_names)
+
+    def bump_generation(self, table_name=None):
+        '''Marks data in a table (or all tables) as changed'''
+        if table_name:
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+        else:
+            self._generation_epoch += 1
+
+    def _on_flush(self, session, _flush_context):
+        table_names = set()
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            table_names.add(obj.__table__.name)
+        for table_name in table_names:
+            self.bump_generation(table_name)
+
+    def _on_bulk_change(self, context):
+        self.bump_generation(context.mapper.local_table.name)
+
+    def _on_commit(self, session):
+        # other sessions may have cached data read before a deferred commit landed
+        for table_name in session.info.pop('flushed_tables', ()):
+            self.bump_generation(table_name)
+
+    # Durability
+    def set_durability_mode(self, wal_mode, commit_window=0):
+        '''
+        Selects WAL journaling with 'synchronous=NORMAL' (instead of the default
+        rollback journal with a sync on every commit), and enables deferring
+        non-critical commits by up to 'commit_window' seconds.
+        '''
+        if commit_window and commit_window > 0:
+            if self._commit_coalescer is None:
+                self._commit_coalescer = CommitCoalescer(commit_window)
+                event.listen(self._Database.DB.session, 'before_flush', self._on_before_flush)
+                event.listen(self._Database.DB.session, 'after_commit', self._on_commit)
+            self._commit_coalescer.window = commit_window
+        elif self._commit_coalescer is not None:
+            self.commit_deferred()
+            event.remove(self._Database.DB.session, 'before_flush', self._on_before_flush)
+            event.remove(self._Database.DB.session, 'after_commit', self._on_commit)
+            self._commit_coalescer = None
+
+        engine = self._Database.DB.engine
+        if wal_mode and not self._wal_mode:
+            self.close() # drop any connection made without the pragmas
+            event.listen(engine, 'connect', self._on_connect)
+            self._hold_wal_connection(True)
+            logger.info('Database using WAL journal mode')
+        elif not wal_mode and os.path.exists(self._DB_FILE_NAME):
+            if self._wal_mode:
+                event.remove(engine, 'connect', self._on_connect)
+                self._hold_wal_connection(False)
+            self.close() # leaving WAL mode needs the only connection to the database
+            try:
+                with engine.connect() as conn:
+                    if conn.execute('PRAGMA journal_mode').scalar() == 'wal':
+                        conn.execute('PRAGMA journal_mode=DELETE')
+                        logger.info('Database journal mode changed from WAL to rollback journal')
+            except Exception as ex:
+                logger.error('Error checking database journal mode: ' + str(ex))
+        self._wal_mode = bool(wal_mode)
+
+    def _hold_wal_connection(self, hold):
+        '''
+        Sessions do not pool connections, and SQLite checkpoints and removes the
+        log when the last connection closes; an idle open connection avoids that
+        (and its disk syncs) on every session close.
+        '''
+        if self._wal_connection is not None:
+            self._wal_connection.close()
+            self._wal_connection = None
+        if hold:
+            try:
+                self._wal_connection = self._Database.DB.engine.raw_connection()
+            except Exception as ex:
+                logger.error('Error opening database connection: ' + str(ex))
+
+    @staticmethod
+    def _on_connect(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    def _on_before_flush(self, session, _flush_context, _instances):
+        # a flush takes the database write lock; release locks held by deferred sessions first
+        if len(self._commit_coalescer):
+            self._commit_coalescer.commit_pending(exclude=session)
+        table_names = session.info.setdefault('flushed_tables', set())
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            table_names.add(obj.__table__.name)
+
+    def commit_deferred(self):
+        '''Performs any deferred commits now'''
+        if self._commit_coalescer is not None:
+            return self._commit_coalescer.commit_pending()
+        return True
+
     # General
     def db_init(self, nofill=False):
         # Creates tables from database classes/models
@@ -81,6 +248,25 @@ class RHData():
             logger.error('Error creating database: ' + str(ex))
             return False
 
+    def ensure_indexes(self):
+        # Adds model indexes missing from databases created by older versions
+        try:
+            engine = self._Database.DB.engine
+            inspector = inspect(engine)
+            existing_tables = inspector.get_table_names()
+            for table in self._Database.DB.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                existing_indexes = [index['name'] for index in inspector.get_indexes(table.name)]
+                for index in table.indexes:
+                    if index.name not in existing_indexes:
+                        logger.info('Adding index {} to database'.format(index.name))
+                        index.create(bind=engine)
+            return True
+        except Exception as ex:
+            logger.error('Error adding database indexes: ' + str(ex))
+            return False
+
     def do_reset_all(self, nofill):
         self.reset_pilots()
         if nofill:
@@ -101,8 +287,20 @@ class RHData():
             self._Database.DB.session.rollback()
             self.do_reset_all(nofill)
 
-    def commit(self):
+    def commit(self, deferred=False):
+        '''
+        Commits the session; with 'deferred', the commit may be delayed and
+        grouped with others for a short window (when enabled). Commits that are
+        not deferred also complete any deferred ones first.
+        '''
         try:
+            if self._commit_coalescer is not None:
+                session = self._Database.DB.session()
+                if deferred:
+                    self._commit_coalescer.defer(session)
+                    return True
+                self._commit_coalescer.discard(session)
+                self._commit_coalescer.commit_pending()
             self._Database.DB.session.commit()
             return True
         except Exception as ex:
@@ -111,6 +309,8 @@ class RHData():
 
     def rollback(self):
         try:
+            if self._commit_coalescer is not None:
+                self._commit_coalescer.discard(self._Database.DB.session())
             self._Database.DB.session.rollback()
             return True
         except Exception as ex:
@@ -119,6 +319,8 @@ class RHData():
 
     def close(self):
         try:
+            if self._commit_coalescer is not None:
+                self.commit_deferred()
             self._Database.DB.session.close()
             return True
         except Exception as ex:
@@ -129,6 +331,9 @@ class RHData():
         try:
             with self._Database.DB.engine.begin() as conn:
                 conn.execute("VACUUM")
+                if self._wal_mode:
+                    # fold the log into the database file so the file alone is complete
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
             return True
         except Exception as ex:
             logger.error('Error cleaning database: ' + str(ex))
@@ -136,17 +341,29 @@ class RHData():
 
     # File Handling
 
-    def backup_db_file(self, copy_flag, prefix_str=None):
-        self.close()
-        self.clean()
+    def backup_db_file(self, copy_flag, prefix_str=None, compress=False, progress_fn=None):
+        '''
+        Copies the database to the backup directory using SQLite's online backup,
+        so the database stays usable during the copy; if not 'copy_flag' then
+        the database file is closed and moved instead. Returns the backup file
+        name, or None if the backup failed (no partial file is left behind).
+        '''
+        if not copy_flag:
+            self.close()
+            self.clean()
+            if self._wal_mode:
+                self._hold_wal_connection(False)
         try:     # generate timestamp from last-modified time of database file
             time_str = datetime.fromtimestamp(os.stat(self._DB_FILE_NAME).st_mtime).strftime('%Y%m%d_%H%M%S')
         except:  # if error then use 'now' timestamp
             time_str = datetime.now().strftime('%Y%m%d_%H%M%S')
+        bkp_name = None
         try:
             (dbname, dbext) = os.path.splitext(self._DB_FILE_NAME)
             if prefix_str:
                 dbname = prefix_str + dbname
+            if copy_flag and compress:
+                dbext += '.gz'
             bkp_name = self._DB_BKP_DIR_NAME + '/' + dbname + '_' + time_str + dbext
             if not os.path.exists(self._DB_BKP_DIR_NAME):
                 os.makedirs(self._DB_BKP_DIR_NAME)
@@ -155,7 +372,7 @@ class RHData():
                 time_str = datetime.now().strftime('%Y%m%d_%H%M%S')
                 bkp_name = self._DB_BKP_DIR_NAME + '/' + dbname + '_' + time_str + dbext
             if copy_flag:
-                shutil.copy2(self._DB_FILE_NAME, bkp_name)
+                self.copy_db_online(bkp_name, compress, progress_fn)
                 logger.info('Copied database file to:  ' + bkp_name)
             else:
                 os.renames(self._DB_FILE_NAME, bkp_name)
@@ -163,8 +380,62 @@ class RHData():
             RHUtils.checkSetFileOwnerPi(bkp_name)
         except Exception:
             logger.exception('Error backing up database file')
+            bkp_name = None
+        if not copy_flag and self._wal_mode:
+            self._hold_wal_connection(True)
         return bkp_name
 
+    def copy_db_online(self, dest_name, compress=False, progress_fn=None):
+        '''
+        Copies database pages in small steps, yielding between steps; 'progress_fn' gets percent done.
+        The copy is written to temporary files and renamed to 'dest_name' only once complete.
+        '''
+        part_name = dest_name + '.part' + BACKUP_TEMP_EXT
+        copy_name = dest_name + BACKUP_TEMP_EXT if compress else part_name
+
+        def on_progress(_status, remaining, total):
+            if progress_fn and total:
+                progress_fn(100.0 * (total - remaining) / total)
+            gevent.sleep(0)
+
+        try:
+            src_conn = sqlite3.connect(self._DB_FILE_NAME)
+            try:
+                dest_conn = sqlite3.connect(copy_name)
+                try:
+                    src_conn.backup(dest_conn, pages=BACKUP_STEP_PAGES, progress=on_progress)
+                finally:
+                    dest_conn.close()
+            finally:
+                src_conn.close()
+
+            if compress:
+                with open(copy_name, 'rb') as src_file, gzip.open(part_name, 'wb') as dest_file:
+                    while True:
+                        chunk = src_file.read(BACKUP_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dest_file.write(chunk)
+                        gevent.sleep(0)
+
+            os.replace(part_name, dest_name)
+        finally:
+            for temp_name in (copy_name, part_name):
+                if os.path.exists(temp_name):
+                    os.remove(temp_name)
+
+        if progress_fn:
+            progress_fn(100.0)
+
+    def extract_db_backup(self, bkp_name):
+        '''Returns path of an uncompressed copy of a compressed backup file (or the given path)'''
+        if not bkp_name.endswith('.gz'):
+            return bkp_name
+        db_name = bkp_name[:-len('.gz')] + BACKUP_TEMP_EXT
+        with gzip.open(bkp_name, 'rb') as src_file, open(db_name, 'wb') as dest_file:
+            shutil.copyfileobj(src_file, dest_file, BACKUP_CHUNK_SIZE)
+        return db_name
+
     def delete_old_db_autoBkp_files(self, num_keep_val, prefix_str, DB_AUTOBKP_NUM_KEEP_STR):
         num_del = 0
         try:
@@ -174,7 +445,9 @@ class RHData():
                 if prefix_str:
                     dbname = prefix_str + dbname
                 file_list = list(filter(os.path.isfile, glob.glob(self._DB_BKP_DIR_NAME + \
-                                                        '/' + dbname + '*' + dbext)))
+                                                        '/' + dbname + '*' + dbext) + \
+                                                    glob.glob(self._DB_BKP_DIR_NAME + \
+                                                        '/' + dbname + '*' + dbext + '.gz')))
                 file_list.sort(key=os.path.getmtime)  # sort by last-modified time
                 if len(file_list) > num_keep_val:
                     if num_keep_val > 0:
@@ -300,6 +573,7 @@ class RHData():
             'stage_1': False,
             'stage_2': False,
         }
+        self.bump_generation()
 
         # stage 0: collect data from file
         try:
@@ -399,6 +673,7 @@ class RHData():
             self.backup_db_file(False)  # rename and move DB file
 
         self.db_init(nofill=True)
+        self.ensure_indexes()
 
         # stage 1: recover pilots, heats, heatnodes, format, profile, class, options
         if recover_status['stage_0'] == True:
@@ -658,6 +933,7 @@ class RHData():
                         self.restore_table(self._Database.SavedPilotRace, racePilot_query_data, defaults={
                             'history_values': None,
                             'history_times': None,
+                            'history_data': None,
                             'penalty_time': None,
                             'penalty_desc': None,
                             'enter_at': None,
@@ -674,6 +950,8 @@ class RHData():
                             'deleted': False
                         })
 
+                        self.pack_savedPilotRace_histories()
+
                     recover_status['stage_2'] = True
                 except Exception as ex:
                     logger.warning('Error while writing data from previous database (stage 2):  ' + str(ex))
@@ -796,7 +1074,7 @@ class RHData():
             else:
                 self._Database.DB.session.add(self._Database.PilotAttribute(id=pilot_id, name=data['pilot_attr'], value=data['value']))
 
-        self.commit()
+        self.commit(deferred=True)
 
         self._racecontext.race.clear_results()  # refresh current leaderboard
 
@@ -849,7 +1127,7 @@ class RHData():
             used_freqs.append(frequency)
 
             pilot.used_frequencies = json.dumps(used_freqs)
-            self.commit()
+            self.commit(deferred=True)
             return pilot
         return False
 
@@ -1052,7 +1330,7 @@ class RHData():
             slot = self._Database.HeatNode.query.get(slot_id)
 
         if 'name' in data:
-            self._racecontext.pagecache.set_valid(False)
+            self._racecontext.pagecache.invalidate_heat(heat_id)
             heat.name = data['name']
         if 'class' in data:
             old_class_id = heat.class_id
@@ -1684,7 +1962,7 @@ class RHData():
             if 'seed_rank' in slot_data:
                 slot.seed_rank = slot_data['seed_rank']
 
-        self.commit()
+        self.commit(deferred=True)
 
     def check_all_heat_nodes_filled(self, heat_id):
         heat_nodes = self.get_heatNodes_by_heat(heat_id)
@@ -1845,9 +2123,8 @@ class RHData():
 
         race_list = self._Database.SavedRaceMeta.query.filter_by(class_id=race_class_id).all()
 
-        if 'class_name' in data:
-            if len(race_list):
-                self._racecontext.pagecache.set_valid(False)
+        if 'class_name' in data or 'class_description' in data:
+            self._racecontext.pagecache.invalidate_raceClass(race_class_id)
 
         if 'class_format' in data or \
            'win_condition' in data or \
@@ -2887,6 +3164,42 @@ class RHData():
     def get_savedPilotRace(self, pilotrace_id):
         return self._Database.SavedPilotRace.query.get(pilotrace_id)
 
+    def resolve_savedPilotRace_from_savedPilotRace_or_id(self, savedPilotRace_or_id):
+        if isinstance(savedPilotRace_or_id, Database.SavedPilotRace):
+            return savedPilotRace_or_id
+        else:
+            return self._Database.SavedPilotRace.query.get(savedPilotRace_or_id)
+
+    def get_savedPilotRace_history(self, savedPilotRace_or_id):
+        '''Returns (history_values, history_times) lists for a saved pilot race'''
+        pilotrace = self.resolve_savedPilotRace_from_savedPilotRace_or_id(savedPilotRace_or_id)
+        if pilotrace is None:
+            return False
+        if pilotrace.history_data:
+            return RssiHistory.unpack(pilotrace.history_data)
+        history_values = json.loads(pilotrace.history_values) if pilotrace.history_values else []
+        history_times = json.loads(pilotrace.history_times) if pilotrace.history_times else []
+        return history_values, history_times
+
+    def pack_savedPilotRace_histories(self):
+        # Converts RSSI history stored as JSON by older versions
+        packed_count = 0
+        for pilotrace in self._Database.SavedPilotRace.query.filter(
+                self._Database.SavedPilotRace.history_data == None,
+                self._Database.SavedPilotRace.history_values != None).all():
+            try:
+                history_data = RssiHistory.pack(json.loads(pilotrace.history_values), json.loads(pilotrace.history_times))
+            except (ValueError, TypeError):
+                history_data = None
+            if history_data is not None:
+                pilotrace.history_data = history_data
+                pilotrace.history_values = None
+                pilotrace.history_times = None
+                packed_count += 1
+        self.commit()
+        if packed_count:
+            logger.info('Packed RSSI history for {} saved pilot races'.format(packed_count))
+
     def get_savedPilotRaces(self):
         return self._Database.SavedPilotRace.query.all()
 
@@ -2941,12 +3254,19 @@ class RHData():
     # Race general
     def add_race_data(self, data):
         for node_index, node_data in data.items():
+            history_values = node_data['history_values']
+            history_times = node_data['history_times']
+            if isinstance(history_values, str): # JSON, as passed by older callers
+                history_values = json.loads(history_values)
+                history_times = json.loads(history_times)
+            history_data = RssiHistory.pack(history_values, history_times)
             new_pilotrace = self._Database.SavedPilotRace(
                 race_id=node_data['race_id'],
                 node_index=node_index,
                 pilot_id=node_data['pilot_id'],
-                history_values=node_data['history_values'],
-                history_times=node_data['history_times'],
+                history_values=json.dumps(list(history_values)) if history_data is None else None,
+                history_times=json.dumps(list(history_times)) if history_data is None else None,
+                history_data=history_data,
                 penalty_time=0,
                 enter_at=node_data['enter_at'],
                 exit_at=node_data['exit_at'],
@@ -2984,6 +3304,97 @@ class RHData():
         logger.info('Database saved races reset')
         return True
 
+    # Bulk Loaders
+    def get_savedRaceData(self, heat_id=None, round_id=None, class_id=None, race_id=None, active_laps=False, load_laps=True):
+        '''
+        Loads saved races with their pilot-races, laps and pilots in a fixed
+        number of queries, independent of the number of rows. Scope is
+        selected by race_id, heat_id (optionally with round_id) or class_id;
+        with no scope all saved races are loaded. active_laps skips deleted
+        laps; load_laps=False skips the lap query entirely.
+
+        Returns dict with:
+            races: list of SavedRaceMeta, ordered by round (by id if unscoped)
+            pilotraces: SavedPilotRace lists, by race id
+            laps: SavedRaceLap lists ordered by time stamp, by pilotrace id
+            pilots: Pilot objects, by pilot id
+        '''
+        SavedRaceMeta = self._Database.SavedRaceMeta
+        SavedPilotRace = self._Database.SavedPilotRace
+        SavedRaceLap = self._Database.SavedRaceLap
+
+        race_filter = self.get_savedRaceFilter(heat_id, round_id, class_id, race_id)
+
+        if race_filter:
+            races = SavedRaceMeta.query.filter(*race_filter).order_by(SavedRaceMeta.round_id).all()
+        else:
+            races = SavedRaceMeta.query.order_by(SavedRaceMeta.id).all()
+
+        pilotrace_query = SavedPilotRace.query
+        lap_query = SavedRaceLap.query
+        if race_filter:
+            pilotrace_query = pilotrace_query.join(SavedRaceMeta, SavedRaceMeta.id == SavedPilotRace.race_id).filter(*race_filter)
+            lap_query = lap_query.join(SavedRaceMeta, SavedRaceMeta.id == SavedRaceLap.race_id).filter(*race_filter)
+        if active_laps:
+            lap_query = lap_query.filter(SavedRaceLap.deleted != 1)
+
+        pilotraces = {race.id: [] for race in races}
+        for pilotrace in pilotrace_query.order_by(SavedPilotRace.id).all():
+            pilotraces.setdefault(pilotrace.race_id, []).append(pilotrace)
+
+        laps = {}
+        for pilotrace_list in pilotraces.values():
+            for pilotrace in pilotrace_list:
+                laps[pilotrace.id] = []
+        if load_laps:
+            for lap in lap_query.order_by(SavedRaceLap.lap_time_stamp, SavedRaceLap.id).all():
+                laps.setdefault(lap.pilotrace_id, []).append(lap)
+
+        pilots = {}
+        for pilot in self.get_pilots():
+            pilots[pilot.id] = pilot
+
+        return {
+            'races': races,
+            'pilotraces': pilotraces,
+            'laps': laps,
+            'pilots': pilots
+        }
+
+    def get_savedRaceLapColumns(self, heat_id=None, round_id=None, class_id=None, race_id=None, active_laps=False):
+        '''
+        Loads saved laps as plain (id, race_id, pilotrace_id, pilot_id, lap_time)
+        rows ordered by lap id, without building model objects. Scope is
+        selected as in get_savedRaceData.
+        '''
+        SavedRaceMeta = self._Database.SavedRaceMeta
+        SavedRaceLap = self._Database.SavedRaceLap
+
+        race_filter = self.get_savedRaceFilter(heat_id, round_id, class_id, race_id)
+
+        lap_query = self._Database.DB.session.query(SavedRaceLap.id, SavedRaceLap.race_id,
+            SavedRaceLap.pilotrace_id, SavedRaceLap.pilot_id, SavedRaceLap.lap_time)
+        if race_filter:
+            lap_query = lap_query.join(SavedRaceMeta, SavedRaceMeta.id == SavedRaceLap.race_id).filter(*race_filter)
+        if active_laps:
+            lap_query = lap_query.filter(SavedRaceLap.deleted != 1)
+
+        return lap_query.order_by(SavedRaceLap.id).all()
+
+    def get_savedRaceFilter(self, heat_id=None, round_id=None, class_id=None, race_id=None):
+        SavedRaceMeta = self._Database.SavedRaceMeta
+
+        race_filter = []
+        if race_id is not None:
+            race_filter.append(SavedRaceMeta.id == race_id)
+        elif heat_id is not None:
+            race_filter.append(SavedRaceMeta.heat_id == heat_id)
+            if round_id is not None:
+                race_filter.append(SavedRaceMeta.round_id == round_id)
+        elif class_id is not None:
+            race_filter.append(SavedRaceMeta.class_id == class_id)
+        return race_filter
+
     # Splits
     def get_lapSplits(self):
         return self._Database.LapSplit.query.all()
@@ -3069,7 +3480,7 @@ class RHData():
             settings.option_value = value
         else:
             self._Database.DB.session.add(self._Database.GlobalSettings(option_name=option, option_value=value))
-        self.commit()
+        self.commit(deferred=True)
 
     def get_optionInt(self, option, default_value=0):
         try:
@@ -34,6 +34,7 @@ class RHRace():
         self.start_time_monotonic = 0
         self.start_time_epoch_ms = 0 # ms since 1970-01-01
         self.node_laps = {} # current race lap objects, by node
+        self.node_consecutives = {} # incremental fastest-consecutives state, by node
         self.node_has_finished = {}
         self.any_races_started = False
         # concluded
@@ -44,6 +45,8 @@ class RHRace():
 
         self.results = None # current race results
         self.cacheStatus = None # whether cache is valid
+        self.live_leaderboard = Results.LiveLeaderboard() # incrementally updated results rows
+        self._results_nodes = None # seats with changed laps since results were built, None to rebuild all
         self.status_message = '' # Race status message (winner, team info)
 
         self.team_results = None # current race results
@@ -61,6 +64,9 @@ class RHRace():
         self._seat_colors = []
         self.external_flag = False # is race data controlled externally (from cluster)
 
+        self._pass_snapshot = None # race-scoped lookups for pass records
+        self.pass_latency = PassLatencyStats()
+
         self.clear_results()
 
         '''
@@ -130,6 +136,41 @@ class RHRace():
                                 (lap['deleted'] == False or lap.get('late_lap', False)), self.node_laps[node_index]))
         return filtered
 
+    def get_consecutives(self, node_index, laps, consecutivesCount):
+        '''Returns fastest consecutives (laps, time, lap_index) for a node's timed laps, consuming only new laps'''
+        tracker = self.node_consecutives.get(node_index)
+        if tracker is None or tracker.count != consecutivesCount:
+            tracker = Results.ConsecutivesTracker(consecutivesCount)
+            self.node_consecutives[node_index] = tracker
+        tracker.sync(laps)
+        return tracker.result()
+
+    def clear_consecutives(self, node_index=None):
+        '''Drops incremental consecutives state after laps are edited'''
+        if node_index is None:
+            self.node_consecutives = {}
+        else:
+            self.node_consecutives.pop(node_index, None)
+
+    def build_pass_snapshot(self):
+        '''Builds the seat/pilot/settings lookups used while processing pass records'''
+        self._pass_snapshot = PassSnapshot(self._racecontext.rhdata, self.current_heat, self.profile,
+            self._pass_snapshot_key())
+        return self._pass_snapshot
+
+    def get_pass_snapshot(self):
+        '''Returns the pass snapshot, rebuilt only if heat, pilots, profile or lap settings changed since staging'''
+        snapshot = self._pass_snapshot
+        if snapshot is None or snapshot.key != self._pass_snapshot_key():
+            snapshot = self.build_pass_snapshot()
+        return snapshot
+
+    def _pass_snapshot_key(self):
+        rhdata = self._racecontext.rhdata
+        return (self.current_heat, self.profile,
+            rhdata.get_generation('heat_node', 'pilot', 'profiles'),
+            rhdata.get_option('MinLapSec'), rhdata.get_option('MinLapBehavior'), rhdata.get_option('timeFormat'))
+
     def any_laps_recorded(self):
         for node_index in range(self.num_nodes):
             if len(self.node_laps[node_index]) > 0:
@@ -243,7 +284,12 @@ class RHRace():
 
         # cache rebuild
         # logger.debug('Building current race results')
-        build = Results.calc_leaderboard(self._racecontext.rhdata, current_race=self, current_profile=self.profile)
+        changed_nodes = self._results_nodes
+        self._results_nodes = set()
+        if changed_nodes is None:
+            build = self.live_leaderboard.build(self._racecontext.rhdata, self, self.profile)
+        else:
+            build = self.live_leaderboard.update(self._racecontext.rhdata, self, self.profile, changed_nodes)
         self.set_results(token, build)
         return build
 
@@ -309,6 +355,16 @@ class RHRace():
             'data_ver': token,
             'build_ver': None
         }
+        self._results_nodes = None
+        return True
+
+    def update_results(self, node_index, token=None):
+        '''Invalidates results after laps change on one seat; only that seat's leaderboard row is rebuilt'''
+        changed_nodes = self._results_nodes
+        self.clear_results(token)
+        if changed_nodes is not None:
+            changed_nodes.add(node_index)
+            self._results_nodes = changed_nodes
         return True
 
     def clear_team_results(self, token=None):
@@ -449,6 +505,60 @@ class RHRace():
         else:
             logger.info('Preventing race format change: Race status not READY')
 
+class PassSnapshot():
+    '''Seat, pilot and lap settings for the current race; treat as read-only'''
+    def __init__(self, rhdata, heat_id, profile, key):
+        self.key = key
+        self.heat_id = heat_id
+        self.seat_pilots = {} # pilot id, by seat
+        self.pilots = {} # SnapshotPilot, by pilot id
+        for heatNode in rhdata.get_heatNodes_by_heat(heat_id):
+            if heatNode.node_index is not None:
+                self.seat_pilots[heatNode.node_index] = heatNode.pilot_id
+                if heatNode.pilot_id != RHUtils.PILOT_ID_NONE:
+                    pilot = rhdata.get_pilot(heatNode.pilot_id)
+                    if pilot:
+                        self.pilots[pilot.id] = SnapshotPilot(pilot.id, pilot.callsign, pilot.team)
+        self.seat_frequencies = json.loads(profile.frequencies)['f']
+        self.min_lap = rhdata.get_optionInt('MinLapSec')
+        self.min_lap_behavior = rhdata.get_optionInt('MinLapBehavior')
+        self.time_format = rhdata.get_option('timeFormat')
+
+class SnapshotPilot():
+    def __init__(self, pilot_id, callsign, team):
+        self.id = pilot_id
+        self.callsign = callsign
+        self.team = team
+
+class PassLatencyStats():
+    '''Queue wait and processing times of pass records (ms)'''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.wait_total = 0
+        self.wait_max = 0
+        self.process_total = 0
+        self.process_max = 0
+
+    def add(self, wait_ms, process_ms):
+        self.count += 1
+        self.wait_total += wait_ms
+        self.wait_max = max(self.wait_max, wait_ms)
+        self.process_total += process_ms
+        self.process_max = max(self.process_max, process_ms)
+
+    def summary(self):
+        count = self.count or 1
+        return {
+            'count': self.count,
+            'wait_avg': self.wait_total / count,
+            'wait_max': self.wait_max,
+            'process_avg': self.process_total / count,
+            'process_max': self.process_max,
+        }
+
 class RHRaceFormat():
     def __init__(self, name, unlimited_time, race_time_sec, lap_grace_sec, staging_fixed_tones, start_delay_min_ms, start_delay_max_ms, staging_delay_tones, number_laps_win, win_condition, team_racing_mode, start_behavior, points_method):
         self.name = name
@@ -6,13 +6,16 @@ from typing import List, Any  # @UnusedImport
 from dataclasses import dataclass, asdict  # @UnresolvedImport
 from enum import Enum
 from flask import request
-from flask_socketio import emit
+from flask_socketio import emit, join_room, leave_room, rooms
 from eventmanager import Evt
 import json
 import subprocess
 from collections import OrderedDict
 import gevent
+from monotonic import monotonic
 import RHUtils
+import Results
+import HeartbeatStream
 from RHUtils import catchLogExceptionsWrapper
 from Database import ProgramMethod
 import logging
@@ -76,6 +79,67 @@ class QuickButton():
     fn: callable
     args: dict
 
+# Topic rooms for broadcasts. Clients that subscribe to topics (a list sent
+# with 'subscribe_topics') only receive broadcasts of these events for their
+# topics; other clients stay in the TOPIC_ALL room and receive everything.
+TOPIC_ALL = 'topic_all'
+
+EVENT_TOPICS = {
+    'heartbeat': 'heartbeat',
+    'node_data': 'nodes',
+    'node_crossing_change': 'nodes',
+    'node_enter_at_level': 'nodes',
+    'node_exit_at_level': 'nodes',
+    'enter_and_exit_at_levels': 'nodes',
+    'node_tuning': 'nodes',
+    'environmental_data': 'environment',
+    'cluster_status': 'cluster',
+    'vrx_list': 'vrx',
+    'current_laps': 'race',
+    'leaderboard': 'leaderboard',
+    'leaderboard_update': 'leaderboard',
+    'pilot_data': 'event',
+    'heat_data': 'event',
+    'class_data': 'event',
+    'format_data': 'event',
+    'race_list': 'marshal',
+    'result_data': 'results',
+}
+
+class PayloadJSON():
+    '''JSON module for the socket server.
+
+    Payloads from the RHUI payload cache are registered here and serialized
+    once; every packet carrying one reuses the stored string.
+    '''
+    _serialized = {} # [payload, JSON strings by dumps() arguments], by payload id
+
+    @classmethod
+    def register(cls, payload):
+        cls._serialized[id(payload)] = [payload, {}]
+
+    @classmethod
+    def unregister(cls, payload):
+        entry = cls._serialized.get(id(payload))
+        if entry and entry[0] is payload:
+            del cls._serialized[id(payload)]
+
+    @classmethod
+    def dumps(cls, data, **kwargs):
+        # socket.io event packets are encoded as [event_name, payload]
+        if isinstance(data, list) and len(data) == 2:
+            entry = cls._serialized.get(id(data[1]))
+            if entry and entry[0] is data[1]:
+                options = tuple(sorted(kwargs.items()))
+                if options not in entry[1]:
+                    entry[1][options] = json.dumps(data[1], **kwargs)
+                return '[' + json.dumps(data[0], **kwargs) + ',' + entry[1][options] + ']'
+        return json.dumps(data, **kwargs)
+
+    @staticmethod
+    def loads(*args, **kwargs):
+        return json.loads(*args, **kwargs)
+
 class RHUI():
     # Language placeholder (Overwritten after module init)
     def __(self, *args):
@@ -92,8 +156,55 @@ class RHUI():
         self._general_settings = []
         self._quickbuttons = []
 
+        self._leaderboard_results = None # current race results last sent to clients
+        self._leaderboard_heat = None
+        self._leaderboard_version = 0 # sequence number of current race results sent to clients
+
+        self._heartbeat_stream = HeartbeatStream.HeartbeatStream() # compact heartbeat subscribers
+
+        self._payloads = {} # cached (key, payload), by event name
+        self._pilot_attributes_ver = 0
+
+    # Topic rooms
+    def subscribe_topics(self, sid, topics=None):
+        '''Sets topic rooms of a client; with no topics list, the client receives all broadcasts'''
+        topic_rooms = set(EVENT_TOPICS.values())
+        if topics is None:
+            join_rooms = {TOPIC_ALL}
+        else:
+            join_rooms = topic_rooms.intersection(topics)
+
+        for room in rooms(sid):
+            if (room in topic_rooms or room == TOPIC_ALL) and room not in join_rooms:
+                leave_room(room, sid)
+        for room in join_rooms:
+            join_room(room, sid)
+
+    def broadcast(self, event, payload, **params):
+        '''Emits to all clients subscribed to the event's topic (all clients for events without a topic)'''
+        topic = EVENT_TOPICS.get(event)
+        if topic:
+            self._socket.emit(event, payload, room=[topic, TOPIC_ALL], **params)
+        else:
+            self._socket.emit(event, payload, **params)
+
+    # Payload cache
+    def get_cached_payload(self, name, key, build_fn):
+        '''Returns payload from build_fn, reused (and serialized once) while key is unchanged'''
+        cached = self._payloads.get(name)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        payload = build_fn()
+        if cached:
+            PayloadJSON.unregister(cached[1])
+        PayloadJSON.register(payload)
+        self._payloads[name] = (key, payload)
+        return payload
+
     # Pilot Attributes
     def register_pilot_attribute(self, field:UIField):
+        self._pilot_attributes_ver += 1
         for idx, attribute in enumerate(self._pilot_attributes):
             if attribute.name == field.name:
                 self._pilot_attributes[idx] = field
@@ -328,6 +439,20 @@ class RHUI():
                     'frequency': profile_freqs["f"][n]
                 })
 
+    def emit_heartbeat(self, heartbeat):
+        '''Emits heartbeat as JSON, or as compact binary frames to subscribed clients.'''
+        compact_sids = self._heartbeat_stream.sids
+        self.broadcast('heartbeat', heartbeat, skip_sid=compact_sids if compact_sids else None)
+
+        for sid, frame in self._heartbeat_stream.get_frames(heartbeat, monotonic()):
+            self._socket.emit('heartbeat_compact', frame, room=sid)
+
+    def subscribe_compact_heartbeat(self, sid, rate=None):
+        self._heartbeat_stream.subscribe(sid, rate)
+
+    def unsubscribe_compact_heartbeat(self, sid):
+        self._heartbeat_stream.unsubscribe(sid)
+
     def emit_node_data(self, **params):
         '''Emits node data.'''
         emit_payload = {
@@ -340,7 +465,7 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('node_data', emit_payload)
         else:
-            self._socket.emit('node_data', emit_payload)
+            self.broadcast('node_data', emit_payload)
 
     def emit_environmental_data(self, **params):
         '''Emits environmental data.'''
@@ -351,7 +476,7 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('environmental_data', emit_payload)
         else:
-            self._socket.emit('environmental_data', emit_payload)
+            self.broadcast('environmental_data', emit_payload)
 
     def emit_enter_and_exit_at_levels(self, **params):
         '''Emits enter-at and exit-at levels for nodes.'''
@@ -366,7 +491,7 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('enter_and_exit_at_levels', emit_payload)
         else:
-            self._socket.emit('enter_and_exit_at_levels', emit_payload)
+            self.broadcast('enter_and_exit_at_levels', emit_payload)
 
     def emit_cluster_status(self, **params):
         '''Emits cluster status information.'''
@@ -374,7 +499,7 @@ class RHUI():
             if ('nobroadcast' in params):
                 emit('cluster_status', self._racecontext.cluster.getClusterStatusInfo())
             else:
-                self._socket.emit('cluster_status', self._racecontext.cluster.getClusterStatusInfo())
+                self.broadcast('cluster_status', self._racecontext.cluster.getClusterStatusInfo())
 
     def emit_start_thresh_lower_amount(self, **params):
         '''Emits current start_thresh_lower_amount.'''
@@ -409,7 +534,7 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('node_tuning', emit_payload)
         else:
-            self._socket.emit('node_tuning', emit_payload)
+            self.broadcast('node_tuning', emit_payload)
 
     def emit_language(self, **params):
         '''Emits race status.'''
@@ -423,10 +548,8 @@ class RHUI():
             self._socket.emit('language', emit_payload)
 
     def emit_all_languages(self, **params):
-        '''Emits full language dictionary.'''
-        emit_payload = {
-                'languages': self._racecontext.language.getAllLanguages()
-            }
+        '''Emits full language dictionary (or one language's, with 'language'), as prebuilt JSON.'''
+        emit_payload = self._racecontext.language.getLanguageBundle(params.get('language'))
         if ('nobroadcast' in params):
             emit('all_languages', emit_payload)
         else:
@@ -515,18 +638,23 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('current_laps', emit_payload)
         else:
-            self._socket.emit('current_laps', emit_payload)
+            self.broadcast('current_laps', emit_payload)
 
     def emit_race_list(self, **params):
         '''Emits race listing'''
+        race_data = self._racecontext.rhdata.get_savedRaceData(load_laps=False)
+        races_by_heat = {}
+        for race in sorted(race_data['races'], key=lambda race: race.round_id):
+            races_by_heat.setdefault(race.heat_id, []).append(race)
+
         heats = {}
         for heat in self._racecontext.rhdata.get_heats():
-            if self._racecontext.rhdata.savedRaceMetas_has_heat(heat.id):
+            if heat.id in races_by_heat:
                 rounds = {}
-                for race in self._racecontext.rhdata.get_savedRaceMetas_by_heat(heat.id):
+                for race in races_by_heat[heat.id]:
                     pilotraces = []
-                    for pilotrace in self._racecontext.rhdata.get_savedPilotRaces_by_savedRaceMeta(race.id):
-                        pilot_data = self._racecontext.rhdata.get_pilot(pilotrace.pilot_id)
+                    for pilotrace in race_data['pilotraces'][race.id]:
+                        pilot_data = race_data['pilots'].get(pilotrace.pilot_id)
                         if pilot_data:
                             nodepilot = pilot_data.callsign
                         else:
@@ -561,7 +689,7 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('race_list', emit_payload)
         else:
-            self._socket.emit('race_list', emit_payload)
+            self.broadcast('race_list', emit_payload)
 
     def emit_result_data(self, **params):
         ''' kick off non-blocking thread to generate data'''
@@ -579,7 +707,7 @@ class RHUI():
             if 'nobroadcast' in params and sid != None:
                 emit('result_data', emit_payload, namespace='/', room=sid)
             else:
-                self._socket.emit('result_data', emit_payload, namespace='/')
+                self.broadcast('result_data', emit_payload, namespace='/')
 
     def emit_current_leaderboard(self, **params):
         '''Emits leaderboard.'''
@@ -599,7 +727,14 @@ class RHUI():
         emit_payload['current']['heat'] = self._racecontext.race.current_heat
         emit_payload['current']['status_msg'] = self._racecontext.race.status_message
 
-        emit_payload['current']['leaderboard'] = self._racecontext.race.get_results()
+        results = self._racecontext.race.get_results()
+        if results is not self._leaderboard_results:
+            self._leaderboard_results = results
+            self._leaderboard_heat = self._racecontext.race.current_heat
+            self._leaderboard_version += 1
+
+        emit_payload['current']['leaderboard'] = results
+        emit_payload['current']['version'] = self._leaderboard_version
 
         if self._racecontext.race.format.team_racing_mode:
             emit_payload['current']['team_leaderboard'] = self._racecontext.race.get_team_results()
@@ -627,11 +762,46 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('leaderboard', emit_payload)
         else:
-            self._socket.emit('leaderboard', emit_payload)
+            self.broadcast('leaderboard', emit_payload)
+
+    def emit_current_leaderboard_update(self):
+        '''Emits changes to the current race leaderboard since it was last sent.
+
+        Clients apply the update if 'base' matches the version of their current
+        leaderboard and request the full leaderboard otherwise.
+        '''
+        race = self._racecontext.race
+        previous = self._leaderboard_results
+
+        if previous is None or race.current_heat != self._leaderboard_heat or race.format.team_racing_mode:
+            self.emit_current_leaderboard()
+            return
+
+        results = race.get_results()
+        emit_payload = Results.calc_leaderboard_update(previous, results)
+        emit_payload['base'] = self._leaderboard_version
+        self._leaderboard_results = results
+        self._leaderboard_version += 1
+        emit_payload['version'] = self._leaderboard_version
+        emit_payload['heat'] = race.current_heat
+        emit_payload['status_msg'] = race.status_message
+
+        self.broadcast('leaderboard_update', emit_payload)
 
     def emit_heat_data(self, **params):
         '''Emits heat data.'''
+        rhdata = self._racecontext.rhdata
+        key = (rhdata.get_generation('heat', 'heat_node', 'saved_race_meta'), rhdata.get_option('currentLanguage'))
+        emit_payload = self.get_cached_payload('heat_data', key, self.build_heat_data)
+        if ('nobroadcast' in params):
+            emit('heat_data', emit_payload)
+        elif ('noself' in params):
+            emit('heat_data', emit_payload, broadcast=True, include_self=False)
+        else:
+            self.broadcast('heat_data', emit_payload)
 
+    def build_heat_data(self):
+        '''Builds heat data payload.'''
         heats = []
         for heat in self._racecontext.rhdata.get_heats():
             current_heat = {}
@@ -676,15 +846,23 @@ class RHUI():
         emit_payload = {
             'heats': heats,
         }
+        return emit_payload
+
+    def emit_class_data(self, **params):
+        '''Emits class data.'''
+        rhdata = self._racecontext.rhdata
+        key = (rhdata.get_generation('race_class', 'saved_race_meta'), rhdata.get_option('currentLanguage'),
+            len(self._racecontext.raceclass_rank_manager.methods))
+        emit_payload = self.get_cached_payload('class_data', key, self.build_class_data)
         if ('nobroadcast' in params):
-            emit('heat_data', emit_payload)
+            emit('class_data', emit_payload)
         elif ('noself' in params):
-            emit('heat_data', emit_payload, broadcast=True, include_self=False)
+            emit('class_data', emit_payload, broadcast=True, include_self=False)
         else:
-            self._socket.emit('heat_data', emit_payload)
+            self.broadcast('class_data', emit_payload)
 
-    def emit_class_data(self, **params):
-        '''Emits class data.'''
+    def build_class_data(self):
+        '''Builds class data payload.'''
         current_classes = []
         for race_class in self._racecontext.rhdata.get_raceClasses():
             current_class = {}
@@ -707,15 +885,22 @@ class RHUI():
         emit_payload = {
             'classes': current_classes,
         }
+        return emit_payload
+
+    def emit_format_data(self, **params):
+        '''Emits format data.'''
+        rhdata = self._racecontext.rhdata
+        key = rhdata.get_generation('race_format', 'saved_race_meta')
+        emit_payload = self.get_cached_payload('format_data', key, self.build_format_data)
         if ('nobroadcast' in params):
-            emit('class_data', emit_payload)
+            emit('format_data', emit_payload)
         elif ('noself' in params):
-            emit('class_data', emit_payload, broadcast=True, include_self=False)
+            emit('format_data', emit_payload, broadcast=True, include_self=False)
         else:
-            self._socket.emit('class_data', emit_payload)
+            self.broadcast('format_data', emit_payload)
 
-    def emit_format_data(self, **params):
-        '''Emits format data.'''
+    def build_format_data(self):
+        '''Builds format data payload.'''
         formats = []
         for race_format in self._racecontext.rhdata.get_raceFormats():
             raceformat = {}
@@ -749,15 +934,25 @@ class RHUI():
         emit_payload = {
             'formats': formats,
         }
+        return emit_payload
+
+    def emit_pilot_data(self, **params):
+        '''Emits pilot data.'''
+        rhdata = self._racecontext.rhdata
+        key = (rhdata.get_generation('pilot', 'pilot_attribute', 'saved_pilot_race'), rhdata.get_option('pilotSort'),
+            self._pilot_attributes_ver)
+        emit_payload = self.get_cached_payload('pilot_data', key, self.build_pilot_data)
         if ('nobroadcast' in params):
-            emit('format_data', emit_payload)
+            emit('pilot_data', emit_payload)
         elif ('noself' in params):
-            emit('format_data', emit_payload, broadcast=True, include_self=False)
+            emit('pilot_data', emit_payload, broadcast=True, include_self=False)
         else:
-            self._socket.emit('format_data', emit_payload)
+            self.broadcast('pilot_data', emit_payload)
 
-    def emit_pilot_data(self, **params):
-        '''Emits pilot data.'''
+        self.emit_heat_data()
+
+    def build_pilot_data(self):
+        '''Builds pilot data payload.'''
         pilots_list = []
 
         attrs = []
@@ -806,14 +1001,7 @@ class RHUI():
             'pilotSort': self._racecontext.rhdata.get_option('pilotSort'),
             'attributes': attrs
         }
-        if ('nobroadcast' in params):
-            emit('pilot_data', emit_payload)
-        elif ('noself' in params):
-            emit('pilot_data', emit_payload, broadcast=True, include_self=False)
-        else:
-            self._socket.emit('pilot_data', emit_payload)
-
-        self.emit_heat_data()
+        return emit_payload
 
     def emit_current_heat(self, **params):
         '''Emits the current heat.'''
@@ -1004,7 +1192,7 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('node_enter_at_level', emit_payload)
         else:
-            self._socket.emit('node_enter_at_level', emit_payload)
+            self.broadcast('node_enter_at_level', emit_payload)
 
     def emit_exit_at_level(self, node, **params):
         '''Emits exit-at level for given node.'''
@@ -1015,7 +1203,7 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('node_exit_at_level', emit_payload)
         else:
-            self._socket.emit('node_exit_at_level', emit_payload)
+            self.broadcast('node_exit_at_level', emit_payload)
 
     def emit_node_crossing_change(self, node, **params):
         '''Emits crossing-flag change for given node.'''
@@ -1026,7 +1214,7 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('node_crossing_change', emit_payload)
         else:
-            self._socket.emit('node_crossing_change', emit_payload)
+            self.broadcast('node_crossing_change', emit_payload)
 
     def emit_cluster_connect_change(self, connect_flag, **params):
         '''Emits connect/disconnect tone for cluster timer.'''
@@ -1141,7 +1329,7 @@ class RHUI():
         if ('nobroadcast' in params):
             emit('vrx_list', emit_payload)
         else:
-            self._socket.emit('vrx_list', emit_payload)
+            self.broadcast('vrx_list', emit_payload)
 
     def emit_exporter_list(self):
         '''List Database Exporters'''
@@ -12,6 +12,7 @@ import glob
 import socket
 import random
 import json
+import functools
 
 logger = logging.getLogger(__name__)
 
@@ -395,136 +396,191 @@ def getFastestSpeedStr(rhapi, spoken_flag, sel_pilot_id=None):
                         fastest_str = "{} {}".format(pilot_obj.callsign, fastest_split.split_speed)
     return fastest_str
 
+# Callout text is compiled once into literal text and %TOKEN% placeholders; each
+#  use resolves only the tokens present, through a CalloutContext for the event.
+CALLOUT_TOKEN_PATTERN = re.compile(r'%([A-Z_]+)%')
+
+class CalloutTemplate:
+    """ Callout text split into literal text (even indices) and token names (odd indices) """
+    def __init__(self, text):
+        self.parts = CALLOUT_TOKEN_PATTERN.split(text)
+        self.tokens = frozenset(self.parts[1::2])
+
+    def render(self, context):
+        parts = list(self.parts)
+        for index in range(1, len(parts), 2):
+            value = context.resolve(parts[index])
+            # unresolved tokens are left in place
+            parts[index] = '%' + parts[index] + '%' if value is None else value
+        return ''.join(parts)
+
+@functools.lru_cache(maxsize=256)
+def compileCallout(text):
+    return CalloutTemplate(text)
+
+@functools.lru_cache(maxsize=1024)
+def cachedPhonetictime(millis, timeformat):
+    return phonetictime_format(millis, timeformat)
+
+_seatResultsCache = [None, None]  # [race results, {node index: leaderboard row}]
+
+def getSeatResult(race_results, node_index):
+    '''Returns the primary-leaderboard row for the given seat, indexed once per set of results'''
+    if _seatResultsCache[0] is not race_results:
+        lboard_name = race_results.get('meta', {}).get('primary_leaderboard', '')
+        seat_results = {}
+        for result in race_results.get(lboard_name, []):
+            seat_results.setdefault(result['node'], result)
+        _seatResultsCache[1] = seat_results
+        _seatResultsCache[0] = race_results
+    return _seatResultsCache[1].get(node_index)
+
+class CalloutContext:
+    """ Resolves callout tokens for one event, looking up data only as needed """
+    def __init__(self, rhapi, args, spoken_flag=False):
+        self.rhapi = rhapi
+        self.args = args
+        self.spoken_flag = spoken_flag
+        self._values = {}
+        self._race_results = None
+        self._time_format = None
+
+    def resolve(self, token):
+        if token not in self._values:
+            resolver = self.RESOLVERS.get(token)
+            self._values[token] = resolver(self) if resolver else None
+        return self._values[token]
+
+    @property
+    def race_results(self):
+        if self._race_results is None:
+            self._race_results = self.rhapi.race.results
+        return self._race_results
+
+    @property
+    def time_format(self):
+        if self._time_format is None:
+            self._time_format = self.rhapi.db.option('timeFormatPhonetic')
+        return self._time_format
+
+    def seat_result(self):
+        if 'node_index' in self.args:
+            return getSeatResult(self.race_results, self.args['node_index'])
+        return None
+
+    def callsign(self, pilot):
+        return pilot.spoken_callsign if self.spoken_flag else pilot.display_callsign
+
+    def heat(self):
+        if 'heat_id' in self.args:
+            heat = self.rhapi.db.heat_by_id(self.args['heat_id'])
+        else:
+            heat = self.rhapi.db.heat_by_id(self.rhapi.race.heat)
+        return heat.display_name if heat and heat.display_name else self.rhapi.__('None')
+
+    def pilot(self):
+        if 'pilot_id' in self.args:
+            pilot = self.rhapi.db.pilot_by_id(self.args['pilot_id'])
+        elif 'node_index' in self.args:
+            pilot = self.rhapi.db.pilot_by_id(self.rhapi.race.pilots[self.args['node_index']])
+        else:
+            return None
+        return self.callsign(pilot) if pilot else None
+
+    def result_field(self, field):
+        result = self.seat_result()
+        if result is None:
+            return None
+        return str(result[field])
+
+    def result_time(self, field):
+        result = self.seat_result()
+        if result is None:
+            return None
+        if self.spoken_flag:
+            return cachedPhonetictime(result[field + '_raw'], self.time_format)
+        return result[field]
+
+    def fastest_speed(self):
+        result = self.seat_result()
+        if result is None:
+            return None
+        return getFastestSpeedStr(self.rhapi, self.spoken_flag, result.get('pilot_id'))
+
+    def consecutive(self):
+        result = self.seat_result()
+        if result is None:
+            return None
+        if result['consecutives_base'] == int(self.rhapi.db.option('consecutivesCount', 3)):
+            return self.result_time('consecutives')
+        return self.rhapi.__('None')
+
+    def fastest_race_lap(self):
+        fastest_race_lap_data = self.race_results.get('meta', {}).get('fastest_race_lap_data')
+        if fastest_race_lap_data:
+            if self.spoken_flag:
+                return "{}, {}".format(fastest_race_lap_data['phonetic'][0],  # pilot name
+                                       fastest_race_lap_data['phonetic'][1])  # lap time
+            return "{} {}".format(fastest_race_lap_data['text'][0],  # pilot name
+                                  fastest_race_lap_data['text'][1])  # lap time
+        return ""
+
+    def fastest_race_speed(self):
+        return getFastestSpeedStr(self.rhapi, self.spoken_flag)
+
+    def winner(self):
+        return self.rhapi.race.race_winner_phonetic if self.spoken_flag else self.rhapi.race.race_winner_name
+
+    def leader(self):
+        lboard_name = self.race_results.get('meta', {}).get('primary_leaderboard', '')
+        leaderboard = self.race_results.get(lboard_name, [])
+        if len(leaderboard) > 1:
+            result = leaderboard[0]
+            if 'pilot_id' in result and result.get('laps', 0) > 0:
+                pilot = self.rhapi.db.pilot_by_id(result['pilot_id'])
+                if pilot:
+                    return self.callsign(pilot)
+        return ""
+
+    def with_prompt(self, token, prompt, name_first=False):
+        value = self.resolve(token)
+        if not value:
+            return value
+        if name_first:
+            return "{} {}".format(value, self.rhapi.__(prompt))
+        return "{} {}".format(self.rhapi.__(prompt), value)
+
+    RESOLVERS = {
+        'HEAT': heat,
+        'PILOT': pilot,
+        'LAP_COUNT': lambda self: self.result_field('laps'),
+        'TOTAL_TIME': lambda self: self.result_time('total_time'),
+        'TOTAL_TIME_LAPS': lambda self: self.result_time('total_time_laps'),
+        'LAST_LAP': lambda self: self.result_time('last_lap'),
+        'AVERAGE_LAP': lambda self: self.result_time('average_lap'),
+        'FASTEST_LAP': lambda self: self.result_time('fastest_lap'),
+        'FASTEST_SPEED': fastest_speed,
+        'CONSECUTIVE': consecutive,
+        'POSITION': lambda self: self.result_field('position'),
+        'FASTEST_RACE_LAP': fastest_race_lap,
+        'FASTEST_RACE_LAP_CALL': lambda self: self.with_prompt('FASTEST_RACE_LAP', 'Fastest lap time'),
+        'FASTEST_RACE_SPEED': fastest_race_speed,
+        'FASTEST_RACE_SPEED_CALL': lambda self: self.with_prompt('FASTEST_RACE_SPEED', 'Fastest speed'),
+        'WINNER': winner,
+        'WINNER_CALL': lambda self: self.with_prompt('WINNER', 'Winner is'),
+        'PILOTS': lambda self: getPilotsListStr(self.rhapi, ' . ', self.spoken_flag),
+        'LINEUP': lambda self: getPilotsListStr(self.rhapi, ' , ', self.spoken_flag),
+        'FREQS': lambda self: getPilotFreqsStr(self.rhapi, ' . ', self.spoken_flag),
+        'LEADER': leader,
+        'LEADER_CALL': lambda self: self.with_prompt('LEADER', 'is leading', name_first=True),
+    }
+
 # Text replacer
 def doReplace(rhapi, text, args, spoken_flag=False):
     if '%' in text:
-        # %HEAT%
-        if 'heat_id' in args:
-            heat = rhapi.db.heat_by_id(args['heat_id'])
-        else:
-            heat = rhapi.db.heat_by_id(rhapi.race.heat)
-        text = text.replace('%HEAT%', heat.display_name if heat and heat.display_name else rhapi.__('None'))
-
-        if 'pilot_id' in args or 'node_index' in args:
-            if 'pilot_id' in args:
-                pilot = rhapi.db.pilot_by_id(args['pilot_id'])
-            else:
-                pilot = rhapi.db.pilot_by_id(rhapi.race.pilots[args['node_index']])
-            text = text.replace('%PILOT%', pilot.spoken_callsign if spoken_flag else pilot.display_callsign)
-
-        race_results = rhapi.race.results
-        leaderboard = None
-        if 'node_index' in args and '%' in text:
-            lboard_name = race_results.get('meta', {}).get('primary_leaderboard', '')
-            leaderboard = race_results.get(lboard_name, [])
-
-            for result in leaderboard:
-                if result['node'] == args['node_index']:
-                    # %LAP_COUNT%
-                    text = text.replace('%LAP_COUNT%', str(result['laps']))
-
-                    # %TOTAL_TIME%
-                    text = text.replace('%TOTAL_TIME%', phonetictime_format( \
-                                result['total_time_raw'], rhapi.db.option('timeFormatPhonetic')) \
-                                if spoken_flag else result['total_time'])
-
-                    # %TOTAL_TIME_LAPS%
-                    text = text.replace('%TOTAL_TIME_LAPS%', phonetictime_format( \
-                                result['total_time_laps_raw'], rhapi.db.option('timeFormatPhonetic')) \
-                                if spoken_flag else result['total_time_laps'])
-
-                    # %LAST_LAP%
-                    text = text.replace('%LAST_LAP%', phonetictime_format( \
-                                result['last_lap_raw'], rhapi.db.option('timeFormatPhonetic')) \
-                                if spoken_flag else result['last_lap'])
-
-                    # %AVERAGE_LAP%
-                    text = text.replace('%AVERAGE_LAP%', phonetictime_format( \
-                                result['average_lap_raw'], rhapi.db.option('timeFormatPhonetic')) \
-                                if spoken_flag else result['average_lap'])
-
-                    # %FASTEST_LAP%
-                    text = text.replace('%FASTEST_LAP%', phonetictime_format( \
-                                result['fastest_lap_raw'], rhapi.db.option('timeFormatPhonetic')) \
-                                if spoken_flag else result['fastest_lap'])
-
-                    # %FASTEST_SPEED%
-                    text = text.replace('%FASTEST_SPEED%', getFastestSpeedStr(rhapi, spoken_flag, \
-                                                                              result.get('pilot_id')))
-
-                    # %CONSECUTIVE%
-                    if result['consecutives_base'] == int(rhapi.db.option('consecutivesCount', 3)):
-                        text = text.replace('%CONSECUTIVE%', phonetictime_format( \
-                                result['consecutives_raw'], rhapi.db.option('timeFormatPhonetic')) \
-                                if spoken_flag else result['consecutives'])
-                    else:
-                        text = text.replace('%CONSECUTIVE%', rhapi.__('None'))
-
-                    # %POSITION%
-                    text = text.replace('%POSITION%', str(result['position']))
-
-                    break
-
-        if '%FASTEST_RACE_LAP' in text:
-            fastest_race_lap_data = race_results.get('meta', {}).get('fastest_race_lap_data')
-            if fastest_race_lap_data:
-                if spoken_flag:
-                    fastest_str = "{}, {}".format(fastest_race_lap_data['phonetic'][0],  # pilot name
-                                                  fastest_race_lap_data['phonetic'][1])  # lap time
-                else:
-                    fastest_str = "{} {}".format(fastest_race_lap_data['text'][0],  # pilot name
-                                                 fastest_race_lap_data['text'][1])  # lap time
-            else:
-                fastest_str = ""
-            # %FASTEST_RACE_LAP% : Pilot/time for fastest lap in race
-            text = text.replace('%FASTEST_RACE_LAP%', fastest_str)
-            # %FASTEST_RACE_LAP_CALL% : Pilot/time for fastest lap in race (with prompt)
-            if len(fastest_str) > 0:
-                fastest_str = "{} {}".format(rhapi.__('Fastest lap time'), fastest_str)
-            text = text.replace('%FASTEST_RACE_LAP_CALL%', fastest_str)
-
-        if '%FASTEST_RACE_SPEED' in text:
-            fastest_str = getFastestSpeedStr(rhapi, spoken_flag)
-            # %FASTEST_RACE_SPEED% : Pilot/speed for fastest speed in race
-            text = text.replace('%FASTEST_RACE_SPEED%', fastest_str)
-            # %FASTEST_RACE_SPEED_CALL% : Pilot/speed for fastest speed in race (with prompt)
-            if len(fastest_str) > 0:
-                fastest_str = "{} {}".format(rhapi.__('Fastest speed'), fastest_str)
-            text = text.replace('%FASTEST_RACE_SPEED_CALL%', fastest_str)
-
-        if '%WINNER' in text:
-            winner_str = rhapi.race.race_winner_phonetic if spoken_flag else rhapi.race.race_winner_name
-            # %WINNER% : Pilot callsign for winner of race
-            text = text.replace('%WINNER%', winner_str)
-            # %WINNER_CALL% : Pilot callsign for winner of race (with prompt)
-            if len(winner_str) > 0:
-                winner_str = "{} {}".format(rhapi.__('Winner is'), winner_str)
-            text = text.replace('%WINNER_CALL%', winner_str)
-
-        if '%PILOTS%' in text:
-            text = text.replace('%PILOTS%', getPilotsListStr(rhapi, ' . ', spoken_flag))
-        if '%LINEUP%' in text:
-            text = text.replace('%LINEUP%', getPilotsListStr(rhapi, ' , ', spoken_flag))
-        if '%FREQS%' in text:
-            text = text.replace('%FREQS%', getPilotFreqsStr(rhapi, ' . ', spoken_flag))
-
-        if '%LEADER' in text:
-            if not leaderboard:
-                lboard_name = race_results.get('meta', {}).get('primary_leaderboard', '')
-                leaderboard = race_results.get(lboard_name, [])
-            name_str = ""
-            if len(leaderboard) > 1:
-                result = leaderboard[0]
-                if 'pilot_id' in result and result.get('laps', 0) > 0:
-                    pilot = rhapi.db.pilot_by_id(result['pilot_id'])
-                    name_str = pilot.spoken_callsign if spoken_flag else pilot.display_callsign
-            # %LEADER% : Callsign of pilot currently leading race
-            text = text.replace('%LEADER%', name_str)
-            if len(name_str) > 0:
-                name_str = "{} {}".format(name_str, rhapi.__('is leading'))
-            # %LEADER_CALL% : Callsign of pilot currently leading race, in the form "NAME is leading"
-            text = text.replace('%LEADER_CALL%', name_str)
-
+        template = compileCallout(text)
+        if template.tokens:
+            text = template.render(CalloutContext(rhapi, args, spoken_flag))
     return text
 
 def heatNodeSorter( x):
@@ -14,6 +14,11 @@ import logging
 from monotonic import monotonic
 from RHRace import RaceStatus, StartBehavior, WinCondition, WinStatus
 
+try:
+    import numpy as np
+except ImportError:
+    np = None # columnar leaderboard engine unavailable; saved results use the per-pilot loop
+
 logger = logging.getLogger(__name__)
 
 class RaceClassRankManager():
@@ -171,6 +176,59 @@ def build_atomic_results(rhDataObj, params):
 
     logger.debug('Built result caches in {0}'.format(monotonic() - timing['start']))
 
+def calc_consecutives(lap_times, consecutivesCount):
+    '''
+    Finds the fastest run of consecutivesCount laps with a sliding window sum.
+    Returns (laps, time, lap_index); with fewer laps than consecutivesCount
+    all laps are summed and lap_index is None.
+    '''
+    tracker = ConsecutivesTracker(consecutivesCount)
+    for lap_time in lap_times:
+        tracker.append(lap_time)
+    return tracker.result()
+
+class ConsecutivesTracker():
+    '''Fastest-consecutives state for one pilot, updated in O(1) per appended lap'''
+    def __init__(self, consecutivesCount):
+        self.count = consecutivesCount
+        self.lap_times = []
+        self.total = 0 # sum of all laps
+        self.window = 0 # sum of last [count] laps
+        self.best_time = None
+        self.best_index = None
+        self._last_lap = None # last lap object consumed by sync
+
+    def append(self, lap_time):
+        self.lap_times.append(lap_time)
+        self.total += lap_time
+        self.window += lap_time
+        if len(self.lap_times) > self.count:
+            self.window -= self.lap_times[-self.count - 1]
+
+        if len(self.lap_times) >= self.count:
+            # same ordering as the leaderboard sort: zero times last, then fastest, first found wins
+            if self.best_time is None or \
+                (not self.window, self.window) < (not self.best_time, self.best_time):
+                self.best_time = self.window
+                self.best_index = len(self.lap_times) - self.count + 1
+
+    def sync(self, laps):
+        '''Consumes new lap objects; rebuilds if laps already consumed have changed'''
+        consumed = len(self.lap_times)
+        if consumed and (len(laps) < consumed or laps[consumed - 1] is not self._last_lap \
+                or laps[consumed - 1]['lap_time'] != self.lap_times[-1]):
+            self.__init__(self.count)
+            consumed = 0
+
+        for lap in laps[consumed:]:
+            self.append(lap['lap_time'])
+            self._last_lap = lap
+
+    def result(self):
+        if self.best_index is not None:
+            return self.count, self.best_time, self.best_index
+        return len(self.lap_times), self.total, None
+
 def calc_leaderboard(rhDataObj, **params):
     ''' Generates leaderboards '''
     meta_points_flag = False
@@ -178,9 +236,9 @@ def calc_leaderboard(rhDataObj, **params):
     USE_ROUND = None
     USE_HEAT = None
     USE_CLASS = None
+    USE_COLUMNAR = False
 
     selected_race_laps = []
-    timeFormat = rhDataObj.get_option('timeFormat')
     consecutivesCount = rhDataObj.get_optionInt('consecutivesCount', 3)
 
     if ('current_race' in params):
@@ -202,18 +260,28 @@ def calc_leaderboard(rhDataObj, **params):
         raceObj = params['current_race']
         race_format = raceObj.format
     else:
+        # the columnar engine reads lap columns directly instead of lap objects
+        if np is not None and consecutivesCount > 0:
+            USE_COLUMNAR = True
+
         if USE_CLASS:
-            selected_races = rhDataObj.get_savedRaceMetas_by_raceClass(USE_CLASS)
+            race_scope = {'class_id': USE_CLASS}
+            race_data = rhDataObj.get_savedRaceData(active_laps=True, load_laps=not USE_COLUMNAR, **race_scope)
+            selected_races = race_data['races']
             if len(selected_races) >= 1:
                 current_format = rhDataObj.get_raceClass(USE_CLASS).format_id
             else:
                 current_format = None
         elif USE_HEAT:
             if USE_ROUND:
-                selected_races = [rhDataObj.get_savedRaceMeta_by_heat_round(USE_HEAT, USE_ROUND)]
+                race_scope = {'heat_id': USE_HEAT, 'round_id': USE_ROUND}
+                race_data = rhDataObj.get_savedRaceData(active_laps=True, load_laps=not USE_COLUMNAR, **race_scope)
+                selected_races = race_data['races']
                 current_format = selected_races[0].format_id
             else:
-                selected_races = rhDataObj.get_savedRaceMetas_by_heat(USE_HEAT)
+                race_scope = {'heat_id': USE_HEAT}
+                race_data = rhDataObj.get_savedRaceData(active_laps=True, load_laps=not USE_COLUMNAR, **race_scope)
+                selected_races = race_data['races']
                 if len(selected_races) >= 1:
                     heat_class = selected_races[0].class_id
                     if heat_class:
@@ -223,18 +291,20 @@ def calc_leaderboard(rhDataObj, **params):
                 else:
                     current_format = None
         else:
-            selected_races = rhDataObj.get_savedRaceMetas()
+            race_scope = {}
+            race_data = rhDataObj.get_savedRaceData(active_laps=True, load_laps=not USE_COLUMNAR, **race_scope)
+            selected_races = race_data['races']
             current_format = None
 
         selected_races_keyed = {}
         for race in selected_races:
             selected_races_keyed[race.id] = race
 
-        selected_pilotraces = {}
-        racelist = []
-        for race in selected_races:
-            racelist.append(race.id)
-            selected_pilotraces[race.id] = rhDataObj.get_savedPilotRaces_by_savedRaceMeta(race.id)
+        selected_pilotraces = race_data['pilotraces']
+        # laps are evaluated in saved (id) order
+        selected_race_laps = {}
+        for pilotrace_id, pilotrace_laps in race_data['laps'].items():
+            selected_race_laps[pilotrace_id] = sorted(pilotrace_laps, key=lambda lap: lap.id)
 
         # Generate heat list with key
         heats_keyed = {}
@@ -247,204 +317,137 @@ def calc_leaderboard(rhDataObj, **params):
         else:
             race_format = None
 
-        # filter laps
-        all_laps = rhDataObj.get_active_savedRaceLaps()
-        for lap in all_laps:
-            if lap.race_id in racelist:
-                selected_race_laps.append(lap)
+        # fetch (cached) race results once for points totals
+        race_results = {}
+        if not USE_ROUND:
+            for race in selected_races:
+                race_results[race.id] = rhDataObj.get_results_savedRaceMeta(race)
+
+        if USE_COLUMNAR:
+            lap_columns = rhDataObj.get_savedRaceLapColumns(active_laps=True, **race_scope)
+        else:
+            # group laps by pilot
+            pilot_race_laps = {}
+            for pilotrace_laps in selected_race_laps.values():
+                for lap in pilotrace_laps:
+                    pilot_race_laps.setdefault(lap.pilot_id, []).append(lap)
+            for pilot_laps in pilot_race_laps.values():
+                pilot_laps.sort(key=lambda lap: lap.id)
 
     gevent.sleep()
 
     leaderboard = []
 
-    if USE_CURRENT and raceObj.current_heat == RHUtils.HEAT_ID_NONE:
-        for node_index in range(raceObj.num_nodes):
-            if node_index < raceObj.num_nodes and len(raceObj.get_active_laps()):
-                laps = raceObj.get_active_laps()[node_index]
+    if USE_CURRENT:
+        leaderboard = build_current_rows(rhDataObj, raceObj, race_format, profile_freqs)
+    elif USE_COLUMNAR:
+        leaderboard, meta_points_flag = calc_pilot_results_columnar(rhDataObj, race_data, lap_columns,
+            race_format, race_results, heats_keyed, consecutivesCount)
+    else:
+        for pilot in race_data['pilots'].values():
+            gevent.sleep()
+            # find hole shots
+            holeshot_laps = []
+            pilotnode = None
+            total_laps = 0
+            race_starts = 0
+            total_points = 0
+
+            pilot_crossings = pilot_race_laps.get(pilot.id, [])
 
-            if laps:
-                if race_format and race_format.start_behavior == StartBehavior.FIRST_LAP:
-                    total_laps = len(laps)
+            for race in selected_races:
+                if race_format:
+                    this_race_format = race_format
                 else:
-                    total_laps = len(laps) - 1
-            else:
-                total_laps = 0
+                    this_race_format = rhDataObj.get_raceFormat(race.format_id)
 
-            if (profile_freqs["b"][node_index] and profile_freqs["c"][node_index]):
-                callsign = profile_freqs["b"][node_index] + str(profile_freqs["c"][node_index])
+                for pilotrace in selected_pilotraces[race.id]:
+                    if pilotrace.pilot_id == pilot.id:
+                        pilotnode = pilotrace.node_index
+                        gevent.sleep()
+
+                        race_laps = []
+                        for lap in selected_race_laps[pilotrace.id]:
+                            if lap.pilot_id == pilot.id:
+                                race_laps.append(lap)
+
+                        total_laps += len(race_laps)
+
+                        if this_race_format and this_race_format.start_behavior == StartBehavior.FIRST_LAP:
+                            if len(race_laps):
+                                race_starts += 1
+                        else:
+                            if len(race_laps):
+                                holeshot_lap = race_laps[0]
+
+                                if holeshot_lap:
+                                    holeshot_laps.append(holeshot_lap.id)
+                                    race_starts += 1
+                                    total_laps -= 1
+
+                if not USE_ROUND:
+                    results = race_results[race.id]
+                    for line in results[results['meta']['primary_leaderboard']]:
+                        if line['pilot_id'] == pilot.id: 
+                            total_points += line['points']
+                            break
+                    if total_points:
+                        meta_points_flag = True 
+
+            if len(holeshot_laps):
+                holeshot_ids = set(holeshot_laps)
+                pilot_laps = []
+                for lap in pilot_crossings:
+                    if lap.id not in holeshot_ids:
+                        pilot_laps.append(lap)
             else:
-                callsign = str(profile_freqs["f"][node_index])
+                pilot_laps = pilot_crossings
 
-            if profile_freqs["f"][node_index] != RHUtils.FREQUENCY_ID_NONE:
+            if race_starts > 0:
                 leaderboard.append({
-                    'pilot_id': None,
-                    'callsign': callsign,
-                    'team_name': None,
+                    'pilot_id': pilot.id,
+                    'callsign': pilot.callsign,
+                    'team_name': pilot.team,
                     'laps': total_laps,
-                    'holeshots': None,
-                    'starts': 1 if len(laps) > 0 else 0,
-                    'node': node_index,
-                    'current_laps': laps
+                    'holeshots': holeshot_laps,
+                    'starts': race_starts,
+                    'node': pilotnode,
+                    'pilot_crossings': pilot_crossings,
+                    'pilot_laps': pilot_laps,
+                    'points': total_points
                 })
-    else:
-        for pilot in rhDataObj.get_pilots():
-            gevent.sleep()
-            if USE_CURRENT:
-                found_pilot = False
-                node_index = 0
-                laps = []
-                for node_index in raceObj.node_pilots:
-                    if raceObj.node_pilots[node_index] == pilot.id and node_index < raceObj.num_nodes and len(raceObj.get_active_laps()):
-                        laps = raceObj.get_active_laps()[node_index]
-                        found_pilot = True
-                        break
-
-                if laps:
-                    if race_format and race_format.start_behavior == StartBehavior.FIRST_LAP:
-                        total_laps = len(laps)
-                    else:
-                        total_laps = len(laps) - 1
-                else:
-                    total_laps = 0
-
-                if found_pilot and profile_freqs["f"][node_index] != RHUtils.FREQUENCY_ID_NONE:
-                    leaderboard.append({
-                        'pilot_id': pilot.id,
-                        'callsign': pilot.callsign,
-                        'team_name': pilot.team,
-                        'laps': total_laps,
-                        'holeshots': None,
-                        'starts': 1 if len(laps) > 0 else 0,
-                        'node': node_index,
-                        'current_laps': laps
-                    })
-            else:
-                # find hole shots
-                holeshot_laps = []
-                pilotnode = None
-                total_laps = 0
-                race_starts = 0
-                total_points = 0
-
-                for race in selected_races:
-                    if race_format:
-                        this_race_format = race_format
-                    else:
-                        this_race_format = rhDataObj.get_raceFormat(race.format_id)
-
-                    pilotraces = selected_pilotraces[race.id]
 
-                    if len(pilotraces):
-                        pilot_crossings = []
-                        for lap in selected_race_laps:
-                            if lap.pilot_id == pilot.id:
-                                pilot_crossings.append(lap)
-
-                        for pilotrace in pilotraces:
-                            if pilotrace.pilot_id == pilot.id:
-                                pilotnode = pilotrace.node_index
-                                gevent.sleep()
-
-                                race_laps = []
-                                for lap in pilot_crossings:
-                                    if lap.pilotrace_id == pilotrace.id:
-                                        race_laps.append(lap) 
-
-                                total_laps += len(race_laps)
-
-                                if this_race_format and this_race_format.start_behavior == StartBehavior.FIRST_LAP:
-                                    if len(race_laps):
-                                        race_starts += 1
-                                else:
-                                    if len(race_laps):
-                                        holeshot_lap = race_laps[0]
-
-                                        if holeshot_lap:
-                                            holeshot_laps.append(holeshot_lap.id)
-                                            race_starts += 1
-                                            total_laps -= 1
-
-                        pilot_laps = []
-                        if len(holeshot_laps):
-                            for lap in selected_race_laps:
-                                if lap.pilot_id == pilot.id and \
-                                    lap.id not in holeshot_laps:
-                                    pilot_laps.append(lap)
-                        else:
-                            pilot_laps = pilot_crossings
-
-                    if not USE_ROUND:
-                        results = rhDataObj.get_results_savedRaceMeta(race)
-                        for line in results[results['meta']['primary_leaderboard']]:
-                            if line['pilot_id'] == pilot.id: 
-                                total_points += line['points']
-                                break
-                        if total_points:
-                            meta_points_flag = True 
-
-                if race_starts > 0:
-                    leaderboard.append({
-                        'pilot_id': pilot.id,
-                        'callsign': pilot.callsign,
-                        'team_name': pilot.team,
-                        'laps': total_laps,
-                        'holeshots': holeshot_laps,
-                        'starts': race_starts,
-                        'node': pilotnode,
-                        'pilot_crossings': pilot_crossings,
-                        'pilot_laps': pilot_laps,
-                        'points': total_points
-                    })
+    if USE_CURRENT:
+        leaderboard_stats = []
+        for result_pilot in leaderboard:
+            gevent.sleep()
+            calc_current_row_stats(result_pilot, raceObj, race_format, consecutivesCount)
+    elif USE_COLUMNAR:
+        leaderboard_stats = []  # per-pilot stats already computed by the columnar engine
+    else:
+        leaderboard_stats = leaderboard
 
-    for result_pilot in leaderboard:
+    for result_pilot in leaderboard_stats:
         gevent.sleep()
 
         # Get the total race time for each pilot
-        if USE_CURRENT:
-            race_total = 0
-            laps_total = 0
-            for lap in result_pilot['current_laps']:
-                race_total += lap['lap_time']
-                if lap['lap_number']:
-                    laps_total += lap['lap_time']
+        result_pilot['total_time'] = 0
+        for lap in result_pilot['pilot_crossings']:
+            result_pilot['total_time'] += lap.lap_time
 
-            result_pilot['total_time'] = race_total
-            result_pilot['total_time_laps'] = laps_total
+        result_pilot['total_time_laps'] = 0
+        for lap in result_pilot['pilot_laps']:
+            result_pilot['total_time_laps'] += lap.lap_time
 
-        else:
-            result_pilot['total_time'] = 0
-            for lap in result_pilot['pilot_crossings']:
-                result_pilot['total_time'] += lap.lap_time
-
-            result_pilot['total_time_laps'] = 0
-            for lap in result_pilot['pilot_laps']:
-                result_pilot['total_time_laps'] += lap.lap_time
-
-        gevent.sleep()
-        # Get the last lap for each pilot (current race only)
-        if result_pilot['laps'] == 0:
-            result_pilot['last_lap'] = None # Add zero if no laps completed
-        else:
-            if USE_CURRENT:
-                result_pilot['last_lap'] = result_pilot['current_laps'][-1]['lap_time']
-            else:
-                result_pilot['last_lap'] = None
+        # Last lap applies to the current race only
+        result_pilot['last_lap'] = None
 
         gevent.sleep()
         # Get the average lap time for each pilot
         if result_pilot['laps'] == 0:
             result_pilot['average_lap'] = 0 # Add zero if no laps completed
         else:
-            if USE_CURRENT:
-                if race_format and race_format.start_behavior == StartBehavior.FIRST_LAP:
-                    avg_lap = result_pilot['current_laps'][-1]['lap_time_stamp'] / len(result_pilot['current_laps'])
-                else:
-                    avg_lap = (result_pilot['current_laps'][-1]['lap_time_stamp'] - result_pilot['current_laps'][0]['lap_time_stamp']) / (len(result_pilot['current_laps']) - 1)
-
-            else:
-                avg_lap = result_pilot['total_time_laps'] / result_pilot['laps']
-
-            result_pilot['average_lap'] = avg_lap
+            result_pilot['average_lap'] = result_pilot['total_time_laps'] / result_pilot['laps']
 
         gevent.sleep()
         # Get the fastest lap time for each pilot
@@ -452,91 +455,46 @@ def calc_leaderboard(rhDataObj, **params):
             result_pilot['fastest_lap'] = 0 # Add zero if no laps completed
             result_pilot['fastest_lap_source'] = None
         else:
-            if USE_CURRENT:
-                if race_format and race_format.start_behavior == StartBehavior.FIRST_LAP:
-                    timed_laps = result_pilot['current_laps']
-                else:
-                    timed_laps = filter(lambda x : x['lap_number'], result_pilot['current_laps'])
+            fast_lap = None
 
-                fast_lap = sorted(timed_laps, key=lambda val : val['lap_time'])[0]['lap_time']
-                result_pilot['fastest_lap'] = fast_lap
-                result_pilot['fastest_lap_source'] = None
-            else:
-                fast_lap = None
-
-                for lap in result_pilot['pilot_laps']:
-                    if fast_lap:
-                        if lap.lap_time <= fast_lap.lap_time:
-                            fast_lap = lap
-                    else:
+            for lap in result_pilot['pilot_laps']:
+                if fast_lap:
+                    if lap.lap_time <= fast_lap.lap_time:
                         fast_lap = lap
+                else:
+                    fast_lap = lap
+
+            race = selected_races_keyed.get(fast_lap.race_id)
+            if race:
+                result_pilot['fastest_lap_source'] = {
+                    'round': race.round_id,
+                    'heat': race.heat_id,
+                    'displayname': heats_keyed[race.heat_id].display_name
+                    }
 
-                for race in selected_races:
-                    if race.id == fast_lap.race_id:
-                        result_pilot['fastest_lap_source'] = {
-                            'round': race.round_id,
-                            'heat': race.heat_id,
-                            'displayname': heats_keyed[race.heat_id].display_name
-                            }
-                        break
-
-                result_pilot['fastest_lap'] = fast_lap.lap_time
+            result_pilot['fastest_lap'] = fast_lap.lap_time
 
         gevent.sleep()
         # find best consecutive X laps
         all_consecutives = []
 
-        if USE_CURRENT:
-            if race_format and race_format.start_behavior == StartBehavior.FIRST_LAP:
-                thisrace = result_pilot['current_laps']
-            else:
-                thisrace = result_pilot['current_laps'][1:]
-
-            if len(thisrace) >= consecutivesCount:
-                for i in range(len(thisrace) - (consecutivesCount - 1)):
-                    gevent.sleep()
-                    all_consecutives.append({
-                        'laps': consecutivesCount,
-                        'time': sum([data['lap_time'] for data in thisrace[i : i + consecutivesCount]]),
-                        'race_id': None,
-                        'lap_index': i+1
-                    })
-            else:
-                all_consecutives.append({
-                    'laps': len(thisrace),
-                    'time': sum([data['lap_time'] for data in thisrace]),
-                    'race_id': None,
-                    'lap_index': None
-                })
-
-        else:
-            # build race lap store
-            race_laps = {}
-            for race in selected_races:
-                race_laps[race.id] = []
-                for lap in result_pilot['pilot_laps']:
-                    if lap.race_id == race.id:
-                        race_laps[race.id].append(lap)
+        # build race lap store
+        race_laps = {}
+        for race in selected_races:
+            race_laps[race.id] = []
+        for lap in result_pilot['pilot_laps']:
+            race_laps[lap.race_id].append(lap)
 
-            for race in selected_races:
-                gevent.sleep()
+        for race in selected_races:
+            gevent.sleep()
 
-                if len(race_laps[race.id]) >= consecutivesCount:
-                    for i in range(len(race_laps[race.id]) - (consecutivesCount - 1)):
-                        gevent.sleep()
-                        all_consecutives.append({
-                            'laps': consecutivesCount,
-                            'time': sum([data.lap_time for data in race_laps[race.id][i : i + consecutivesCount]]),
-                            'race_id': race.id,
-                            'lap_index': i+1
-                        })
-                else:
-                    all_consecutives.append({
-                        'laps': len(race_laps[race.id]),
-                        'time': sum([data.lap_time for data in race_laps[race.id]]),
-                        'race_id': race.id,
-                        'lap_index': None
-                    })
+            laps, time, lap_index = calc_consecutives([data.lap_time for data in race_laps[race.id]], consecutivesCount)
+            all_consecutives.append({
+                'laps': laps,
+                'time': time,
+                'race_id': race.id,
+                'lap_index': lap_index
+            })
 
         # Get lowest not-none value (if any)
         if all_consecutives:
@@ -547,18 +505,15 @@ def calc_leaderboard(rhDataObj, **params):
             result_pilot['consecutives_base'] = all_consecutives[0]['laps']
             result_pilot['consecutive_lap_start'] = all_consecutives[0]['lap_index']
 
-            if USE_CURRENT:
-                result_pilot['consecutives_source'] = None
+            source_race = selected_races_keyed[all_consecutives[0]['race_id']]
+            if source_race:
+                result_pilot['consecutives_source'] = {
+                    'round': source_race.round_id,
+                    'heat': source_race.heat_id,
+                    'displayname': heats_keyed[source_race.heat_id].display_name
+                    }
             else:
-                source_race = selected_races_keyed[all_consecutives[0]['race_id']]
-                if source_race:
-                    result_pilot['consecutives_source'] = {
-                        'round': source_race.round_id,
-                        'heat': source_race.heat_id,
-                        'displayname': heats_keyed[source_race.heat_id].display_name
-                        }
-                else:
-                    result_pilot['consecutives_source'] = None
+                result_pilot['consecutives_source'] = None
 
         else:
             result_pilot['consecutives'] = None
@@ -566,6 +521,11 @@ def calc_leaderboard(rhDataObj, **params):
             result_pilot['consecutives_base'] = None
             result_pilot['consecutive_lap_start'] = None
 
+    return build_leaderboard_output(rhDataObj, leaderboard, race_format, consecutivesCount, meta_points_flag)
+
+def build_leaderboard_output(rhDataObj, leaderboard, race_format, consecutivesCount, meta_points_flag=False):
+    '''Formats leaderboard rows and assembles the sorted, ranked leaderboards'''
+    timeFormat = rhDataObj.get_option('timeFormat')
 
     gevent.sleep()
 
@@ -741,6 +701,409 @@ def calc_leaderboard(rhDataObj, **params):
 
     return leaderboard_output
 
+def count_current_laps(laps, race_format):
+    '''Returns the number of completed laps in a seat's current race crossings'''
+    if laps:
+        if race_format and race_format.start_behavior == StartBehavior.FIRST_LAP:
+            return len(laps)
+        return len(laps) - 1
+    return 0
+
+def build_current_rows(rhDataObj, raceObj, race_format, profile_freqs):
+    '''Creates current race leaderboard rows (by frequency in practice mode, by pilot otherwise)'''
+    leaderboard = []
+    active_laps = raceObj.get_active_laps()
+
+    if raceObj.current_heat == RHUtils.HEAT_ID_NONE:
+        for node_index in range(raceObj.num_nodes):
+            laps = []
+            if len(active_laps):
+                laps = active_laps[node_index]
+
+            if (profile_freqs["b"][node_index] and profile_freqs["c"][node_index]):
+                callsign = profile_freqs["b"][node_index] + str(profile_freqs["c"][node_index])
+            else:
+                callsign = str(profile_freqs["f"][node_index])
+
+            if profile_freqs["f"][node_index] != RHUtils.FREQUENCY_ID_NONE:
+                leaderboard.append({
+                    'pilot_id': None,
+                    'callsign': callsign,
+                    'team_name': None,
+                    'laps': count_current_laps(laps, race_format),
+                    'holeshots': None,
+                    'starts': 1 if len(laps) > 0 else 0,
+                    'node': node_index,
+                    'current_laps': laps
+                })
+    else:
+        for pilot in rhDataObj.get_pilots():
+            gevent.sleep()
+            found_pilot = False
+            node_index = 0
+            laps = []
+            for node_index in raceObj.node_pilots:
+                if raceObj.node_pilots[node_index] == pilot.id and node_index < raceObj.num_nodes and len(active_laps):
+                    laps = active_laps[node_index]
+                    found_pilot = True
+                    break
+
+            if found_pilot and profile_freqs["f"][node_index] != RHUtils.FREQUENCY_ID_NONE:
+                leaderboard.append({
+                    'pilot_id': pilot.id,
+                    'callsign': pilot.callsign,
+                    'team_name': pilot.team,
+                    'laps': count_current_laps(laps, race_format),
+                    'holeshots': None,
+                    'starts': 1 if len(laps) > 0 else 0,
+                    'node': node_index,
+                    'current_laps': laps
+                })
+
+    return leaderboard
+
+def calc_current_row_stats(result_pilot, raceObj, race_format, consecutivesCount):
+    '''Computes time, lap and consecutives stats of a current race row from its crossings'''
+    current_laps = result_pilot['current_laps']
+
+    # Get the total race time
+    race_total = 0
+    laps_total = 0
+    for lap in current_laps:
+        race_total += lap['lap_time']
+        if lap['lap_number']:
+            laps_total += lap['lap_time']
+
+    result_pilot['total_time'] = race_total
+    result_pilot['total_time_laps'] = laps_total
+
+    if result_pilot['laps'] == 0:
+        result_pilot['last_lap'] = None
+        result_pilot['average_lap'] = 0 # Add zero if no laps completed
+        result_pilot['fastest_lap'] = 0
+    else:
+        result_pilot['last_lap'] = current_laps[-1]['lap_time']
+
+        if race_format and race_format.start_behavior == StartBehavior.FIRST_LAP:
+            result_pilot['average_lap'] = current_laps[-1]['lap_time_stamp'] / len(current_laps)
+            timed_laps = current_laps
+        else:
+            result_pilot['average_lap'] = (current_laps[-1]['lap_time_stamp'] - current_laps[0]['lap_time_stamp']) / (len(current_laps) - 1)
+            timed_laps = filter(lambda x : x['lap_number'], current_laps)
+
+        result_pilot['fastest_lap'] = sorted(timed_laps, key=lambda val : val['lap_time'])[0]['lap_time']
+
+    result_pilot['fastest_lap_source'] = None
+
+    # find best consecutive X laps
+    if race_format and race_format.start_behavior == StartBehavior.FIRST_LAP:
+        thisrace = current_laps
+    else:
+        thisrace = current_laps[1:]
+
+    laps, time, lap_index = raceObj.get_consecutives(result_pilot['node'], thisrace, consecutivesCount)
+    result_pilot['consecutives'] = time
+    result_pilot['consecutives_base'] = laps
+    result_pilot['consecutive_lap_start'] = lap_index
+    result_pilot['consecutives_source'] = None
+
+class LiveLeaderboard():
+    '''Current race leaderboard, updated incrementally as laps are recorded.
+
+    build() creates the rows of all seats; update() recomputes only the rows
+    of seats whose laps changed before re-sorting. Output is the same as
+    calc_leaderboard(rhDataObj, current_race=raceObj, current_profile=profile).
+    '''
+    def __init__(self):
+        self.rows = None # raw leaderboard rows, before formatting
+        self.race_format = None
+        self.profile = None
+        self.consecutivesCount = None
+
+    def build(self, rhDataObj, raceObj, profile):
+        self.race_format = raceObj.format
+        self.profile = profile
+        self.consecutivesCount = rhDataObj.get_optionInt('consecutivesCount', 3)
+        rows = build_current_rows(rhDataObj, raceObj, self.race_format, json.loads(profile.frequencies))
+        for result_pilot in rows:
+            gevent.sleep()
+            calc_current_row_stats(result_pilot, raceObj, self.race_format, self.consecutivesCount)
+
+        self.rows = rows
+        return self.output(rhDataObj)
+
+    def update(self, rhDataObj, raceObj, profile, node_indexes):
+        '''Recomputes rows for the given seats; falls back to a full build when rows are not available'''
+        if self.rows is None or raceObj.format is not self.race_format or profile is not self.profile \
+            or self.consecutivesCount != rhDataObj.get_optionInt('consecutivesCount', 3):
+            return self.build(rhDataObj, raceObj, profile)
+
+        active_laps = raceObj.get_active_laps()
+        for result_pilot in self.rows:
+            if result_pilot['node'] in node_indexes:
+                laps = active_laps.get(result_pilot['node'], [])
+                result_pilot['laps'] = count_current_laps(laps, self.race_format)
+                result_pilot['starts'] = 1 if len(laps) > 0 else 0
+                result_pilot['current_laps'] = laps
+                calc_current_row_stats(result_pilot, raceObj, self.race_format, self.consecutivesCount)
+
+        return self.output(rhDataObj)
+
+    def output(self, rhDataObj):
+        # formatting replaces raw values, so work on copies of the rows
+        return build_leaderboard_output(rhDataObj, [dict(row) for row in self.rows],
+            self.race_format, self.consecutivesCount)
+
+    def clear(self):
+        self.rows = None
+
+def calc_leaderboard_update(previous, leaderboard):
+    '''Returns the changes between two current race leaderboards.
+
+    For each ranking, 'rows' holds changed fields of rows (keyed by node) and
+    'order' the node order, when it changed; 'meta' is included if changed.
+    '''
+    update = {}
+    for ranking in ['by_race_time', 'by_fastest_lap', 'by_consecutives']:
+        previous_rows = {}
+        for row in previous[ranking]:
+            previous_rows[row['node']] = row
+
+        changed_rows = {}
+        for row in leaderboard[ranking]:
+            previous_row = previous_rows.get(row['node'])
+            if previous_row is None:
+                changed_rows[row['node']] = row
+            else:
+                changes = {key: value for key, value in row.items() if previous_row.get(key) != value}
+                if changes:
+                    changed_rows[row['node']] = changes
+
+        ranking_update = {}
+        if changed_rows:
+            ranking_update['rows'] = changed_rows
+        order = [row['node'] for row in leaderboard[ranking]]
+        if order != [row['node'] for row in previous[ranking]]:
+            ranking_update['order'] = order
+        if ranking_update:
+            update[ranking] = ranking_update
+
+    if leaderboard['meta'] != previous['meta']:
+        update['meta'] = leaderboard['meta']
+
+    return update
+
+def columnar_lookup(values, keys, default):
+    '''Maps each value to the index of the equal key, or to default if there is none'''
+    keys = np.array(keys, dtype=np.int64)
+    if not len(keys):
+        return np.full(len(values), default, dtype=np.int64)
+    sorter = np.argsort(keys, kind='stable')
+    found = sorter[np.minimum(np.searchsorted(keys, values, sorter=sorter), len(keys) - 1)]
+    return np.where(keys[found] == values, found, default)
+
+def calc_pilot_results_columnar(rhDataObj, race_data, lap_columns, race_format, race_results, heats_keyed, consecutivesCount):
+    '''
+    Columnar engine for saved-race leaderboards (requires NumPy).
+
+    Loads laps (rows from get_savedRaceLapColumns) into column arrays and
+    computes starts, lap totals, fastest lap and fastest consecutives for
+    every pilot with grouped array operations. Returns the per-pilot rows
+    (matching those assembled by the per-pilot loop in calc_leaderboard) and
+    whether any points were found.
+    '''
+    selected_races = race_data['races']
+    pilots = race_data['pilots']
+
+    # points totals from (cached) race results
+    meta_points_flag = False
+    pilot_points = {pilot_id: 0 for pilot_id in pilots}
+    for race in selected_races:
+        if race.id in race_results:
+            results = race_results[race.id]
+            counted = set()
+            for line in results[results['meta']['primary_leaderboard']]:
+                if line['pilot_id'] in pilot_points and line['pilot_id'] not in counted:
+                    counted.add(line['pilot_id'])
+                    pilot_points[line['pilot_id']] += line['points']
+                    if pilot_points[line['pilot_id']]:
+                        meta_points_flag = True
+
+    # pilot ids map to dense codes; code pilot_count collects unknown pilots
+    pilot_count = len(pilots)
+    pilot_codes = {pilot_id: code for code, pilot_id in enumerate(pilots)}
+
+    race_first_lap = np.zeros(len(selected_races), dtype=bool)
+    race_formats = {}
+    for idx, race in enumerate(selected_races):
+        if race_format:
+            this_race_format = race_format
+        else:
+            if race.format_id not in race_formats:
+                race_formats[race.format_id] = rhDataObj.get_raceFormat(race.format_id)
+            this_race_format = race_formats[race.format_id]
+        race_first_lap[idx] = bool(this_race_format and this_race_format.start_behavior == StartBehavior.FIRST_LAP)
+
+    # pilotrace columns, in race order
+    pr_id = []
+    pr_code = []
+    pr_race = []
+    pr_node = []
+    for idx, race in enumerate(selected_races):
+        for pilotrace in race_data['pilotraces'][race.id]:
+            pr_id.append(pilotrace.id)
+            pr_code.append(pilot_codes.get(pilotrace.pilot_id, pilot_count))
+            pr_race.append(idx)
+            pr_node.append(pilotrace.node_index)
+
+    if not pr_code:
+        return [], meta_points_flag
+
+    pr_code = np.array(pr_code, dtype=np.int64)
+    pr_race = np.array(pr_race, dtype=np.int64)
+    pr_node = np.array(pr_node, dtype=np.int64)
+    pilotrace_count = len(pr_code)
+
+    # lap columns, in saved (id) order
+    columns = np.array(lap_columns, dtype=np.int64).reshape(-1, 5)
+    lap_race = columnar_lookup(columns[:, 1], [race.id for race in selected_races], -1)
+    lap_pr = columnar_lookup(columns[:, 2], pr_id, -1)
+    lap_code = columnar_lookup(columns[:, 3], list(pilots), pilot_count)
+    lap_time = columns[:, 4]
+    lap_count = len(lap_time)
+    lap_position = np.arange(lap_count)
+
+    gevent.sleep()
+
+    # laps crossed by the pilot assigned to the pilotrace
+    own_position = lap_position[(lap_pr >= 0) & (lap_code == pr_code[np.maximum(lap_pr, 0)])]
+    own_count = np.bincount(lap_pr[own_position], minlength=pilotrace_count)
+
+    # first own lap of each pilotrace is its holeshot, unless the race format counts it
+    started_pr, first_own = np.unique(lap_pr[own_position], return_index=True)
+    holeshot_pr = ~race_first_lap[pr_race[started_pr]]
+    is_holeshot = np.zeros(lap_count, dtype=bool)
+    is_holeshot[own_position[first_own[holeshot_pr]]] = True
+
+    code_count = pilot_count + 1
+    starts = np.bincount(pr_code[started_pr], minlength=code_count)
+    holeshots = np.bincount(pr_code[started_pr[holeshot_pr]], minlength=code_count)
+    total_laps = np.zeros(code_count, dtype=np.int64)
+    np.add.at(total_laps, pr_code, own_count)
+    total_laps -= holeshots
+
+    # node of the last pilotrace flown by each pilot
+    node = np.full(code_count, -1, dtype=np.int64)
+    last_codes, last_reversed = np.unique(pr_code[::-1], return_index=True)
+    node[last_codes] = pr_node[pilotrace_count - 1 - last_reversed]
+
+    total_time = np.zeros(code_count, dtype=np.int64)
+    np.add.at(total_time, lap_code, lap_time)
+
+    counted_position = lap_position[~is_holeshot]
+    total_time_laps = np.zeros(code_count, dtype=np.int64)
+    np.add.at(total_time_laps, lap_code[counted_position], lap_time[counted_position])
+
+    # fastest lap; the last of equal laps wins
+    fastest = np.full(code_count, -1, dtype=np.int64)
+    order = np.lexsort((-counted_position, lap_time[counted_position], lap_code[counted_position]))
+    fastest_codes, fastest_first = np.unique(lap_code[counted_position][order], return_index=True)
+    fastest[fastest_codes] = counted_position[order][fastest_first]
+
+    gevent.sleep()
+
+    # fastest consecutives over per-pilot, per-race lap groups
+    grouped = counted_position[lap_race[counted_position] >= 0]
+    grouped = grouped[np.lexsort((grouped, lap_race[grouped], lap_code[grouped]))]
+    g_code = lap_code[grouped]
+    g_race = lap_race[grouped]
+    g_time = lap_time[grouped]
+    grouped_count = len(grouped)
+
+    new_group = np.ones(grouped_count, dtype=bool)
+    new_group[1:] = (g_code[1:] != g_code[:-1]) | (g_race[1:] != g_race[:-1])
+    group_start = np.flatnonzero(new_group)
+    group_size = np.diff(np.append(group_start, grouped_count))
+    rank = np.arange(grouped_count) - np.repeat(group_start, group_size)
+    time_sum = np.concatenate(([0], np.cumsum(g_time)))
+
+    window_end = np.flatnonzero(rank >= consecutivesCount - 1)
+    short_group = group_size < consecutivesCount
+
+    cand_code = np.concatenate((g_code[window_end], g_code[group_start[short_group]]))
+    cand_race = np.concatenate((g_race[window_end], g_race[group_start[short_group]]))
+    cand_laps = np.concatenate((np.full(len(window_end), consecutivesCount, dtype=np.int64), group_size[short_group]))
+    cand_time = np.concatenate((
+        time_sum[window_end + 1] - time_sum[window_end + 1 - consecutivesCount],
+        time_sum[group_start[short_group] + group_size[short_group]] - time_sum[group_start[short_group]]
+        ))
+    cand_index = np.concatenate((rank[window_end] - consecutivesCount + 2, np.zeros(np.count_nonzero(short_group), dtype=np.int64)))
+
+    best = np.full(code_count, -1, dtype=np.int64)
+    order = np.lexsort((cand_index, cand_race, cand_time, cand_time == 0, -cand_laps, cand_code))
+    best_codes, best_first = np.unique(cand_code[order], return_index=True)
+    best[best_codes] = order[best_first]
+
+    gevent.sleep()
+
+    leaderboard = []
+    for pilot_id, pilot in pilots.items():
+        code = pilot_codes[pilot_id]
+        if starts[code] > 0:
+            laps = int(total_laps[code])
+            result_pilot = {
+                'pilot_id': pilot.id,
+                'callsign': pilot.callsign,
+                'team_name': pilot.team,
+                'laps': laps,
+                'starts': int(starts[code]),
+                'node': int(node[code]),
+                'points': pilot_points[pilot_id],
+                'total_time': int(total_time[code]),
+                'total_time_laps': int(total_time_laps[code]),
+                'last_lap': None
+            }
+
+            if laps == 0:
+                result_pilot['average_lap'] = 0
+                result_pilot['fastest_lap'] = 0
+                result_pilot['fastest_lap_source'] = None
+            else:
+                result_pilot['average_lap'] = result_pilot['total_time_laps'] / laps
+
+                fast_lap = fastest[code]
+                if lap_race[fast_lap] >= 0:
+                    race = selected_races[lap_race[fast_lap]]
+                    result_pilot['fastest_lap_source'] = {
+                        'round': race.round_id,
+                        'heat': race.heat_id,
+                        'displayname': heats_keyed[race.heat_id].display_name
+                        }
+                result_pilot['fastest_lap'] = int(lap_time[fast_lap])
+
+            if best[code] >= 0:
+                cand = best[code]
+                source_race = selected_races[cand_race[cand]]
+                result_pilot['consecutives'] = int(cand_time[cand])
+                result_pilot['consecutives_base'] = int(cand_laps[cand])
+                result_pilot['consecutive_lap_start'] = int(cand_index[cand]) if cand_index[cand] else None
+            else:
+                # no counted laps in any race
+                source_race = selected_races[0]
+                result_pilot['consecutives'] = 0
+                result_pilot['consecutives_base'] = 0
+                result_pilot['consecutive_lap_start'] = None
+
+            result_pilot['consecutives_source'] = {
+                'round': source_race.round_id,
+                'heat': source_race.heat_id,
+                'displayname': heats_keyed[source_race.heat_id].display_name
+                }
+
+            leaderboard.append(result_pilot)
+
+    return leaderboard, meta_points_flag
+
 def calc_team_leaderboard(raceObj, rhDataObj):
     '''Calculates and returns team-racing info.'''
     # Uses current results cache / requires calc_leaderboard to have been run prior
@@ -0,0 +1,120 @@
+'''
+Packed RSSI history
+
+Saved races store each node's RSSI history as a binary blob instead of JSON
+lists of floats. Values are delta-encoded int16 (RSSI scaled by 1, or by 2
+for older nodes with half-step readings) and times are uint32 millisecond
+offsets from the earliest sample. The body is zlib-compressed when that makes
+it smaller.
+
+Layout (little-endian):
+    uint8    format version
+    uint8    flags (bit 0: body is zlib-compressed)
+    uint8    value scale
+    uint8    (reserved)
+    uint32   sample count
+    float64  base time (seconds)
+    body:    int16[count] value deltas, then uint32[count] time offsets (ms)
+
+'''
+
+import logging
+import struct
+import sys
+import zlib
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+FLAG_ZLIB = 0x01
+
+HEADER = struct.Struct('<BBBxId')
+
+INT16_MIN = -0x8000
+INT16_MAX = 0x7FFF
+UINT32_MAX = 0xFFFFFFFF
+
+def get_value_scale(values):
+    '''Returns the smallest scale (1 or 2) that makes all values integers, or None'''
+    for scale in (1, 2):
+        if all(float(value * scale).is_integer() for value in values):
+            return scale
+    return None
+
+def pack(history_values, history_times, compress=True):
+    '''Packs RSSI history lists; returns None if they cannot be represented'''
+    count = len(history_values)
+    if count != len(history_times):
+        return None
+
+    scale = get_value_scale(history_values)
+    if scale is None:
+        return None
+    base_time = min(history_times) if count else 0.0
+
+    if np is not None:
+        values = np.rint(np.asarray(history_values, dtype=np.float64) * scale).astype(np.int64)
+        deltas = np.diff(values, prepend=0)
+        offsets = np.rint((np.asarray(history_times, dtype=np.float64) - base_time) * 1000).astype(np.int64)
+        if count and (deltas.min() < INT16_MIN or deltas.max() > INT16_MAX or offsets.max() > UINT32_MAX):
+            return None
+        body = deltas.astype('<i2').tobytes() + offsets.astype('<u4').tobytes()
+    else:
+        values = [int(round(value * scale)) for value in history_values]
+        deltas = [value - last for value, last in zip(values, [0] + values[:-1])]
+        offsets = [int(round((time - base_time) * 1000)) for time in history_times]
+        if count and (min(deltas) < INT16_MIN or max(deltas) > INT16_MAX or max(offsets) > UINT32_MAX):
+            return None
+        deltas = array('h', deltas)
+        offsets = array('I', offsets) if array('I').itemsize == 4 else array('L', offsets)
+        if sys.byteorder == 'big':
+            deltas.byteswap()
+            offsets.byteswap()
+        body = deltas.tobytes() + offsets.tobytes()
+
+    flags = 0
+    if compress:
+        compressed = zlib.compress(body)
+        if len(compressed) < len(body):
+            body = compressed
+            flags |= FLAG_ZLIB
+
+    return HEADER.pack(FORMAT_VERSION, flags, scale, count, base_time) + body
+
+def unpack(data):
+    '''Returns (history_values, history_times) lists from packed history'''
+    version, flags, scale, count, base_time = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError('Unsupported RSSI history format: {}'.format(version))
+
+    body = data[HEADER.size:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+
+    if np is not None:
+        values = np.cumsum(np.frombuffer(body, dtype='<i2', count=count).astype(np.int64))
+        offsets = np.frombuffer(body, dtype='<u4', count=count, offset=count * 2)
+        times = (base_time + offsets / 1000.0).tolist()
+        values = (values / scale).tolist() if scale != 1 else values.tolist()
+    else:
+        deltas = array('h')
+        deltas.frombytes(body[:count * 2])
+        offsets = array('I') if array('I').itemsize == 4 else array('L')
+        offsets.frombytes(body[count * 2:count * 6])
+        if sys.byteorder == 'big':
+            deltas.byteswap()
+            offsets.byteswap()
+        values = []
+        total = 0
+        for delta in deltas:
+            total += delta
+            values.append(total / scale if scale != 1 else total)
+        times = [base_time + offset / 1000.0 for offset in offsets]
+
+    return values, times
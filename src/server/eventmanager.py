@@ -4,21 +4,170 @@ RotorHazard event manager
 
 import logging
 import gevent
-import copy
-from RHUtils import catchLogExceptionsWrapper
+import gevent.pool
+import greenlet
+from bisect import bisect_left
+from collections import OrderedDict
 from monotonic import monotonic
 
 logger = logging.getLogger(__name__)
 
+HANDLER_POOL_SIZE = 64  # max number of async handlers running at once; others wait for a free slot
+SLOW_HANDLER_WARN_INTERVAL_SECS = 60  # min time between slow-handler warnings for the same handler
+
+class LatencyHistogram:
+    """ Counts durations in fixed, roughly logarithmic buckets """
+
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)  # bucket upper bounds; last bucket is open
+    BOUNDS_SECS = tuple(bound / 1000.0 for bound in BOUNDS_MS)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.totalSecs = 0.0
+        self.maxSecs = 0.0
+        self.lastSecs = 0.0
+
+    def add(self, secs):
+        self.counts[bisect_left(self.BOUNDS_SECS, secs)] += 1
+        self.count += 1
+        self.totalSecs += secs
+        self.lastSecs = secs
+        if secs > self.maxSecs:
+            self.maxSecs = secs
+
+    def percentileMs(self, fraction):
+        '''Returns the upper bound of the bucket holding the given fraction of durations (capped at the max)'''
+        if not self.count:
+            return 0
+        target = fraction * self.count
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= target:
+                break
+        maxMs = self.maxSecs * 1000
+        return round(min(self.BOUNDS_MS[index], maxMs) if index < len(self.BOUNDS_MS) else maxMs, 3)
+
+    def toDict(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.totalSecs * 1000, 3),
+            'avg_ms': round(self.totalSecs * 1000 / self.count, 3) if self.count else 0,
+            'max_ms': round(self.maxSecs * 1000, 3),
+            'last_ms': round(self.lastSecs * 1000, 3),
+            'p50_ms': self.percentileMs(0.5),
+            'p95_ms': self.percentileMs(0.95),
+            'p99_ms': self.percentileMs(0.99),
+            'histogram': list(self.counts)
+        }
+
+
+class LoopTimer:
+    """
+    Measures the time greenlets hold the event loop: from a greenlet switch
+    hook, time is counted only while a timed greenlet is running, not while
+    it is waiting (in gevent.sleep, I/O and so on) and others run.
+    """
+
+    def __init__(self):
+        self._timers = {}  # greenlet -> list of [held secs, time switched in] for each timing in progress
+        self._prevTrace = None
+        self._installed = False
+
+    def start(self):
+        '''Starts timing the current greenlet; returns the timer to pass to stop()'''
+        if not self._installed:
+            self._prevTrace = greenlet.settrace(self._trace)
+            self._installed = True
+        timer = [0.0, monotonic()]
+        self._timers.setdefault(greenlet.getcurrent(), []).append(timer)
+        return timer
+
+    def stop(self, timer):
+        '''Stops the timer; returns the seconds the greenlet held the event loop'''
+        current = greenlet.getcurrent()
+        timers = self._timers.get(current)
+        if timers and timer in timers:
+            timers.remove(timer)
+            if not timers:
+                del self._timers[current]
+        if timer[1] is not None:
+            timer[0] += monotonic() - timer[1]
+            timer[1] = None
+        return timer[0]
+
+    def _trace(self, event, args):
+        if event in ('switch', 'throw'):
+            origin, target = args
+            if self._timers:
+                nowTime = monotonic()
+                for timer in self._timers.get(origin, ()):
+                    if timer[1] is not None:
+                        timer[0] += nowTime - timer[1]
+                        timer[1] = None
+                for timer in self._timers.get(target, ()):
+                    timer[1] = nowTime
+        if self._prevTrace is not None:
+            self._prevTrace(event, args)
+
+
+class HandlerStats:
+    """ Run-time statistics for an event handler """
+
+    def __init__(self, event, name):
+        self.event = event
+        self.name = name
+        self.runTime = LatencyHistogram()  # wall time, including time spent waiting (gevent.sleep, I/O)
+        self.loopTime = LatencyHistogram()  # time spent holding the event loop
+        self.queueDelay = LatencyHistogram()  # time between being triggered and starting to run
+        self.numErrors = 0
+        self.numCancelled = 0
+        self.numOverBudget = 0
+        self.lastWarnTime = None
+
+    def toDict(self):
+        stats = self.runTime.toDict()
+        stats['event'] = self.event
+        stats['name'] = self.name
+        stats['errors'] = self.numErrors
+        stats['cancelled'] = self.numCancelled
+        stats['over_budget'] = self.numOverBudget
+        stats['loop_time'] = self.loopTime.toDict()
+        stats['queue_delay'] = self.queueDelay.toDict()
+        return stats
+
+
+class EventStats(HandlerStats):
+    """ Run-time statistics for all handlers run by an event """
+
+    def __init__(self, event):
+        super().__init__(event, None)
+        self.numTriggers = 0
+
+    def toDict(self):
+        stats = super().toDict()
+        del stats['name']
+        stats['handler_runs'] = stats.pop('count')
+        stats['triggers'] = self.numTriggers
+        return stats
+
+
 class EventManager:
     processEventObj = gevent.event.Event()
 
     events = {}
-    eventOrder = {}
-    eventThreads = {}
+    dispatchTable = {}  # event -> handler entries (including Evt.ALL), built on demand
+    eventThreads = {}  # thread name -> running greenlet
 
-    def __init__(self, rhapi):
+    def __init__(self, rhapi, pool_size=HANDLER_POOL_SIZE):
         self._rhapi = rhapi
+        self._pool = gevent.pool.Pool(pool_size)
+        self._pendingHandlers = OrderedDict()  # thread name -> handler waiting for a pool slot
+        self._handlerStats = {}  # (event, name) -> HandlerStats
+        self._eventStats = {}  # event -> EventStats
+        self._latencyBudgetSecs = 0  # warn about handlers that hold the event loop longer than this (0 to disable)
+        self._loopTimer = LoopTimer()
 
     def on(self, event, name, handler_fn, default_args=None, priority=200, unique=False):
         if default_args == None:
@@ -34,7 +183,7 @@ class EventManager:
             "unique": unique
         }
 
-        self.eventOrder[event] = [key for key, _value in sorted(self.events[event].items(), key=lambda x: x[1]['priority'])]
+        self.dispatchTable.clear()
 
         return True
 
@@ -47,58 +196,141 @@ class EventManager:
 
         del(self.events[event][name])
 
-        self.eventOrder[event] = [key for key, _value in sorted(self.events[event].items(), key=lambda x: x[1]['priority'])]
+        self.dispatchTable.clear()
 
         return True
 
+    def get_dispatch_list(self, event):
+        '''Returns (event, name, handler) entries to run for the given event, in order'''
+        entries = self.dispatchTable.get(event)
+        if entries is None:
+            entries = []
+            for ev in (event, Evt.ALL) if event != Evt.ALL else (Evt.ALL,):
+                if ev in self.events:
+                    for name, handler in sorted(self.events[ev].items(), key=lambda x: x[1]['priority']):
+                        entries.append((ev, name, handler))
+            entries = tuple(entries)
+            self.dispatchTable[event] = entries
+        return entries
+
     def trigger(self, event, evt_args=None):
         # logger.debug('-Triggered event- {0}'.format(event))
-        evt_list = []
-        if event in self.eventOrder:
-            for name in self.eventOrder[event]:
-                evt_list.append([event, name])
-        if Evt.ALL in self.eventOrder:
-            for name in self.eventOrder[Evt.ALL]:
-                evt_list.append([Evt.ALL, name])
-
-        if len(evt_list):
-            for ev, name in evt_list:
-                handler = self.events[ev][name]
-                args = copy.copy(handler['default_args'])
+        eventStats = self._eventStats.get(event)
+        if eventStats is None:
+            eventStats = self._eventStats[event] = EventStats(event)
+        eventStats.numTriggers += 1
 
+        for ev, name, handler in self.get_dispatch_list(event):
+            if handler['default_args']:
+                args = dict(handler['default_args'])
                 if evt_args:
-                    if args:
-                        args.update(evt_args)
-                    else:
-                        args = evt_args
+                    args.update(evt_args)
+            elif evt_args:
+                args = evt_args
+            else:
+                args = {}
+
+            if ev == Evt.ALL:
+                args['_eventName'] = event
 
-                if ev == Evt.ALL:
-                    args['_eventName'] = event
+            if handler['unique']:
+                threadName = name + str(monotonic())
+            else:
+                threadName = name
+                # stop any running or waiting thread with same name
+                self._pendingHandlers.pop(name, None)
+                greenlet = self.eventThreads.pop(name, None)
+                if greenlet is not None:
+                    greenlet.kill(block=False)
 
-                if handler['unique']:
-                    threadName = name + str(monotonic())
+            if handler['priority'] < 100:
+                self.run_handler_timed(eventStats, ev, name, handler['handler_fn'], args)
+            else:
+                job = (eventStats, ev, name, handler['handler_fn'], args, monotonic())
+                if self._pool.full():
+                    self._pendingHandlers[threadName] = job
                 else:
-                    threadName = name
+                    self._spawn_handler(threadName, job)
 
-                # stop any threads with same name
-                for token in self.eventThreads.copy():
-                    if token in self.eventThreads and self.eventThreads[token]['name'] == name:
-                        self.eventThreads[token]['thread'].kill(block=False)
-                    if token in self.eventThreads and self.eventThreads[token]['thread'].dead:
-                        self.eventThreads.pop(token, False)
+    def _spawn_handler(self, threadName, job):
+        greenlet = self._pool.spawn(self.run_handler_timed, *job)
+        self.eventThreads[threadName] = greenlet
+        greenlet.link(lambda g: self._on_handler_done(threadName, g))
 
-                if handler['priority'] < 100:
-                    self.run_handler(handler['handler_fn'], args)
-                else:
-                    greenlet = gevent.spawn(self.run_handler, handler['handler_fn'], args)
-                    self.eventThreads[greenlet.minimal_ident] = {
-                        'name': threadName,
-                        'thread': greenlet
-                        }
-
-    @catchLogExceptionsWrapper
-    def run_handler(self, handler, args):
-        return handler(args)
+    def _on_handler_done(self, threadName, greenlet):
+        if self.eventThreads.get(threadName) is greenlet:
+            del self.eventThreads[threadName]
+        while self._pendingHandlers and not self._pool.full():
+            self._spawn_handler(*self._pendingHandlers.popitem(last=False))
+
+    def run_handler_timed(self, eventStats, ev, name, handler, args, queuedTime=None):
+        stats = self._handlerStats.get((ev, name))
+        if stats is None:
+            stats = self._handlerStats[(ev, name)] = HandlerStats(ev, name)
+        startTime = monotonic()
+        if queuedTime is not None:
+            stats.queueDelay.add(startTime - queuedTime)
+            eventStats.queueDelay.add(startTime - queuedTime)
+        loopTimer = self._loopTimer.start()
+        try:
+            return handler(args)
+        except gevent.GreenletExit:
+            stats.numCancelled += 1
+            eventStats.numCancelled += 1
+            raise
+        except Exception:
+            stats.numErrors += 1
+            eventStats.numErrors += 1
+            logger.exception("Exception in handler '{}' for event '{}'".format(name, eventStats.event))
+        finally:
+            loopSecs = self._loopTimer.stop(loopTimer)
+            elapsedSecs = monotonic() - startTime
+            stats.runTime.add(elapsedSecs)
+            eventStats.runTime.add(elapsedSecs)
+            stats.loopTime.add(loopSecs)
+            eventStats.loopTime.add(loopSecs)
+            if self._latencyBudgetSecs and loopSecs > self._latencyBudgetSecs:
+                self._on_over_budget(stats, eventStats, loopSecs, elapsedSecs, queuedTime is None)
+
+    def _on_over_budget(self, stats, eventStats, loopSecs, elapsedSecs, blockingFlag):
+        stats.numOverBudget += 1
+        eventStats.numOverBudget += 1
+        nowTime = monotonic()
+        if stats.lastWarnTime is None or nowTime - stats.lastWarnTime >= SLOW_HANDLER_WARN_INTERVAL_SECS:
+            stats.lastWarnTime = nowTime
+            logger.warning("Slow {}handler '{}' for event '{}': held event loop {:.1f} ms of {:.1f} ms run time (budget {:.0f} ms, {} of {} runs over budget)".\
+                           format("blocking " if blockingFlag else "", stats.name, eventStats.event, loopSecs * 1000,
+                                  elapsedSecs * 1000, self._latencyBudgetSecs * 1000, stats.numOverBudget, stats.runTime.count))
+
+    def set_latency_budget(self, budget_ms):
+        '''Sets the time holding the event loop over which a handler is logged as slow (0 to disable)'''
+        self._latencyBudgetSecs = (budget_ms or 0) / 1000.0
+
+    def get_latency_budget(self):
+        return self._latencyBudgetSecs * 1000
+
+    def get_handler_stats(self):
+        '''Returns run-time statistics for each handler that has run, busiest first'''
+        stats = [stats.toDict() for stats in self._handlerStats.values()]
+        stats.sort(key=lambda item: item['total_ms'], reverse=True)
+        return stats
+
+    def get_event_stats(self):
+        '''Returns statistics for each event that has been triggered, busiest first'''
+        stats = [stats.toDict() for stats in self._eventStats.values()]
+        stats.sort(key=lambda item: item['total_ms'], reverse=True)
+        return stats
+
+    def reset_handler_stats(self):
+        self._handlerStats.clear()
+        self._eventStats.clear()
+
+    def get_pool_status(self):
+        return {
+            'running': len(self._pool),
+            'waiting': len(self._pendingHandlers),
+            'size': self._pool.size
+        }
 
 
 class Evt:
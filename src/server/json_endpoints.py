@@ -1,6 +1,7 @@
 # JSON API
 import json
 import Results
+from eventmanager import LatencyHistogram
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from flask.blueprints import Blueprint
 
@@ -178,11 +179,12 @@ def createBlueprint(RaceContext, serverInfo):
     @APP.route('/api/race/<int:heat_id>/<int:round_id>')
     def api_race(heat_id, round_id):
         race = RaceContext.rhdata.get_savedRaceMeta_by_heat_round(heat_id, round_id)
+        race_data = RaceContext.rhdata.get_savedRaceData(race_id=race.id)
 
         pilotraces = []
-        for pilotrace in RaceContext.rhdata.get_savedPilotRaces_by_savedRaceMeta(race.id):
+        for pilotrace in race_data['pilotraces'][race.id]:
             laps = []
-            for lap in RaceContext.rhdata.get_savedRaceLaps_by_savedPilotRace(pilotrace.id):
+            for lap in race_data['laps'][pilotrace.id]:
                 laps.append({
                         'id': lap.id,
                         'lap_time_stamp': lap.lap_time_stamp,
@@ -192,7 +194,7 @@ def createBlueprint(RaceContext, serverInfo):
                         'deleted': lap.deleted
                     })
 
-            pilot_data = RaceContext.rhdata.get_pilot(pilotrace.pilot_id)
+            pilot_data = race_data['pilots'].get(pilotrace.pilot_id)
             if pilot_data:
                 nodepilot = pilot_data.callsign
             else:
@@ -252,4 +254,17 @@ def createBlueprint(RaceContext, serverInfo):
 
         return json.dumps({"options": payload}, cls=AlchemyEncoder), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
 
+    @APP.route('/api/events/stats')
+    def api_events_stats():
+        events = RaceContext.events
+        payload = {
+            "latency_budget_ms": events.get_latency_budget(),
+            "histogram_bounds_ms": list(LatencyHistogram.BOUNDS_MS),
+            "pool": events.get_pool_status(),
+            "events": events.get_event_stats(),
+            "handlers": events.get_handler_stats()
+        }
+
+        return json.dumps({"event_stats": payload}), 201, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
     return APP
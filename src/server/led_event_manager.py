@@ -15,12 +15,21 @@ import RHRace
 import RHUtils
 from RHUtils import catchLogExceptionsWrapper, cleanVarName
 import gevent
+import gevent.event
+from monotonic import monotonic
 from eventmanager import Evt
 from six.moves import UserDict
 import logging
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 logger = logging.getLogger(__name__)
 
+DEF_LED_MAX_FPS = 30
+
 class LEDEventManager:
     events = {}
     idleArgs = {}
@@ -28,9 +37,9 @@ class LEDEventManager:
     eventThread = None
     displayColorCache = []
 
-    def __init__(self, eventmanager, strip, RaceContext, RHAPI):
+    def __init__(self, eventmanager, strip, RaceContext, RHAPI, maxFps=DEF_LED_MAX_FPS):
         self.Events = eventmanager
-        self.strip = strip
+        self.strip = LEDRenderer(strip, maxFps)
         self._racecontext = RaceContext
         self._rhapi = RHAPI
 
@@ -137,7 +146,9 @@ class LEDEventManager:
         if 'caller' in args and args['caller'] == 'shutdown':
             return False
 
+        self.strip.beginEffect()
         result = args['handler_fn'](args)
+        self.strip.flush()
         if result == False:
             logger.debug('LED effect %s produced no output', args['handler_fn'])
         if 'preventIdle' not in args or not args['preventIdle']:
@@ -166,6 +177,94 @@ class LEDEventManager:
             self.eventEffects[self.events[event]]['handler_fn'](self.idleArgs[event])
 
 
+class LEDRenderer():
+    """
+    Stands in for the LED strip given to effects. Effects draw into a shared
+    buffer and call show() to queue a frame; a single greenlet copies the latest
+    frame to the strip when the server is otherwise idle, at most 'maxFps' times
+    a second (0 for no limit), and only if the frame changed. Frames shown
+    between pushes are skipped. Only the most recently started effect can show frames, so an
+    effect that has been replaced stops drawing as soon as the next one starts.
+    """
+    def __init__(self, strip, maxFps=DEF_LED_MAX_FPS):
+        self.strip = strip
+        self.pixels = [0] * strip.numPixels()
+        self.shownFrame = None
+        self.lastFrame = None
+        self.frameInterval = 1.0 / maxFps if maxFps else 0
+        self.lastPushTime = 0
+        self.numPushed = 0
+        self.numSkipped = 0
+        self.effectGreenlet = None
+        self.frameEvent = gevent.event.Event()
+        self.renderThread = gevent.spawn(self.renderLoop)
+
+    def begin(self):
+        pass
+
+    def numPixels(self):
+        return len(self.pixels)
+
+    def setPixelColor(self, i, color):
+        self.pixels[i] = color
+
+    def getPixelColor(self, i):
+        return self.pixels[i]
+
+    def setPixels(self, colors, start=0):
+        end = min(start + len(colors), len(self.pixels))
+        self.pixels[start:end] = colors[:end - start]
+
+    def setBrightness(self, brightness):
+        self.strip.setBrightness(brightness)
+        self.lastFrame = None  # push next frame even if unchanged
+
+    def show(self):
+        if self.effectGreenlet is None or self.effectGreenlet is gevent.getcurrent():
+            self.shownFrame = list(self.pixels)
+            self.frameEvent.set()
+
+    def beginEffect(self):
+        '''Makes the calling greenlet the only one whose frames are shown'''
+        self.effectGreenlet = gevent.getcurrent()
+
+    def waitForFrame(self):
+        '''Sleeps for one frame interval; for effects that redraw continuously'''
+        gevent.sleep(self.frameInterval or 0.001)
+
+    def flush(self):
+        '''Pushes the latest frame to the strip now, if changed'''
+        if self.effectGreenlet is None or self.effectGreenlet is gevent.getcurrent():
+            self.frameEvent.clear()
+            self.push()
+
+    def renderLoop(self):
+        while True:
+            try:
+                self.frameEvent.wait()
+                waitSecs = self.lastPushTime + self.frameInterval - monotonic()
+                if waitSecs > 0:
+                    gevent.sleep(waitSecs)
+                gevent.idle()  # never ahead of time-critical work
+                self.frameEvent.clear()
+                self.push()
+            except gevent.GreenletExit:
+                break
+            except Exception:
+                logger.exception("Error pushing LED frame")
+                gevent.sleep(1)
+
+    def push(self):
+        frame = self.shownFrame
+        if frame is None or frame == self.lastFrame:
+            self.numSkipped += 1
+            return
+        setStripPixels(self.strip, frame)
+        self.strip.show()
+        self.lastFrame = frame
+        self.lastPushTime = monotonic()
+        self.numPushed += 1
+
 class NoLEDManager():
     def __init__(self):
         pass
@@ -213,6 +312,80 @@ def Color(red, green, blue):
 
 
 
+def setStripPixels(strip, colors, start=0):
+    '''Sets consecutive strip pixels to the given 24-bit colors, in bulk if the strip supports it'''
+    if np and isinstance(colors, np.ndarray):
+        colors = colors.tolist()
+    if hasattr(strip, 'setPixels'):
+        strip.setPixels(colors, start)
+    else:
+        for pos, color in enumerate(colors, start):
+            strip.setPixelColor(pos, color)
+
+class PanelFramebuffer:
+    """
+    Copies images to an LED panel. Images are drawn upright and turned by
+    'rotate' quarter turns counterclockwise (as Image.rotate(90 * rotate)) on
+    the panel. Strip positions run along each panel row in turn; with inverted
+    (serpentine) rows, every other row runs backwards. The image-to-strip index
+    map, including the rotation, is computed once for each image size, and
+    images are converted to strip colors in bulk (with NumPy if available).
+    """
+    _indexMaps = {}  # (numPixels, width, height, invertedRows, rotate) -> image index for each strip position
+
+    def __init__(self, strip, invertedRows=False, rotate=0):
+        self.strip = strip
+        self.invertedRows = invertedRows
+        self.rotate = rotate % 4
+
+    def getIndexMap(self, width, height):
+        key = (self.strip.numPixels(), width, height, self.invertedRows, self.rotate)
+        indexMap = self._indexMaps.get(key)
+        if indexMap is None:
+            # panel size after rotation
+            if self.rotate % 2:
+                panelWidth, panelHeight = height, width
+            else:
+                panelWidth, panelHeight = width, height
+
+            indexMap = []
+            for row in range(panelHeight):
+                if self.invertedRows and row % 2 == 0:
+                    cols = range(panelWidth - 1, -1, -1)
+                else:
+                    cols = range(panelWidth)
+                for col in cols:
+                    # image pixel shown at this panel position
+                    if self.rotate == 1:
+                        x, y = width - 1 - row, col
+                    elif self.rotate == 2:
+                        x, y = width - 1 - col, height - 1 - row
+                    elif self.rotate == 3:
+                        x, y = row, height - 1 - col
+                    else:
+                        x, y = col, row
+                    indexMap.append(y * width + x)
+            indexMap = indexMap[:key[0]]
+            if np:
+                indexMap = np.array(indexMap, dtype=np.intp)
+            self._indexMaps[key] = indexMap
+        return indexMap
+
+    def imageToColors(self, img):
+        '''Returns the 24-bit strip colors for the given image, in strip order'''
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        indexMap = self.getIndexMap(img.width, img.height)
+        if np:
+            rgb = np.asarray(img, dtype=np.uint32).reshape(-1, 3)[indexMap]
+            return (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+        data = img.getdata()
+        return [Color(*data[index]) for index in indexMap]
+
+    def blit(self, img):
+        '''Copies the image to the strip (without showing it)'''
+        setStripPixels(self.strip, self.imageToColors(img))
+
 class ColorVal:
     NONE = Color(0,0,0)
     BLUE = Color(0,31,255)
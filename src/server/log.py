@@ -6,6 +6,8 @@ import platform
 import time
 import zipfile
 import gevent
+import gevent.event
+from collections import deque
 from datetime import datetime
 
 # Sample configuration:
@@ -14,15 +16,30 @@ from datetime import datetime
 #         "SYSLOG_LEVEL": "NONE",
 #         "FILELOG_LEVEL": "INFO",
 #         "FILELOG_NUM_KEEP": 30,
-#         "CONSOLE_STREAM": "stdout"
+#         "CONSOLE_STREAM": "stdout",
+#         "QUEUE_SIZE": 10000,
+#         "OVERFLOW_POLICY": "DROP_OLDEST"
 #     }
 #
 # Valid log levels:  DEBUG, INFO, WARNING, WARN, ERROR, FATAL, CRITICAL, NONE
 # FILELOG_NUM_KEEP is number of log files to keep, rest will be deleted (oldest first)
 # CONSOLE_STREAM may be "stdout" or "stderr"
+# QUEUE_SIZE is the number of log records that may wait to be written
+# OVERFLOW_POLICY is what happens to a record logged when the queue is full:
+#  "DROP_OLDEST" (the oldest waiting record is discarded), "DROP_NEWEST" (the
+#  new record is discarded) or "BLOCK" (wait up to a second, then drop oldest)
 
 DEF_CONSOLE_STREAM = sys.stdout  # default console-output stream
 DEF_FILELOG_NUM_KEEP = 30        # default number of log files to keep
+DEF_QUEUE_SIZE = 10000           # default max number of records waiting to be written
+WRITE_BATCH_SIZE = 200           # max number of records written per batch
+WRITE_BATCH_DELAY = 0.02         # seconds to wait for more records before writing a partial batch
+
+OVERFLOW_DROP_OLDEST = "DROP_OLDEST"
+OVERFLOW_DROP_NEWEST = "DROP_NEWEST"
+OVERFLOW_BLOCK = "BLOCK"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_BLOCK)
+DEF_OVERFLOW_POLICY = OVERFLOW_DROP_OLDEST
 
 LOG_FILENAME_STR = "rh.log"
 LOG_DIR_NAME = "logs"
@@ -37,20 +54,35 @@ SYSLOG_LEVEL_STR = "SYSLOG_LEVEL"
 FILELOG_LEVEL_STR = "FILELOG_LEVEL"
 FILELOG_NUM_KEEP_STR = "FILELOG_NUM_KEEP"
 CONSOLE_STREAM_STR = "CONSOLE_STREAM"
+QUEUE_SIZE_STR = "QUEUE_SIZE"
+OVERFLOW_POLICY_STR = "OVERFLOW_POLICY"
 LEVEL_NONE_STR = "NONE"
 LEVEL_NONE_VALUE = 9999
 
 socket_handler_obj = None
 queued_handler_obj = None
+queue_options = {}
 
-# Log handler that distributes log records to one or more destination handlers via a gevent queue.
+# Log handler that distributes log records to one or more destination handlers via a queue.
+# Records are formatted and written by a worker greenlet, in batches (one write and flush per
+# batch for stream and file handlers), so logging adds little delay to the calling code.
 class QueuedLogEventHandler(logging.Handler):
 
     # Creates queued-log-event handler, with given destination log handler.
-    def __init__(self, dest_hndlr=None):
+    def __init__(self, dest_hndlr=None, queue_size=DEF_QUEUE_SIZE, overflow_policy=DEF_OVERFLOW_POLICY):
         super(QueuedLogEventHandler, self).__init__()
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError("Invalid log-queue overflow policy: {0}".format(overflow_policy))
         self.queue_handlers_list = []
-        self.log_record_queue = gevent.queue.Queue(maxsize=99)
+        self.log_record_queue = deque()
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.records_event = gevent.event.Event()
+        self.writing_flag = False
+        self.num_written = 0
+        self.num_dropped = 0
+        self.num_dropped_reported = 0
+        self.max_queue_depth = 0
         if dest_hndlr:
             self.queue_handlers_list.append(dest_hndlr)
         gevent.spawn(self.queueWorkerFn)
@@ -62,30 +94,72 @@ class QueuedLogEventHandler(logging.Handler):
     def queueWorkerFn(self):
         while True:
             try:
-                log_rec = self.log_record_queue.get()  # block until log record put into queue
-                for dest_hndlr in self.queue_handlers_list:
-                    if log_rec.levelno >= dest_hndlr.level:
-                        gevent.sleep(0.001)
-                        dest_hndlr.emit(log_rec)
+                self.records_event.wait()  # block until log record put into queue
+                self.records_event.clear()
+                if len(self.log_record_queue) < WRITE_BATCH_SIZE:
+                    gevent.sleep(WRITE_BATCH_DELAY)  # let records logged together share a write
+                while self.log_record_queue:
+                    self.writing_flag = True
+                    batch = []
+                    while self.log_record_queue and len(batch) < WRITE_BATCH_SIZE:
+                        batch.append(self.log_record_queue.popleft())
+                    if self.num_dropped > self.num_dropped_reported:
+                        batch.append(self.makeDroppedRecord())
+                    for dest_hndlr in self.queue_handlers_list:
+                        write_records(dest_hndlr, [log_rec for log_rec in batch if log_rec.levelno >= dest_hndlr.level])
+                    self.num_written += len(batch)
+                    gevent.sleep(0)  # let other greenlets run between batches
+                self.writing_flag = False
             except KeyboardInterrupt:
                 print("Log-event queue worker thread terminated by keyboard interrupt")
                 raise
             except SystemExit:
                 raise
             except Exception as ex:
+                self.writing_flag = False
                 print("Error processing log-event queue: " + str(ex))
                 gevent.sleep(5)
 
+    def makeDroppedRecord(self):
+        num_dropped = self.num_dropped - self.num_dropped_reported
+        self.num_dropped_reported = self.num_dropped
+        return logging.makeLogRecord({
+            'name': __name__,
+            'levelno': logging.WARNING,
+            'levelname': logging.getLevelName(logging.WARNING),
+            'msg': "Log queue full; {0} record(s) dropped (total {1})".format(num_dropped, self.num_dropped)
+        })
+
     def emit(self, record):
-        try:
-            self.log_record_queue.put(record, timeout=1)
-        except Exception as ex:
-            print("Error adding record to log-event queue: " + str(ex))
+        if len(self.log_record_queue) >= self.queue_size:
+            if self.overflow_policy == OVERFLOW_BLOCK:
+                self.records_event.set()
+                wait_count = 0
+                while len(self.log_record_queue) >= self.queue_size and wait_count < 1000:
+                    wait_count += 1
+                    gevent.sleep(0.001)  # wait (up to about a second) for the worker to catch up
+            if len(self.log_record_queue) >= self.queue_size:
+                self.num_dropped += 1
+                if self.overflow_policy == OVERFLOW_DROP_NEWEST:
+                    return
+                self.log_record_queue.popleft()
+        self.log_record_queue.append(record)
+        if len(self.log_record_queue) > self.max_queue_depth:
+            self.max_queue_depth = len(self.log_record_queue)
+        self.records_event.set()
+
+    def getStats(self):
+        return {
+            'queued': len(self.log_record_queue),
+            'max_queued': self.max_queue_depth,
+            'written': self.num_written,
+            'dropped': self.num_dropped
+        }
 
     def waitForQueueEmpty(self):
         try:
             count = 0
-            while not self.log_record_queue.empty():
+            while self.log_record_queue or self.writing_flag:
                 count += 1
                 if count > 300:
                     print("Timeout waiting for log queue empty")
@@ -107,6 +181,30 @@ class QueuedLogEventHandler(logging.Handler):
         except Exception as ex:
             print("Error closing QueuedLogEventHandler: " + str(ex))
 
+# Writes log records to the given handler; stream and file handlers get the formatted
+#  records in a single write, followed by a single flush.
+def write_records(dest_hndlr, log_recs):
+    if not log_recs:
+        return
+    if type(dest_hndlr) in (logging.StreamHandler, logging.FileHandler) and dest_hndlr.stream is not None:
+        text_list = []
+        for log_rec in log_recs:
+            try:
+                text_list.append(dest_hndlr.format(log_rec) + dest_hndlr.terminator)
+            except Exception:
+                dest_hndlr.handleError(log_rec)
+        dest_hndlr.acquire()
+        try:
+            dest_hndlr.stream.write(''.join(text_list))
+            dest_hndlr.flush()
+        except Exception:
+            dest_hndlr.handleError(log_recs[-1])
+        finally:
+            dest_hndlr.release()
+    else:
+        for log_rec in log_recs:
+            dest_hndlr.emit(log_rec)
+
 class SocketForwardHandler(logging.Handler):
 
     def __init__(self, socket, *a, **kw):
@@ -158,6 +256,27 @@ def get_logging_level_for_item(logging_config, cfg_item_name, err_str, def_level
     return (lvl_num, err_str)
 
 
+# Determines log-queue size and overflow policy from configuration, or generates
+#  error message (and uses defaults) if invalid.
+def get_queue_options(logging_config, err_str):
+    queue_size = logging_config[QUEUE_SIZE_STR]
+    overflow_policy = str(logging_config[OVERFLOW_POLICY_STR]).upper()
+    item_errs = []
+    try:
+        queue_size = int(queue_size)
+        if queue_size <= 0:
+            raise ValueError("Non-positive value")
+    except ValueError:
+        item_errs.append("Value for '{0}' in configuration is invalid: {1}".format(QUEUE_SIZE_STR, queue_size))
+        queue_size = DEF_QUEUE_SIZE
+    if overflow_policy not in OVERFLOW_POLICIES:
+        item_errs.append("Value for '{0}' in configuration is invalid: {1}".format(OVERFLOW_POLICY_STR, overflow_policy))
+        overflow_policy = DEF_OVERFLOW_POLICY
+    if item_errs:
+        err_str = (err_str + ", " if err_str else "") + ", ".join(item_errs)
+    return (queue_size, overflow_policy, err_str)
+
+
 # Completes the logging setup.
 # Returns the path/filename for the current log file in use, or None.
 def later_stage_setup(config, socket):
@@ -171,6 +290,8 @@ def later_stage_setup(config, socket):
     logging_config[FILELOG_LEVEL_STR] = logging.getLevelName(logging.INFO)
     logging_config[FILELOG_NUM_KEEP_STR] = DEF_FILELOG_NUM_KEEP
     logging_config[CONSOLE_STREAM_STR] = DEF_CONSOLE_STREAM.name[1:-1]
+    logging_config[QUEUE_SIZE_STR] = DEF_QUEUE_SIZE
+    logging_config[OVERFLOW_POLICY_STR] = DEF_OVERFLOW_POLICY
 
     logging_config.update(config)
 
@@ -233,6 +354,10 @@ def later_stage_setup(config, socket):
         num_old_del = 0
         log_path_name = None
 
+    (queue_size, overflow_policy, err_str) = get_queue_options(logging_config, err_str)
+    queue_options['queue_size'] = queue_size
+    queue_options['overflow_policy'] = overflow_policy
+
     if err_str:
         err_str = "Logging configuration error: " + err_str
         if hdlr_obj:
@@ -250,7 +375,7 @@ def later_stage_setup(config, socket):
     root.setLevel(min_level)
 
     global queued_handler_obj
-    queued_handler_obj = QueuedLogEventHandler()
+    queued_handler_obj = QueuedLogEventHandler(**queue_options)
     for logHndlr in handlers:
         queued_handler_obj.addHandler(logHndlr)
 
@@ -265,6 +390,12 @@ def wait_for_queue_empty():
     if queued_handler_obj:
         queued_handler_obj.waitForQueueEmpty()
 
+# Returns counts of queued, written and dropped log records.
+def get_queue_stats():
+    if queued_handler_obj:
+        return queued_handler_obj.getStats()
+    return None
+
 def close_logging():
     try:
         global queued_handler_obj
@@ -286,7 +417,7 @@ def start_socket_forward_handler():
     global socket_handler_obj
     if socket_handler_obj:
         # use separate queue for socket forwarder (in case it has trouble because of network issues)
-        queued_handler2 = QueuedLogEventHandler(socket_handler_obj)
+        queued_handler2 = QueuedLogEventHandler(socket_handler_obj, **queue_options)
         logging.getLogger().addHandler(queued_handler2)
         socket_handler_obj = None
 
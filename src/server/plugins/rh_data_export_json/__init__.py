@@ -179,7 +179,12 @@ def assemble_racemeta_complete(rhapi):
     return payload
 
 def assemble_pilotrace_complete(rhapi):
-    payload = rhapi.db.pilotruns
+    payload = []
+    encoder = AlchemyEncoder()
+    for pilotrun in rhapi.db.pilotruns:
+        fields = encoder.default(pilotrun)
+        fields['history_values'], fields['history_times'] = rhapi.db.pilotrun_history(pilotrun)
+        payload.append(fields)
     return payload
 
 def assemble_racelap_complete(rhapi):
@@ -205,6 +210,8 @@ class AlchemyEncoder(json.JSONEncoder):
                 if field != 'query' \
                     and field != 'query_class':
                     try:
+                        if field == 'history_data':
+                            continue
                         json.dumps(data) # this will fail on non-encodable values, like other classes
                         if field == 'frequencies':
                             fields[field] = json.loads(data)
@@ -6,7 +6,7 @@
 
 import Config
 from eventmanager import Evt
-from led_event_manager import LEDEffect, Color
+from led_event_manager import LEDEffect, PanelFramebuffer
 import gevent
 from PIL import Image
 
@@ -16,21 +16,7 @@ def showBitmap(args):
     else:
         return False
 
-    def setPixels(img):
-        pos = 0
-        for row in range(0, img.height):
-            for col in range(0, img.width):
-                if pos >= strip.numPixels():
-                    return
-
-                c = col
-                if Config.LED['INVERTED_PANEL_ROWS']:
-                    if row % 2 == 0:
-                        c = 15 - col
-
-                px = img.getpixel((c, row))
-                strip.setPixelColor(pos, Color(px[0], px[1], px[2]))
-                pos += 1
+    framebuffer = PanelFramebuffer(strip, Config.LED['INVERTED_PANEL_ROWS'], Config.LED['PANEL_ROTATE'])
 
     bitmaps = args['bitmaps']
     if bitmaps and bitmaps is not None:
@@ -62,9 +48,8 @@ def showBitmap(args):
             pad_left = int((output_w - size[0]) / 2) 
             pad_top = int((output_h - size[1]) / 2)
             output_img.paste(img, (pad_left, pad_top))
-            output_img = output_img.rotate(90 * Config.LED['PANEL_ROTATE'], expand=True)
 
-            setPixels(output_img)
+            framebuffer.blit(output_img)
             strip.show()
             gevent.sleep(delay/1000.0)
 
@@ -6,7 +6,7 @@
 
 import Config
 from eventmanager import Evt
-from led_event_manager import LEDEffect, LEDEvent, Color, ColorVal
+from led_event_manager import LEDEffect, LEDEvent, ColorVal, PanelFramebuffer
 from RHRace import RaceStatus
 import gevent
 from PIL import Image, ImageFont, ImageDraw
@@ -106,9 +106,7 @@ def printCharacter(args):
 
     panel['draw'].text((int((panel['width']-w)/2), int((panel['height']-h)/2)), text, font=font, fill=(color))
 
-    img = panel['im'].rotate(90 * Config.LED['PANEL_ROTATE'], expand=True)
-
-    setPixels(strip, img)
+    setPixels(strip, panel['im'])
     strip.show()
 
 def scrollText(args):
@@ -141,12 +139,12 @@ def scrollText(args):
         h = 8
 
     draw_y = int((panel['height']-h)/2)
+    framebuffer = getFramebuffer(strip)
 
     for i in range(-panel['width'], w + panel['width']):
         panel['draw'].rectangle((0, 0, panel['width'], panel['height']), fill=(0, 0, 0))
         panel['draw'].text((-i, draw_y), text, font=font, fill=(color))
-        img = panel['im'].rotate(90 * Config.LED['PANEL_ROTATE'], expand=True)
-        setPixels(strip, img)
+        framebuffer.blit(panel['im'])
         strip.show()
         gevent.sleep(10/1000.0)
 
@@ -222,8 +220,7 @@ def multiLapGrid(args):
 
             panel['draw'].text((pos_x + 1, pos_y), text, font=font, fill=color)
 
-    img = panel['im'].rotate(90 * Config.LED['PANEL_ROTATE'], expand=True)
-    setPixels(strip, img)
+    setPixels(strip, panel['im'])
     strip.show()
 
 def getPanelImg(strip):
@@ -245,21 +242,11 @@ def getPanelImg(strip):
         'draw': ImageDraw.Draw(im)
     }
 
+def getFramebuffer(strip):
+    return PanelFramebuffer(strip, Config.LED['INVERTED_PANEL_ROWS'], Config.LED['PANEL_ROTATE'])
+
 def setPixels(strip, img):
-    pos = 0
-    for row in range(0, img.height):
-        for col in range(0, img.width):
-            if pos >= strip.numPixels():
-                return
-
-            c = col
-            if Config.LED['INVERTED_PANEL_ROWS']:
-                if row % 2 == 0:
-                    c = 15 - col
-
-            px = img.getpixel((c, row))
-            strip.setPixelColor(pos, Color(px[0], px[1], px[2]))
-            pos += 1
+    getFramebuffer(strip).blit(img)
 
 def clearPixels(strip):
     for i in range(strip.numPixels()):
@@ -6,8 +6,7 @@
 
 import Config
 from eventmanager import Evt
-from led_event_manager import LEDEffect, Color, ColorVal
-import gevent
+from led_event_manager import LEDEffect, ColorVal, PanelFramebuffer
 from PIL import Image, ImageDraw
 
 def rssiGraph(args):
@@ -25,6 +24,7 @@ def rssiGraph(args):
         return False
 
     panel = getPanelImg(strip)
+    framebuffer = getFramebuffer(strip)
 
     if 'active_only' in args and args['active_only'] == True:
         active_nodes = []
@@ -57,11 +57,10 @@ def rssiGraph(args):
 
                 panel['draw'].rectangle((barWidth * node.index, point, (barWidth * node.index) + barWidth - 1, panel['height']), fill=color)
 
-        img = panel['im'].rotate(90 * Config.LED['PANEL_ROTATE'], expand=True)
-        setPixels(strip, img)
+        framebuffer.blit(panel['im'])
         strip.show()
 
-        gevent.idle()
+        strip.waitForFrame()
 
 def getPanelImg(strip):
     panel_w = Config.LED['LED_COUNT'] // Config.LED['LED_ROWS']
@@ -82,21 +81,11 @@ def getPanelImg(strip):
         'draw': ImageDraw.Draw(im)
     }
 
+def getFramebuffer(strip):
+    return PanelFramebuffer(strip, Config.LED['INVERTED_PANEL_ROWS'], Config.LED['PANEL_ROTATE'])
+
 def setPixels(strip, img):
-    pos = 0
-    for row in range(0, img.height):
-        for col in range(0, img.width):
-            if pos >= strip.numPixels():
-                return
-
-            c = col
-            if Config.LED['INVERTED_PANEL_ROWS']:
-                if row % 2 == 0:
-                    c = 15 - col
-
-            px = img.getpixel((c, row))
-            strip.setPixelColor(pos, Color(px[0], px[1], px[2]))
-            pos += 1
+    getFramebuffer(strip).blit(img)
 
 def clearPixels(strip):
     for i in range(strip.numPixels()):
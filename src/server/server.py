@@ -1,6 +1,6 @@
 '''RotorHazard server script'''
 RELEASE_VERSION = "4.1.0-dev.1" # Public release version code
-SERVER_API = 41 # Server API version
+SERVER_API = 42 # Server API version
 NODE_API_SUPPORTED = 18 # Minimum supported node version
 NODE_API_BEST = 35 # Most recent node API
 JSON_API = 3 # JSON API version
@@ -100,6 +100,7 @@ RaceContext = RaceContext.RaceContext()
 RHAPI = RHAPI.RHAPI(RaceContext)
 
 Events = EventManager(RHAPI)
+Events.set_latency_budget(Config.GENERAL['EVENT_HANDLER_BUDGET_MS'])
 RaceContext.events = Events
 EventActionsObj = None
 
@@ -165,7 +166,8 @@ Database.DB.init_app(APP)
 Database.DB.app = APP
 
 # start SocketIO service
-SOCKET_IO = SocketIO(APP, async_mode='gevent', cors_allowed_origins=Config.GENERAL['CORS_ALLOWED_HOSTS'], max_http_buffer_size=5e7)
+SOCKET_IO = SocketIO(APP, async_mode='gevent', cors_allowed_origins=Config.GENERAL['CORS_ALLOWED_HOSTS'], max_http_buffer_size=5e7,
+    json=RHUI.PayloadJSON)
 
 # this is the moment where we can forward log-messages to the frontend, and
 # thus set up logging for good.
@@ -183,6 +185,13 @@ Server_secondary_mode = None
 
 SECONDARY_RACE_FORMAT = None
 RaceContext.rhdata = RHData.RHData(Database, Events, RaceContext, SERVER_API, DB_FILE_NAME, DB_BKP_DIR_NAME) # Primary race data storage
+RaceContext.rhdata.set_durability_mode(Config.GENERAL['DB_WAL_MODE'], Config.GENERAL['DB_COMMIT_WINDOW'])
+
+# deferred commits must complete before the request's DB session is removed
+#  (teardown functions run in reverse order, so this runs before Flask-SQLAlchemy's)
+@APP.teardown_appcontext
+def commit_deferred_db_changes(_exception=None):
+    RaceContext.rhdata.commit_deferred()
 
 RaceContext.pagecache = PageCache.PageCache(RaceContext, Events) # For storing page cache
 
@@ -600,6 +609,7 @@ def stop_background_threads():
             HEARTBEAT_THREAD.kill(block=True, timeout=0.5)
             HEARTBEAT_THREAD = None
         RaceContext.interface.stop()
+        RaceContext.rhdata.commit_deferred()
     except Exception:
         logger.error("Error stopping background threads")
 
@@ -612,6 +622,7 @@ def stop_background_threads():
 def connect_handler(auth):
     '''Starts the interface and a heartbeat thread for rssi.'''
     logger.debug('Client connected')
+    RaceContext.rhui.subscribe_topics(request.sid) # all broadcasts until client subscribes to topics
     start_background_threads()
     #
     @catchLogExceptionsWrapper
@@ -626,6 +637,26 @@ def connect_handler(auth):
 def disconnect_handler():
     '''Emit disconnect event.'''
     logger.debug('Client disconnected')
+    RaceContext.rhui.unsubscribe_compact_heartbeat(request.sid)
+
+@SOCKET_IO.on('subscribe_topics')
+@catchLogExceptionsWrapper
+def on_subscribe_topics(data):
+    '''Limits topic broadcasts to this client to the listed topics.'''
+    RaceContext.rhui.subscribe_topics(request.sid, data.get('topics', []))
+
+@SOCKET_IO.on('subscribe_compact_heartbeat')
+@catchLogExceptionsWrapper
+def on_subscribe_compact_heartbeat(data=None):
+    '''Switches client from JSON heartbeat to compact binary frames, at an optional rate (per second).'''
+    rate = data.get('rate') if data else None
+    RaceContext.rhui.subscribe_compact_heartbeat(request.sid, rate)
+
+@SOCKET_IO.on('unsubscribe_compact_heartbeat')
+@catchLogExceptionsWrapper
+def on_unsubscribe_compact_heartbeat():
+    '''Returns client to JSON heartbeat.'''
+    RaceContext.rhui.unsubscribe_compact_heartbeat(request.sid)
 
 # LiveTime compatible events
 
@@ -688,13 +719,15 @@ def on_join_cluster_ex(data=None):
         try:  # if first time joining and DB contains races then backup DB and clear races
             if prev_mode is None and len(RaceContext.rhdata.get_savedRaceMetas()) > 0:
                 logger.info("Making database autoBkp and clearing races on split timer")
-                RaceContext.rhdata.backup_db_file(True, "autoBkp_")
-                RaceContext.rhdata.clear_race_data()
-                reset_current_laps()
-                RaceContext.rhui.emit_current_laps()
-                RaceContext.rhui.emit_result_data()
-                RaceContext.rhdata.delete_old_db_autoBkp_files(Config.GENERAL['DB_AUTOBKP_NUM_KEEP'], \
-                                                   "autoBkp_", "DB_AUTOBKP_NUM_KEEP")
+                if RaceContext.rhdata.backup_db_file(True, "autoBkp_", compress=Config.GENERAL['DB_BKP_COMPRESS']):
+                    RaceContext.rhdata.clear_race_data()
+                    reset_current_laps()
+                    RaceContext.rhui.emit_current_laps()
+                    RaceContext.rhui.emit_result_data()
+                    RaceContext.rhdata.delete_old_db_autoBkp_files(Config.GENERAL['DB_AUTOBKP_NUM_KEEP'], \
+                                                       "autoBkp_", "DB_AUTOBKP_NUM_KEEP")
+                else:
+                    logger.error("Database autoBkp failed; keeping races on split timer")
         except:
             logger.exception("Error making db-autoBkp / clearing races on split timer")
         RaceContext.race.format = SECONDARY_RACE_FORMAT
@@ -703,14 +736,16 @@ def on_join_cluster_ex(data=None):
     Events.trigger(Evt.CLUSTER_JOIN, {
                 'message': __('Joined cluster')
                 })
+    RaceContext.cluster.set_primary_batch_mode(SOCKET_IO, bool(data.get('batch')) if data else False)
     RaceContext.cluster.emit_join_cluster_response(SOCKET_IO, serverInfoItems)
 
 @SOCKET_IO.on('check_secondary_query')
 @catchLogExceptionsWrapper
-def on_check_secondary_query(_data):
+def on_check_secondary_query(data):
     ''' Check-query received from primary; return response. '''
     payload = {
-        'timestamp': monotonic_to_epoch_millis(monotonic())
+        'timestamp': monotonic_to_epoch_millis(monotonic()),
+        'query_timestamp': data.get('timestamp') if data else None  # lets primary match response to query
     }
     SOCKET_IO.emit('check_secondary_response', payload)
 
@@ -757,6 +792,26 @@ def on_cluster_message_ack(data):
     messagePayload = data.get('messagePayload') if data else None
     RaceContext.cluster.emit_cluster_ack_to_primary(messageType, messagePayload)
 
+@SOCKET_IO.on('cluster_batch')
+@catchLogExceptionsWrapper
+def on_cluster_batch(data):
+    ''' Received batch of messages from primary; handle each as if emitted separately. '''
+    RaceContext.cluster.receive_batch_from_primary(data, dispatch_cluster_batch_message, \
+                                                   lambda ack: emit('cluster_batch_ack', ack))
+
+def dispatch_cluster_batch_message(messageType, messagePayload):
+    handler = SOCKET_IO.server.handlers.get('/', {}).get(messageType)
+    if handler:
+        handler(request.sid, *([messagePayload] if messagePayload is not None else []))
+    else:
+        logger.warning("Unexpected message '{0}' in batch from primary".format(messageType))
+
+@SOCKET_IO.on('cluster_batch_ack')
+@catchLogExceptionsWrapper
+def on_cluster_batch_ack(data):
+    ''' Received batch acknowledgement from primary. '''
+    RaceContext.cluster.ack_batch_from_primary(data)
+
 @SOCKET_IO.on('dispatch_event')
 @catchLogExceptionsWrapper
 def dispatch_event(evtArgs):
@@ -1404,11 +1459,30 @@ def on_alter_race(data):
 @catchLogExceptionsWrapper
 def on_backup_database():
     '''Backup database.'''
-    bkp_name = RaceContext.rhdata.backup_db_file(True)  # make copy of DB file
+    last_percent = [None]
+
+    def on_progress(percent):
+        if int(percent) != last_percent[0]:
+            last_percent[0] = int(percent)
+            emit('database_bkp_progress', {'percent': last_percent[0]})
+
+    # make copy of DB file
+    bkp_name = RaceContext.rhdata.backup_db_file(True, compress=Config.GENERAL['DB_BKP_COMPRESS'], progress_fn=on_progress)
 
     # read DB data and convert to Base64
-    with open(bkp_name, mode='rb') as file_obj:
-        file_content = file_obj.read()
+    file_content = None
+    if bkp_name:
+        try:
+            with open(bkp_name, mode='rb') as file_obj:
+                file_content = file_obj.read()
+        except Exception:
+            logger.exception('Error reading database backup file')
+
+    if file_content is None:
+        emit('database_bkp_failed')
+        RaceContext.rhui.emit_priority_message(__('Database backup failed'), False, nobroadcast=True)
+        return
+
     if hasattr(base64, "encodebytes"):
         file_content = base64.encodebytes(file_content).decode()
     else:
@@ -1438,7 +1512,7 @@ def on_list_backups():
     else:
         files = []
         for (_, _, filenames) in os.walk(DB_BKP_DIR_NAME):
-            files.extend(filenames)
+            files.extend(filename for filename in filenames if not filename.endswith(RHData.BACKUP_TEMP_EXT))
             break
 
         files.sort(key=str.casefold)
@@ -1458,7 +1532,12 @@ def restore_database_file(db_file_name):
         RaceContext.race.num_nodes = len(RaceContext.interface.nodes)  # restore number of nodes
         RaceContext.last_race = None
         try:
-            RaceContext.rhdata.recover_database(db_file_name)
+            recover_file_name = RaceContext.rhdata.extract_db_backup(db_file_name)
+            try:
+                RaceContext.rhdata.recover_database(recover_file_name)
+            finally:
+                if recover_file_name != db_file_name:
+                    os.remove(recover_file_name)
             gevent.sleep(1)  # pause/yield to allow changes to be committed
             reset_current_laps()
             clean_results_cache()
@@ -2088,6 +2167,8 @@ def on_stage_race(data=None):
         RaceContext.race.any_races_started = True
 
         RaceContext.race.init_node_finished_flags(heatNodes)
+        RaceContext.race.build_pass_snapshot()
+        RaceContext.race.pass_latency.reset()
 
         RaceContext.interface.set_race_status(RaceStatus.STAGING)
         RaceContext.rhui.emit_current_laps() # Race page, blank laps to the web client
@@ -2367,8 +2448,7 @@ def race_start_thread(start_token):
         RaceContext.race.start_time = datetime.now() # record standard-formatted time
 
         for node in RaceContext.interface.nodes:
-            node.history_values = [] # clear race history
-            node.history_times = []
+            node.history.clear() # clear race history
             node.under_min_lap_count = 0
             # clear any lingering crossing (if rssi>enterAt then first crossing starts now)
             if node.crossing_flag and node.frequency > 0 and (
@@ -2457,6 +2537,11 @@ def do_stop_race_actions(doSave=False):
         if len(min_laps_list) > 0:
             logger.info('Nodes with laps under minimum:  ' + ', '.join(min_laps_list))
 
+        if RaceContext.race.pass_latency.count:
+            latency = RaceContext.race.pass_latency.summary()
+            logger.info('Pass records: {}, queue wait avg/max {:.1f}/{:.1f}ms, processing avg/max {:.1f}/{:.1f}ms'.format(
+                latency['count'], latency['wait_avg'], latency['wait_max'], latency['process_avg'], latency['process_max']))
+
         RaceContext.race.race_status = RaceStatus.DONE # To stop registering passed laps, waiting for laps to be cleared
         RaceContext.interface.set_race_status(RaceStatus.DONE)
 
@@ -2560,11 +2645,12 @@ def do_save_actions():
             pilot_id = RaceContext.rhdata.get_pilot_from_heatNode(RaceContext.race.current_heat, node_index)
 
             if pilot_id is not None:
+                history_values, history_times = RaceContext.interface.nodes[node_index].history.view()
                 race_data[node_index] = {
                     'race_id': new_race.id,
                     'pilot_id': pilot_id,
-                    'history_values': json.dumps(RaceContext.interface.nodes[node_index].history_values),
-                    'history_times': json.dumps(RaceContext.interface.nodes[node_index].history_times),
+                    'history_values': history_values,
+                    'history_times': history_times,
                     'enter_at': RaceContext.interface.nodes[node_index].enter_at_level,
                     'exit_at': RaceContext.interface.nodes[node_index].exit_at_level,
                     'frequency': RaceContext.interface.nodes[node_index].frequency,
@@ -2676,7 +2762,7 @@ def on_resave_laps(data):
 
 @catchLogExceptionsWrapper
 def build_atomic_result_caches(params):
-    RaceContext.pagecache.set_valid(False)
+    RaceContext.pagecache.invalidate_race(params['race_id'])
     Results.build_atomic_results(RaceContext.rhdata, params)
     RaceContext.rhui.emit_result_data()
 
@@ -2978,6 +3064,7 @@ def on_delete_lap(data):
 
     logger.info('Lap deleted: Node {0} LapIndex {1}'.format(node_index+1, lap_index))
 
+    RaceContext.race.clear_consecutives(node_index)
     RaceContext.race.clear_results()
     PassInvokeFuncQueueObj.waitForQueueEmpty()  # wait until any active pass-record processing is finished
     RaceContext.race.get_results()  # update leaderboard before checking possible updated winner/leader
@@ -3028,6 +3115,7 @@ def on_restore_deleted_lap(data):
 
     logger.info('Restored deleted lap: Node {0} LapIndex {1}'.format(node_index+1, lap_index))
 
+    RaceContext.race.clear_consecutives(node_index)
     RaceContext.race.clear_results()
     PassInvokeFuncQueueObj.waitForQueueEmpty()  # wait until any active pass-record processing is finished
     RaceContext.race.get_results()  # update leaderboard before checking possible updated winner/leader
@@ -3182,13 +3270,15 @@ def get_pilotrace(data):
         else:
             nodepilot = None
 
+        history_values, history_times = RaceContext.rhdata.get_savedPilotRace_history(pilotrace)
+
         emit('race_details', {
             'pilotrace_id': data['pilotrace_id'],
             'callsign': nodepilot,
             'pilot_id': pilotrace.pilot_id,
             'node_index': pilotrace.node_index,
-            'history_values': json.loads(pilotrace.history_values),
-            'history_times': json.loads(pilotrace.history_times),
+            'history_values': history_values,
+            'history_times': history_times,
             'laps': laps,
             'enter_at': pilotrace.enter_at,
             'exit_at': pilotrace.exit_at,
@@ -3320,7 +3410,7 @@ def heartbeat_thread_function():
         try:
             node_data = RaceContext.interface.get_heartbeat_json()
 
-            SOCKET_IO.emit('heartbeat', node_data)
+            RaceContext.rhui.emit_heartbeat(node_data)
             heartbeat_thread_function.iter_tracker += 1
 
             # update displayed IMD rating after freqs changed:
@@ -3441,26 +3531,37 @@ def ms_from_program_start():
     return milli_sec
 
 def pass_record_callback(node, lap_timestamp_absolute, source):
-    PassInvokeFuncQueueObj.put(do_pass_record_callback, node, lap_timestamp_absolute, source)
+    PassInvokeFuncQueueObj.put(do_pass_record_callback, node, lap_timestamp_absolute, source, monotonic())
 
-def do_pass_record_callback(node, lap_timestamp_absolute, source):
+def do_pass_record_callback(node, lap_timestamp_absolute, source, queued_time=None):
     '''Handles pass records from the nodes.'''
-
+    start_time = monotonic()
+    try:
+        process_pass_record(node, lap_timestamp_absolute, source)
+    finally:
+        end_time = monotonic()
+        wait_ms = (start_time - queued_time) * 1000 if queued_time else 0
+        process_ms = (end_time - start_time) * 1000
+        RaceContext.race.pass_latency.add(wait_ms, process_ms)
+        logger.debug('Pass record latency: Node={}, queued={:.1f}ms, processed={:.1f}ms' \
+                     .format(node.index+1, wait_ms, process_ms))
+
+def process_pass_record(node, lap_timestamp_absolute, source):
     logger.debug('Pass record: Node={}, abs_ts={:.3f}, source={} ("{}")' \
                  .format(node.index+1, lap_timestamp_absolute, source, RaceContext.interface.get_lap_source_str(source)))
     node.pass_crossing_flag = False  # clear the "synchronized" version of the crossing flag
     node.debug_pass_count += 1
     RaceContext.rhui.emit_node_data() # For updated triggers and peaks
 
-    profile_freqs = json.loads(RaceContext.race.profile.frequencies)
-    if profile_freqs["f"][node.index] != RHUtils.FREQUENCY_ID_NONE :
+    snapshot = RaceContext.race.get_pass_snapshot()
+    if snapshot.seat_frequencies[node.index] != RHUtils.FREQUENCY_ID_NONE :
         # always count laps if race is running, otherwise test if lap should have counted before race end
         if RaceContext.race.race_status is RaceStatus.RACING \
             or (RaceContext.race.race_status is RaceStatus.DONE and \
                 lap_timestamp_absolute < RaceContext.race.end_time):
 
             # Get the current pilot id on the node
-            pilot_id = RaceContext.rhdata.get_pilot_from_heatNode(RaceContext.race.current_heat, node.index)
+            pilot_id = snapshot.seat_pilots.get(node.index)
 
             # reject passes before race start and with disabled (no-pilot) nodes
             race_format = RaceContext.race.format
@@ -3492,12 +3593,12 @@ def do_pass_record_callback(node, lap_timestamp_absolute, source):
                         min_lap = 0  # don't enforce min-lap time if running as secondary timer
                         min_lap_behavior = 0
                     else:
-                        min_lap = RaceContext.rhdata.get_optionInt("MinLapSec")
-                        min_lap_behavior = RaceContext.rhdata.get_optionInt("MinLapBehavior")
+                        min_lap = snapshot.min_lap
+                        min_lap_behavior = snapshot.min_lap_behavior
 
-                    lap_time_fmtstr = RHUtils.time_format(lap_time, RaceContext.rhdata.get_option('timeFormat'))
-                    lap_ts_fmtstr = RHUtils.time_format(lap_time_stamp, RaceContext.rhdata.get_option('timeFormat'))
-                    pilot_obj = RaceContext.rhdata.get_pilot(pilot_id)
+                    lap_time_fmtstr = RHUtils.time_format(lap_time, snapshot.time_format)
+                    lap_ts_fmtstr = RHUtils.time_format(lap_time_stamp, snapshot.time_format)
+                    pilot_obj = snapshot.pilots.get(pilot_id)
                     pilot_namestr = pilot_obj.callsign if pilot_obj else ""
 
                     lap_ok_flag = True
@@ -3554,10 +3655,10 @@ def do_pass_record_callback(node, lap_timestamp_absolute, source):
                         if logger.getEffectiveLevel() <= logging.DEBUG:  # if DEBUG msgs actually being logged
                             late_str = " (late lap)" if lap_late_flag else ""
                             enter_fmtstr = RHUtils.time_format((node.enter_at_timestamp-RaceContext.race.start_time_monotonic)*1000, \
-                                                               RaceContext.rhdata.get_option('timeFormat')) \
+                                                               snapshot.time_format) \
                                            if node.enter_at_timestamp else "0"
                             exit_fmtstr = RHUtils.time_format((node.exit_at_timestamp-RaceContext.race.start_time_monotonic)*1000, \
-                                                              RaceContext.rhdata.get_option('timeFormat')) \
+                                                              snapshot.time_format) \
                                            if node.exit_at_timestamp else "0"
                             logger.debug('Lap pass{}: Node={}, lap={}, lapTime={}, sinceStart={}, abs_ts={:.3f}, source={}, enter={}, exit={}, dur={:.0f}ms, pilot: {}' \
                                         .format(late_str, node.index+1, lap_number, lap_time_fmtstr, lap_ts_fmtstr, \
@@ -3580,7 +3681,7 @@ def do_pass_record_callback(node, lap_timestamp_absolute, source):
                         }
                         RaceContext.race.node_laps[node.index].append(lap_data)
 
-                        RaceContext.race.clear_results()
+                        RaceContext.race.update_results(node.index)
 
                         Events.trigger(Evt.RACE_LAP_RECORDED, {
                             'pilot_id': pilot_id,
@@ -3603,7 +3704,7 @@ def do_pass_record_callback(node, lap_timestamp_absolute, source):
                                 })
 
                         RaceContext.rhui.emit_current_laps() # update all laps on the race page
-                        RaceContext.rhui.emit_current_leaderboard() # generate and update leaderboard
+                        RaceContext.rhui.emit_current_leaderboard_update() # send leaderboard changes
 
                         if lap_number == 0:
                             RaceContext.rhui.emit_first_pass_registered(node.index) # play first-pass sound
@@ -3642,7 +3743,7 @@ def do_pass_record_callback(node, lap_timestamp_absolute, source):
                                     # if new leading pilot was not called out above (different pilot) then call out now
                                     if leader_pilot_id != pilot_id:
                                         RaceContext.rhui.emit_phonetic_leader(leader_pilot_id)
-                                        leader_pilot_obj = RaceContext.rhdata.get_pilot(leader_pilot_id)
+                                        leader_pilot_obj = snapshot.pilots.get(leader_pilot_id)
                                         if leader_pilot_obj:
                                             logger.info('Pilot {} is leading'.format(leader_pilot_obj.callsign))
                                     else:
@@ -3889,6 +3990,7 @@ def reset_current_laps():
     for idx in range(RaceContext.race.num_nodes):
         RaceContext.race.node_laps[idx] = []
 
+    RaceContext.race.clear_consecutives()
     RaceContext.race.clear_results()
     logger.debug('Database current laps reset')
 
@@ -4522,6 +4624,8 @@ if not db_inited_flag:
         if not RaceContext.rhdata.check_integrity():
             RaceContext.rhdata.recover_database(DB_FILE_NAME, startup=True)
             clean_results_cache()
+        else:
+            RaceContext.rhdata.ensure_indexes()
 
     except Exception as ex:
         logger.warning('Clearing all data after recovery failure:  ' + str(ex))
@@ -4556,7 +4660,7 @@ if strip:
     # Initialize the library (must be called once before other functions).
     try:
         strip.begin()
-        RaceContext.led_manager = LEDEventManager(Events, strip, RaceContext, RHAPI)
+        RaceContext.led_manager = LEDEventManager(Events, strip, RaceContext, RHAPI, Config.LED['LED_MAX_FPS'])
         init_LED_effects()
     except:
         logger.exception("Error initializing LED support")
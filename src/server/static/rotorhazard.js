@@ -1634,14 +1634,159 @@ jQuery(document).ready(function($){
 		}
 	});
 
+	// receive only broadcasts for topics this page handles
+	socket.on('connect', function () {
+		if (typeof(data_topics) != "undefined") {
+			socket.emit('subscribe_topics', {'topics': data_topics});
+		}
+	});
+
 	// store language strings
 	socket.on('all_languages', function (msg) {
-		rotorhazard.language_strings = msg.languages;
+		if (msg instanceof ArrayBuffer || ArrayBuffer.isView(msg)) {
+			// prebuilt JSON bundle of language dictionaries
+			var languages = JSON.parse(new TextDecoder('utf-8').decode(msg));
+			for (var lang in languages) {
+				rotorhazard.language_strings[lang] = languages[lang];
+			}
+		} else {
+			rotorhazard.language_strings = msg.languages;
+		}
 	});
 });
 }
 
+/* Heartbeat */
+function on_heartbeat(callback, compact_rate) {
+	// call back with heartbeat data; with compact_rate (per second), receive compact binary frames instead of JSON
+	socket.on('heartbeat', callback);
+
+	if (compact_rate) {
+		var heartbeat = null;
+		socket.on('heartbeat_compact', function (frame) {
+			heartbeat = decode_heartbeat_frame(frame, heartbeat);
+			callback(heartbeat);
+		});
+
+		var subscribe = function () {
+			heartbeat = null;
+			socket.emit('subscribe_compact_heartbeat', {'rate': compact_rate});
+		};
+		socket.on('connect', subscribe);
+		if (socket.connected)
+			subscribe();
+	}
+}
+
+function decode_heartbeat_frame(frame, previous) {
+	// unpack compact heartbeat frame (layout in HeartbeatStream.py), applying changes to previous data
+	if (frame instanceof ArrayBuffer) {
+		var view = new DataView(frame);
+	} else {
+		var view = new DataView(frame.buffer, frame.byteOffset, frame.byteLength);
+	}
+	var keyframe = view.getUint8(0) & 0x01;
+	var node_count = view.getUint8(1);
+	var offset = 2;
+
+	var read_mask = function () {
+		var flags = [];
+		for (var i = 0; i < node_count; i++) {
+			flags.push(Boolean(view.getUint8(offset + Math.floor(i / 8)) & (1 << (i % 8))));
+		}
+		offset += Math.ceil(node_count / 8);
+		return flags;
+	};
+
+	var heartbeat = {
+		'crossing_flag': read_mask()
+	};
+	var fields = [
+		['current_rssi', 'getInt16', 2],
+		['frequency', 'getUint16', 2],
+		['loop_time', 'getUint32', 4]
+	];
+	for (var f = 0; f < fields.length; f++) {
+		var field = fields[f][0];
+		var changed = read_mask();
+		var values = [];
+		for (var i = 0; i < node_count; i++) {
+			var last = (previous && !keyframe) ? previous[field][i] : 0;
+			if (changed[i]) {
+				var value = view[fields[f][1]](offset, true);
+				offset += fields[f][2];
+				if (field == 'current_rssi')
+					value += last; // rssi is sent as change from previous value
+				values.push(value);
+			} else {
+				values.push(last);
+			}
+		}
+		heartbeat[field] = values;
+	}
+	return heartbeat;
+}
+
 /* Leaderboards */
+function on_leaderboard(callback) {
+	// call back with each full leaderboard, and with the stored leaderboard after applying a compact update
+	socket.on('leaderboard', function (msg) {
+		rotorhazard.leaderboard_msg = msg;
+		callback(msg);
+	});
+
+	socket.on('leaderboard_update', function (update) {
+		var msg = rotorhazard.leaderboard_msg;
+		if (!msg || !msg.current || msg.current.version != update.base) {
+			// missed an update; request full leaderboard
+			socket.emit('load_data', {'load_types': ['leaderboard']});
+			return;
+		}
+
+		apply_leaderboard_update(msg.current.leaderboard, update);
+		msg.current.version = update.version;
+		msg.current.heat = update.heat;
+		msg.current.status_msg = update.status_msg;
+		callback(msg);
+	});
+}
+
+function apply_leaderboard_update(leaderboard, update) {
+	var rankings = ['by_race_time', 'by_fastest_lap', 'by_consecutives'];
+	for (var i in rankings) {
+		var ranking = rankings[i];
+		if (!(ranking in update))
+			continue;
+
+		var rows = {};
+		var order = [];
+		for (var j in leaderboard[ranking]) {
+			var row = leaderboard[ranking][j];
+			rows[row.node] = row;
+			order.push(row.node);
+		}
+
+		var changed_rows = update[ranking].rows || {};
+		for (var node in changed_rows) {
+			if (!(node in rows))
+				rows[node] = {};
+			for (var key in changed_rows[node]) {
+				rows[node][key] = changed_rows[node][key];
+			}
+		}
+
+		if ('order' in update[ranking])
+			order = update[ranking].order;
+
+		leaderboard[ranking] = order.map(function (node) {
+			return rows[node];
+		});
+	}
+
+	if ('meta' in update)
+		leaderboard.meta = update.meta;
+}
+
 function build_leaderboard(leaderboard, display_type, meta, display_starts=false) {
 	if (typeof(display_type) === 'undefined')
 		var display_type = 'by_race_time';
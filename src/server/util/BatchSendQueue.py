@@ -0,0 +1,208 @@
+# BatchSendQueue:  Sends messages in sequence-numbered batches with cumulative acknowledgements
+
+# Messages put on the queue are coalesced into batches, each emitted as a single 'cluster_batch'
+# message carrying a sequence number and a list of [messageType, messagePayload] items.  Up to
+# 'windowSize' batches may be in flight (sent but not yet acknowledged) at once.  The receiver
+# acknowledges cumulatively, with the highest sequence number it has processed in order; if the
+# oldest batch in flight is not acknowledged within the retry interval then all batches in flight
+# are resent (and the receiver ignores any it already processed).
+
+# Each batch also carries the sender's session id and the oldest sequence number the sender still
+# holds, so the receiver can tell when the sender has restarted or has given up on earlier batches.
+
+import random
+from collections import deque, OrderedDict
+import gevent
+import gevent.event
+from monotonic import monotonic
+
+BATCH_MESSAGE = 'cluster_batch'
+BATCH_ACK_MESSAGE = 'cluster_batch_ack'
+
+class BatchSendQueue:
+    """ Sends messages in windowed, sequence-numbered batches """
+
+    RETRY_INTERVAL_SECS = 3
+    RETRY_MAX_ATTEMPTS = 40  # retry for about two minutes max
+    LATENCY_HISTORY_SIZE = 30
+
+    def __init__(self, emitFn, logger, name, windowSize=4, maxBatchSize=32, batchDelaySecs=0.005, maxQueueSize=1000):
+        self.emitFn = emitFn
+        self.logger = logger
+        self.name = name
+        self.windowSize = windowSize
+        self.maxBatchSize = maxBatchSize
+        self.batchDelaySecs = batchDelaySecs
+        self.maxQueueSize = maxQueueSize
+        self.sessionId = '{:08x}'.format(random.getrandbits(32))
+        self.pendingMessages = deque()  # (messageType, messagePayload, putTime)
+        self.inFlightBatches = OrderedDict()  # seq -> batch info
+        self.nextSeq = 1
+        self.retryCount = 0
+        self.numDropped = 0
+        self.latenciesMs = deque(maxlen=self.LATENCY_HISTORY_SIZE)
+        self.notifyEventObj = gevent.event.Event()
+        self.runningFlag = True
+        self.workerThread = gevent.spawn(self.queueWorkerFn)
+
+    def put(self, messageType, messagePayload=None):
+        if len(self.pendingMessages) >= self.maxQueueSize:
+            self.numDropped += 1
+            self.logger.warning("BatchSendQueue ({0}) full; discarding msg: '{1}': {2}".\
+                                format(self.name, messageType, messagePayload))
+            return False
+        self.pendingMessages.append((messageType, messagePayload, monotonic()))
+        self.notifyEventObj.set()
+        return True
+
+    def ack(self, seq, sessionId=None):
+        '''Acknowledges all batches up to and including the given sequence number'''
+        if sessionId and sessionId != self.sessionId:
+            return
+        nowTime = monotonic()
+        ackedFlag = False
+        while self.inFlightBatches:
+            firstSeq = next(iter(self.inFlightBatches))
+            if firstSeq > seq:
+                break
+            batch = self.inFlightBatches.pop(firstSeq)
+            for putTime in batch['putTimes']:
+                self.latenciesMs.append((nowTime - putTime) * 1000)
+            ackedFlag = True
+        if ackedFlag:
+            self.retryCount = 0
+            self.notifyEventObj.set()
+
+    def clear(self):
+        '''Discards all pending and in-flight messages'''
+        numMessages = self.getQueueDepth()
+        self.pendingMessages.clear()
+        self.inFlightBatches.clear()
+        self.retryCount = 0
+        return numMessages
+
+    def stop(self):
+        self.runningFlag = False
+        self.workerThread.kill(block=False)
+
+    def getQueueDepth(self):
+        return len(self.pendingMessages) + sum(len(batch['putTimes']) for batch in self.inFlightBatches.values())
+
+    def getStats(self):
+        latencies = self.latenciesMs
+        return {
+            'queueDepth': self.getQueueDepth(),
+            'inFlight': len(self.inFlightBatches),
+            'avgLatencyMs': int(round(sum(latencies) / len(latencies))) if latencies else 0,
+            'maxLatencyMs': int(round(max(latencies))) if latencies else 0,
+            'lastLatencyMs': int(round(latencies[-1])) if latencies else 0,
+            'dropped': self.numDropped
+        }
+
+    def makeFrame(self, seq):
+        return {
+            'sid': self.sessionId,
+            'seq': seq,
+            'base': next(iter(self.inFlightBatches)),
+            'msgs': self.inFlightBatches[seq]['msgs']
+        }
+
+    def sendBatch(self, seq):
+        self.inFlightBatches[seq]['sendTime'] = monotonic()
+        self.emitFn(BATCH_MESSAGE, self.makeFrame(seq))
+
+    def checkRetry(self):
+        firstSeq = next(iter(self.inFlightBatches))
+        if monotonic() < self.inFlightBatches[firstSeq]['sendTime'] + self.RETRY_INTERVAL_SECS:
+            return
+        self.retryCount += 1
+        if self.retryCount > self.RETRY_MAX_ATTEMPTS:
+            batch = self.inFlightBatches.pop(firstSeq)
+            self.numDropped += len(batch['msgs'])
+            self.retryCount = 0
+            self.logger.warning("BatchSendQueue ({0}) retry limit reached; discarding batch {1} ({2} msgs)".\
+                                format(self.name, firstSeq, len(batch['msgs'])))
+            if not self.inFlightBatches:
+                return
+        else:
+            self.logger.info("BatchSendQueue ({0}) timeout reached (retryCount={1}); resending {2} batch(es) from {3}".\
+                             format(self.name, self.retryCount, len(self.inFlightBatches), firstSeq))
+        for seq in list(self.inFlightBatches):
+            self.sendBatch(seq)
+
+    def queueWorkerFn(self):
+        while self.runningFlag:
+            try:
+                self.notifyEventObj.wait(self.RETRY_INTERVAL_SECS / 3)
+                self.notifyEventObj.clear()
+                try:
+                    if self.inFlightBatches:
+                        self.checkRetry()
+                    if self.pendingMessages and len(self.inFlightBatches) < self.windowSize:
+                        if self.batchDelaySecs and len(self.pendingMessages) < self.maxBatchSize:
+                            gevent.sleep(self.batchDelaySecs)  # let messages emitted together share a batch
+                        while self.pendingMessages and len(self.inFlightBatches) < self.windowSize:
+                            msgs = []
+                            putTimes = []
+                            while self.pendingMessages and len(msgs) < self.maxBatchSize:
+                                (messageType, messagePayload, putTime) = self.pendingMessages.popleft()
+                                msgs.append([messageType, messagePayload])
+                                putTimes.append(putTime)
+                            seq = self.nextSeq
+                            self.nextSeq += 1
+                            self.inFlightBatches[seq] = { 'msgs': msgs, 'putTimes': putTimes, 'sendTime': 0 }
+                            self.sendBatch(seq)
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except Exception:
+                    self.logger.exception("BatchSendQueue ({0}) error sending batch".format(self.name))
+                    gevent.sleep(1)
+            except KeyboardInterrupt:
+                self.logger.info("BatchSendQueue worker thread terminated by keyboard interrupt")
+                raise
+            except SystemExit:
+                raise
+            except gevent.GreenletExit:
+                break
+            except Exception:
+                self.logger.exception("BatchSendQueue ({0}) error in worker thread (aborting thread)".format(self.name))
+                break
+
+
+class BatchReceiver:
+    """ Receives batches from a BatchSendQueue, dispatching messages in order """
+
+    def __init__(self, dispatchFn, ackFn, logger, name):
+        self.dispatchFn = dispatchFn
+        self.ackFn = ackFn
+        self.logger = logger
+        self.name = name
+        self.senderId = None
+        self.lastSeq = 0
+
+    def receive(self, frame):
+        seq = frame['seq']
+        base = frame.get('base', seq)
+        if frame.get('sid') != self.senderId:
+            if self.senderId is not None:
+                self.logger.info("BatchReceiver ({0}) new sender session".format(self.name))
+            self.senderId = frame.get('sid')
+            self.lastSeq = base - 1
+        elif base > self.lastSeq + 1:
+            self.logger.warning("BatchReceiver ({0}) sender gave up on batches {1} to {2}".\
+                                format(self.name, self.lastSeq + 1, base - 1))
+            self.lastSeq = base - 1
+
+        if seq == self.lastSeq + 1:
+            self.lastSeq = seq
+            for messageType, messagePayload in frame['msgs']:
+                try:
+                    self.dispatchFn(messageType, messagePayload)
+                except Exception:
+                    self.logger.exception("BatchReceiver ({0}) error processing msg: '{1}': {2}".\
+                                          format(self.name, messageType, messagePayload))
+        elif seq > self.lastSeq + 1:
+            self.logger.debug("BatchReceiver ({0}) ignoring out-of-order batch {1} (expected {2})".\
+                              format(self.name, seq, self.lastSeq + 1))
+        # acknowledge in-order progress (repeats the ack for duplicates and out-of-order batches)
+        self.ackFn({ 'sid': self.senderId, 'seq': self.lastSeq })
@@ -0,0 +1,89 @@
+# ClockSync:  Estimates the offset and drift of a remote clock from query round trips
+
+from collections import deque
+
+class ClockOffsetEstimator:
+    """
+    NTP-style clock offset estimator. Each sample is a query round trip: local
+    send time, the remote clock time when responding, and local receive time.
+    The remote time is assumed to be taken midway through the round trip, so a
+    sample's error is at most half its round-trip time; only the samples with
+    the lowest round-trip times are used, and a line fitted through them gives
+    the offset and its drift over time.
+    """
+    MIN_FIT_SAMPLES = 3
+    MAX_DRIFT_PPM = 500  # larger fitted drift is treated as noise
+
+    def __init__(self, maxNumSamples=128, bestFraction=0.25, minDriftSpanMs=60000):
+        self.maxNumSamples = maxNumSamples
+        self.bestFraction = bestFraction
+        self.minDriftSpanMs = minDriftSpanMs
+        self.reset()
+
+    def reset(self):
+        self.samples = deque(maxlen=self.maxNumSamples)  # (local time, offset, round-trip time), in ms
+        self.offsetMs = 0     # offset at 'refTimeMs'
+        self.refTimeMs = 0
+        self.driftPpm = 0
+        self.minRttMs = 0
+        self.jitterMs = 0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def addSample(self, sendMs, remoteMs, recvMs):
+        """Adds a round trip (local send and receive times, and remote time); returns False if invalid"""
+        rttMs = recvMs - sendMs
+        if rttMs < 0:
+            return False
+        localMs = (sendMs + recvMs) / 2
+        self.samples.append((localMs, remoteMs - localMs, rttMs))
+        self.update()
+        return True
+
+    def update(self):
+        bestSamples = sorted(self.samples, key=lambda sample: sample[2])
+        self.minRttMs = bestSamples[0][2]
+        bestSamples = bestSamples[:max(self.MIN_FIT_SAMPLES, int(len(bestSamples) * self.bestFraction))]
+
+        count = len(bestSamples)
+        meanTime = sum(sample[0] for sample in bestSamples) / count
+        meanOffset = sum(sample[1] for sample in bestSamples) / count
+        slope = 0
+        if count >= self.MIN_FIT_SAMPLES:
+            timeSpan = max(sample[0] for sample in bestSamples) - min(sample[0] for sample in bestSamples)
+            if timeSpan >= self.minDriftSpanMs:
+                # least-squares line through the best samples
+                sumTimeSq = sum((sample[0] - meanTime) ** 2 for sample in bestSamples)
+                slope = sum((sample[0] - meanTime) * (sample[1] - meanOffset) for sample in bestSamples) / sumTimeSq
+                if abs(slope) * 1e6 > self.MAX_DRIFT_PPM:
+                    slope = 0
+
+        self.refTimeMs = meanTime
+        self.offsetMs = meanOffset
+        self.driftPpm = slope * 1e6
+        residuals = [sample[1] - (meanOffset + slope * (sample[0] - meanTime)) for sample in bestSamples]
+        self.jitterMs = (sum(residual ** 2 for residual in residuals) / count) ** 0.5
+
+    def getOffsetMs(self, localMs=None):
+        """Returns the estimated remote-minus-local clock offset at the given local time"""
+        if not self.samples:
+            return 0
+        if localMs is None:
+            return self.offsetMs
+        return self.offsetMs + self.driftPpm * 1e-6 * (localMs - self.refTimeMs)
+
+    def toLocalMs(self, remoteMs):
+        """Converts a remote clock time to local clock time"""
+        if not self.samples:
+            return remoteMs
+        return remoteMs - self.getOffsetMs(remoteMs - self.offsetMs)
+
+    def getStats(self, localMs=None):
+        return {
+            'offsetMs': round(self.getOffsetMs(localMs), 1),
+            'minRttMs': round(self.minRttMs, 1),
+            'jitterMs': round(self.jitterMs, 1),
+            'driftPpm': round(self.driftPpm, 1),
+            'numSamples': len(self.samples)
+        }
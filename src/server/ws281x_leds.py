@@ -4,6 +4,18 @@ import importlib
 import logging
 logger = logging.getLogger(__name__)
 
+def make_bulk_pixel_class(Pixel):
+    '''Returns a subclass of the library's pixel class that can set pixels in bulk'''
+    class BulkPixel(Pixel):
+        def setPixels(self, colors, start=0):
+            end = min(start + len(colors), self.numPixels())
+            try:
+                self._led_data[start:end] = colors[:end - start]
+            except (AttributeError, TypeError):
+                for pos in range(start, end):
+                    self.setPixelColor(pos, colors[pos - start])
+    return BulkPixel
+
 def get_pixel_interface(config, brightness, *args, **kwargs):
     '''Returns the pixel interface.'''
 
@@ -48,4 +60,4 @@ def get_pixel_interface(config, brightness, *args, **kwargs):
         return None
 
     logger.info('LED: hardware GPIO enabled, count={0}, pin={1}, freqHz={2}, dma={3}, invert={4}, chan={5}, strip={6}/{7}'.format(config['LED_COUNT'], config['LED_GPIO'], config['LED_FREQ_HZ'], config['LED_DMA'], config['LED_INVERT'], config['LED_CHANNEL'], led_strip_config, led_strip))
-    return Pixel(config['LED_COUNT'], config['LED_GPIO'], config['LED_FREQ_HZ'], config['LED_DMA'], config['LED_INVERT'], brightness, config['LED_CHANNEL'], led_strip)
+    return make_bulk_pixel_class(Pixel)(config['LED_COUNT'], config['LED_GPIO'], config['LED_FREQ_HZ'], config['LED_DMA'], config['LED_INVERT'], brightness, config['LED_CHANNEL'], led_strip)
@@ -0,0 +1,92 @@
+'''python bench_db_commits.py [changes]
+
+Measures committed changes per second for small option updates, as made by
+RHData.set_option, with the default rollback journal (a disk sync on every
+commit), then with WAL journaling and 'synchronous=NORMAL', and then with
+commits also grouped by RHData's commit coalescer.
+'''
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import os
+import sys
+import tempfile
+import gevent
+from timeit import default_timer
+
+sys.path.append('../server')
+sys.path.append('../server/util')
+sys.path.append('../interface')
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+import Database
+from RHData import RHData, CommitCoalescer
+
+OPTION_COUNT = 50
+COMMIT_WINDOW = 0.05 # seconds
+
+def set_options(session, change_count, commit_fn):
+    options = session.query(Database.GlobalSettings).all()
+    start = default_timer()
+    for index in range(change_count):
+        option = options[index % OPTION_COUNT]
+        option.option_value = str(index)
+        commit_fn(session)
+        gevent.sleep(0) # let other greenlets (and the coalescer) run, as the server would
+    return default_timer() - start
+
+def run(db_file, change_count, wal_mode=False, coalesce=False):
+    engine = create_engine('sqlite:///{}'.format(db_file))
+    if wal_mode:
+        event.listen(engine, 'connect', RHData._on_connect)
+    Database.DB.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(Database.GlobalSettings.__table__.delete())
+        conn.execute(Database.GlobalSettings.__table__.insert(), [{'option_name': 'option{}'.format(index),
+            'option_value': ''} for index in range(OPTION_COUNT)])
+
+    if wal_mode:
+        wal_connection = engine.raw_connection() # as held by RHData, so the log persists between sessions
+    session = sessionmaker(bind=engine)()
+    commits = []
+    event.listen(session, 'after_commit', lambda _session: commits.append(1))
+    try:
+        if coalesce:
+            coalescer = CommitCoalescer(COMMIT_WINDOW)
+            elapsed = set_options(session, change_count, coalescer.defer)
+            start = default_timer()
+            coalescer.commit_pending()
+            elapsed += default_timer() - start
+        else:
+            elapsed = set_options(session, change_count, lambda session: session.commit())
+    finally:
+        session.close()
+        if wal_mode:
+            wal_connection.close()
+        engine.dispose()
+    return change_count / elapsed, len(commits)
+
+def main():
+    change_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    db_dir = tempfile.mkdtemp()
+    db_file = os.path.join(db_dir, 'bench.db')
+    try:
+        print('{:<34}{:>14}{:>10}'.format('mode', 'changes/s', 'commits'))
+        baseline = None
+        for name, kwargs in [
+                ('rollback journal, synchronous=FULL', {}),
+                ('WAL, synchronous=NORMAL', {'wal_mode': True}),
+                ('WAL + coalesced commits', {'wal_mode': True, 'coalesce': True})]:
+            rate, commits = run(db_file, change_count, **kwargs)
+            baseline = baseline or rate
+            print('{:<34}{:>14.0f}{:>10}  ({:.1f}x)'.format(name, rate, commits, rate / baseline))
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+        os.rmdir(db_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+'''python bench_db_indexes.py [laps]
+
+Times saved-race lookups against a synthetic database (50k laps by default),
+first without and then with the secondary indexes defined in Database.py.
+'''
+import os
+import sys
+import random
+import tempfile
+from timeit import default_timer
+
+sys.path.append('../server')
+
+from sqlalchemy import create_engine, inspect
+import Database
+
+LAPS_PER_PILOTRACE = 10
+NODES_PER_RACE = 8
+HEAT_COUNT = 50
+PILOT_COUNT = 64
+LOOKUP_COUNT = 500
+
+def build_database(engine, lap_count):
+    Database.DB.metadata.create_all(engine)
+
+    # start without secondary indexes, as in databases from older versions
+    for table in Database.DB.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(bind=engine)
+
+    race_count = lap_count // (LAPS_PER_PILOTRACE * NODES_PER_RACE)
+    heats = []
+    heatnodes = []
+    races = []
+    pilotraces = []
+    laps = []
+
+    for heat_id in range(1, HEAT_COUNT + 1):
+        heats.append({'id': heat_id, 'class_id': 0, 'cacheStatus': '', 'status': 0,
+            'auto_frequency': False})
+        for node_index in range(NODES_PER_RACE):
+            heatnodes.append({'heat_id': heat_id, 'node_index': node_index,
+                'pilot_id': random.randint(1, PILOT_COUNT), 'method': 0})
+
+    for race_id in range(1, race_count + 1):
+        heat_id = (race_id - 1) % HEAT_COUNT + 1
+        races.append({'id': race_id, 'round_id': (race_id - 1) // HEAT_COUNT + 1,
+            'heat_id': heat_id, 'class_id': 0, 'format_id': 1, 'start_time': 0,
+            'start_time_formatted': '', 'cacheStatus': ''})
+        for node_index in range(NODES_PER_RACE):
+            pilotrace_id = len(pilotraces) + 1
+            pilot_id = random.randint(1, PILOT_COUNT)
+            pilotraces.append({'id': pilotrace_id, 'race_id': race_id,
+                'node_index': node_index, 'pilot_id': pilot_id, 'penalty_time': 0,
+                'enter_at': 0, 'exit_at': 0})
+            for lap_index in range(LAPS_PER_PILOTRACE):
+                laps.append({'race_id': race_id, 'pilotrace_id': pilotrace_id,
+                    'node_index': node_index, 'pilot_id': pilot_id,
+                    'lap_time_stamp': lap_index * 20000, 'lap_time': 20000,
+                    'lap_time_formatted': '20.000', 'source': 0, 'deleted': False})
+
+    with engine.begin() as conn:
+        conn.execute(Database.Pilot.__table__.insert(), [{'id': pilot_id,
+            'callsign': 'Pilot {}'.format(pilot_id), 'name': '', 'team': 'A',
+            'phonetic': ''} for pilot_id in range(1, PILOT_COUNT + 1)])
+        conn.execute(Database.Heat.__table__.insert(), heats)
+        conn.execute(Database.HeatNode.__table__.insert(), heatnodes)
+        conn.execute(Database.SavedRaceMeta.__table__.insert(), races)
+        conn.execute(Database.SavedPilotRace.__table__.insert(), pilotraces)
+        conn.execute(Database.SavedRaceLap.__table__.insert(), laps)
+
+    return race_count, len(pilotraces), len(laps)
+
+def run_lookups(engine, race_count, pilotrace_count):
+    lap_table = Database.SavedRaceLap.__table__
+    pilotrace_table = Database.SavedPilotRace.__table__
+    heatnode_table = Database.HeatNode.__table__
+    race_table = Database.SavedRaceMeta.__table__
+
+    lookups = [
+        ('laps by race', lambda conn: conn.execute(lap_table.select().where(
+            lap_table.c.race_id == random.randint(1, race_count))).fetchall()),
+        ('laps by pilotrace', lambda conn: conn.execute(lap_table.select().where(
+            lap_table.c.pilotrace_id == random.randint(1, pilotrace_count))).fetchall()),
+        ('laps by pilot', lambda conn: conn.execute(lap_table.select().where(
+            lap_table.c.pilot_id == random.randint(1, PILOT_COUNT))).fetchall()),
+        ('pilotraces by race', lambda conn: conn.execute(pilotrace_table.select().where(
+            pilotrace_table.c.race_id == random.randint(1, race_count))).fetchall()),
+        ('pilotraces by pilot', lambda conn: conn.execute(pilotrace_table.select().where(
+            pilotrace_table.c.pilot_id == random.randint(1, PILOT_COUNT))).fetchall()),
+        ('heatnodes by pilot', lambda conn: conn.execute(heatnode_table.select().where(
+            heatnode_table.c.pilot_id == random.randint(1, PILOT_COUNT))).fetchall()),
+        ('races by heat', lambda conn: conn.execute(race_table.select().where(
+            race_table.c.heat_id == random.randint(1, HEAT_COUNT))).fetchall()),
+    ]
+
+    results = {}
+    with engine.connect() as conn:
+        for name, lookup in lookups:
+            random.seed(name)
+            start = default_timer()
+            for _i in range(LOOKUP_COUNT):
+                lookup(conn)
+            results[name] = (default_timer() - start) / LOOKUP_COUNT
+    return results
+
+def create_indexes(engine):
+    inspector = inspect(engine)
+    for table in Database.DB.metadata.sorted_tables:
+        existing_indexes = [index['name'] for index in inspector.get_indexes(table.name)]
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=engine)
+
+def main():
+    lap_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    random.seed(0)
+
+    db_dir = tempfile.mkdtemp()
+    db_file = os.path.join(db_dir, 'bench.db')
+    engine = create_engine('sqlite:///{}'.format(db_file))
+    try:
+        race_count, pilotrace_count, laps = build_database(engine, lap_count)
+        print('Synthetic database: {} races, {} pilotraces, {} laps'.format(race_count, pilotrace_count, laps))
+
+        before = run_lookups(engine, race_count, pilotrace_count)
+        start = default_timer()
+        create_indexes(engine)
+        print('Index creation: {:.3f}s'.format(default_timer() - start))
+        after = run_lookups(engine, race_count, pilotrace_count)
+
+        print('{:<22}{:>14}{:>14}{:>10}'.format('lookup', 'no index (ms)', 'indexed (ms)', 'speedup'))
+        for name in before:
+            print('{:<22}{:>14.3f}{:>14.3f}{:>9.1f}x'.format(name,
+                before[name] * 1000, after[name] * 1000, before[name] / after[name]))
+    finally:
+        engine.dispose()
+        os.remove(db_file)
+        os.rmdir(db_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+'''python bench_log_pipeline.py [records]
+
+Logs DEBUG-level pass records to a log file, as the race loop does, and
+measures the delay each logging call adds to the calling code and the
+number of records per second written to the file. Runs with a plain file
+handler (formatted and written in the caller), with the previous queued
+handler (a 99-entry queue with a 1 ms pause per record), and with
+log.QueuedLogEventHandler.
+'''
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import os
+import sys
+import logging
+import tempfile
+import gevent
+import gevent.queue
+from timeit import default_timer
+
+sys.path.append('../server')
+
+import log
+
+class PreviousQueuedHandler(logging.Handler):
+    '''The queued handler as it was before records were written in batches'''
+    def __init__(self, dest_hndlr):
+        super(PreviousQueuedHandler, self).__init__()
+        self.dest_hndlr = dest_hndlr
+        self.log_record_queue = gevent.queue.Queue(maxsize=99)
+        self.num_dropped = 0
+        gevent.spawn(self.queueWorkerFn)
+
+    def queueWorkerFn(self):
+        while True:
+            log_rec = self.log_record_queue.get()
+            gevent.sleep(0.001)
+            self.dest_hndlr.emit(log_rec)
+
+    def emit(self, record):
+        try:
+            self.log_record_queue.put(record, timeout=1)
+        except Exception:
+            self.num_dropped += 1
+
+    def waitForQueueEmpty(self):
+        while not self.log_record_queue.empty():
+            gevent.sleep(0.01)
+
+def wait_for_written(hndlr):
+    if isinstance(hndlr, PreviousQueuedHandler):
+        hndlr.waitForQueueEmpty()
+    else:
+        while hndlr.log_record_queue or hndlr.writing_flag:
+            gevent.sleep(0.001)
+
+def run(log_file, record_count, make_handler):
+    file_hndlr = logging.FileHandler(log_file, mode='w')
+    file_hndlr.setFormatter(logging.Formatter(fmt=log.FILELOG_FORMAT_STR, datefmt='%Y-%m-%d %H:%M:%S'))
+    hndlr = make_handler(file_hndlr)
+    logger = logging.getLogger('bench')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(hndlr)
+
+    delays = []
+    start = default_timer()
+    try:
+        for index in range(record_count):
+            call_start = default_timer()
+            logger.debug('Pass record: Node: %d, Lap: %d, Lap time: %.3f', index % 8 + 1, index // 8, 12.345)
+            delays.append(default_timer() - call_start)
+            gevent.sleep(0)  # the race loop yields between passes
+        if hndlr is not file_hndlr:
+            wait_for_written(hndlr)
+        elapsed = default_timer() - start
+    finally:
+        logger.removeHandler(hndlr)
+        file_hndlr.close()
+
+    with open(log_file) as f:
+        written = sum(1 for _line in f)
+    delays.sort()
+    return {
+        'rate': written / elapsed,
+        'avg_us': sum(delays) / len(delays) * 1e6,
+        'p99_us': delays[int(len(delays) * 0.99)] * 1e6,
+        'max_us': delays[-1] * 1e6,
+        'dropped': record_count - written
+    }
+
+def main():
+    record_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    log_dir = tempfile.mkdtemp()
+    log_file = os.path.join(log_dir, 'bench.log')
+    try:
+        print('{:<22}{:>12}{:>10}{:>10}{:>10}{:>9}'.format('handler', 'records/s', 'avg us', 'p99 us', 'max us', 'dropped'))
+        for name, make_handler in [
+                ('file (direct)', lambda hndlr: hndlr),
+                ('previous queue', PreviousQueuedHandler),
+                ('batched queue', log.QueuedLogEventHandler)]:
+            result = run(log_file, record_count, make_handler)
+            print('{:<22}{rate:>12.0f}{avg_us:>10.1f}{p99_us:>10.1f}{max_us:>10.0f}{dropped:>9}'.format(name, **result))
+    finally:
+        if os.path.exists(log_file):
+            os.remove(log_file)
+        os.rmdir(log_dir)
+
+if __name__ == '__main__':
+    main()
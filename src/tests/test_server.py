@@ -1,10 +1,18 @@
 '''python -m unittest discover'''
 import os
+import io
+import logging
+import json
+import random
+import re
+import sqlite3
 import sys
 import unittest
 import gevent
 from datetime import datetime
+from monotonic import monotonic
 from flask.blueprints import Blueprint
+from sqlalchemy import inspect
 
 sys.path.append('../server')
 sys.path.append('../server/util')
@@ -14,7 +22,23 @@ sys.path.append('../interface')
 os.environ['RH_INTERFACE'] = 'Mock'
 
 import server
+import log
+import RHData
+import RHUtils
+import Results
+import HeartbeatStream
+import RHInterface
+from HistoryBuffer import HistoryBuffer
+from ClockSync import ClockOffsetEstimator
+from BatchSendQueue import BatchSendQueue, BatchReceiver
+from eventmanager import EventManager
+import led_event_manager
+from led_event_manager import PanelFramebuffer, LEDRenderer, Color, ColorVal
+import RssiHistory
+import rh_data_export_json
+import Language
 from Node import Node
+import RHUI
 from RHUI import UIField, UIFieldType
 
 class ServerTest(unittest.TestCase):
@@ -593,6 +617,901 @@ class ServerTest(unittest.TestCase):
         readings = sensor.getReadings()
         self.assertEqual(readings['counter']['value'], count+1)
 
-        
+
+    def save_test_race(self, heat_id, pilot_id, lap_times):
+        rhdata = server.RaceContext.rhdata
+        race = rhdata.add_savedRaceMeta({
+            'round_id': rhdata.get_max_round(heat_id) + 1,
+            'heat_id': heat_id,
+            'class_id': RHUtils.CLASS_ID_NONE,
+            'format_id': 1,
+            'start_time': 0,
+            'start_time_formatted': '2000-01-01 00:00:00',
+        })
+        laps = []
+        time_stamp = 0
+        for lap_time in lap_times:
+            time_stamp += lap_time
+            laps.append({
+                'lap_time_stamp': time_stamp,
+                'lap_time': lap_time,
+                'lap_time_formatted': str(lap_time),
+                'source': 0,
+                'deleted': False
+            })
+        rhdata.add_race_data({
+            0: {
+                'race_id': race.id,
+                'pilot_id': pilot_id,
+                'history_values': '[]',
+                'history_times': '[]',
+                'enter_at': 0,
+                'exit_at': 0,
+                'frequency': 5658,
+                'laps': laps
+            }
+        })
+        return race
+
+    def test_saved_race_data(self):
+        rhdata = server.RaceContext.rhdata
+        pilot_id = rhdata.get_pilots()[0].id
+        heat = server.RHAPI.db.heat_add()
+        race_1 = self.save_test_race(heat.id, pilot_id, [1000, 20000, 21000])
+        race_2 = self.save_test_race(heat.id, pilot_id, [1500, 22000])
+
+        race_data = rhdata.get_savedRaceData(heat_id=heat.id)
+        self.assertEqual([race.id for race in race_data['races']], [race_1.id, race_2.id])
+        pilotrace = race_data['pilotraces'][race_2.id][0]
+        self.assertEqual(pilotrace.pilot_id, pilot_id)
+        self.assertEqual([lap.lap_time for lap in race_data['laps'][pilotrace.id]], [1500, 22000])
+        self.assertEqual(race_data['pilots'][pilot_id].id, pilot_id)
+
+        race_data = rhdata.get_savedRaceData(heat_id=heat.id, round_id=2, load_laps=False)
+        self.assertEqual([race.id for race in race_data['races']], [race_2.id])
+        self.assertEqual(race_data['laps'][pilotrace.id], [])
+
+        rhdata.clear_race_data()
+
+    def test_history_buffer(self):
+        history = HistoryBuffer(capacity=8, initial_size=2)
+        for index in range(6):
+            history.append(40 + index, 100.0 + index)
+        self.assertEqual(len(history), 6)
+        self.assertEqual(history.last_value(2), 44)
+        history.set_last_time(105.5)
+        self.assertEqual(history.times, [100.0, 101.0, 102.0, 103.0, 104.0, 105.5])
+
+        history.trim_before(102.0)
+        self.assertEqual(history.values, [42, 43, 44, 45])
+
+        # wraps around storage, then overwrites oldest entries once at capacity
+        for index in range(6, 12):
+            history.append(40 + index, 100.0 + index)
+        self.assertEqual(history.values, [44, 45, 46, 47, 48, 49, 50, 51])
+        values, times = history.view()
+        self.assertIsInstance(values, memoryview)
+        self.assertEqual(values.tolist(), history.values)
+        self.assertEqual(times.tolist()[0], 104.0)
+
+        history.clear()
+        self.assertEqual(history.values, [])
+
+        node = Node()
+        pn_history = RHInterface.PeakNadirHistory(0)
+        pn_history.peakRssi = 90
+        pn_history.peakFirstTime = 200
+        pn_history.peakLastTime = 100
+        pn_history.addTo(10.0, node.history, None)
+        self.assertEqual(node.history_values, [90, 90])
+        self.assertEqual(node.history_times, [9.8, 9.9])
+
+    def test_rssi_history_packing(self):
+        history_values = [40, 42, 120, 118, 45, 44]
+        history_times = [1000.25, 1000.5, 1001.125, 1001.2, 1001.9, 1005.0]
+        data = RssiHistory.pack(history_values, history_times)
+        self.assertEqual(RssiHistory.unpack(data), (history_values, history_times))
+        self.assertEqual(RssiHistory.unpack(RssiHistory.pack([20.5, 21.0], [3.0, 3.001])), ([20.5, 21.0], [3.0, 3.001]))
+        self.assertIsNone(RssiHistory.pack([20.25], [3.0]))
+        self.assertEqual(RssiHistory.unpack(RssiHistory.pack([], [])), ([], []))
+
+        # long histories compress well below their JSON size
+        history_values = [40 + (index % 50) for index in range(5000)]
+        history_times = [1000 + index * 0.0123 for index in range(5000)]
+        data = RssiHistory.pack(history_values, history_times)
+        self.assertLess(len(data), len(json.dumps(history_values) + json.dumps(history_times)) / 4)
+        history_values, unpacked_times = RssiHistory.unpack(data)
+        self.assertEqual(history_values, [40 + (index % 50) for index in range(5000)])
+        for time, unpacked_time in zip(history_times, unpacked_times):
+            self.assertAlmostEqual(time, unpacked_time, delta=0.0006)
+
+        # JSON history from older versions is read as-is, then packed
+        rhdata = server.RaceContext.rhdata
+        heat = server.RHAPI.db.heat_add()
+        race = self.save_test_race(heat.id, server.RHAPI.db.pilot_add().id, [1000])
+        pilotrace = rhdata.get_savedPilotRaces_by_savedRaceMeta(race.id)[0]
+        pilotrace.history_data = None
+        pilotrace.history_values = '[40, 41.5]'
+        pilotrace.history_times = '[10.0, 10.25]'
+        rhdata.commit()
+        self.assertEqual(rhdata.get_savedPilotRace_history(pilotrace), ([40, 41.5], [10.0, 10.25]))
+        self.assertEqual(server.RHAPI.db.pilotrun_history(pilotrace.id), ([40, 41.5], [10.0, 10.25]))
+        exported = [item for item in json.loads(rh_data_export_json.write_json(
+            rh_data_export_json.assemble_pilotrace_complete(server.RHAPI))['data']) if item['id'] == pilotrace.id]
+        self.assertEqual(exported[0]['history_values'], [40, 41.5])
+        rhdata.pack_savedPilotRace_histories()
+        self.assertIsNotNone(pilotrace.history_data)
+        self.assertIsNone(pilotrace.history_values)
+        self.assertEqual(rhdata.get_savedPilotRace_history(pilotrace), ([40, 41.5], [10.0, 10.25]))
+        exported = [item for item in json.loads(rh_data_export_json.write_json(
+            rh_data_export_json.assemble_pilotrace_complete(server.RHAPI))['data']) if item['id'] == pilotrace.id]
+        self.assertEqual(exported[0]['history_values'], [40, 41.5])
+        self.assertEqual(exported[0]['history_times'], [10.0, 10.25])
+        self.assertNotIn('history_data', exported[0])
+        self.assertFalse(server.RHAPI.db.pilotrun_history(-1))
+
+        rhdata.clear_race_data()
+
+    def test_database_backup(self):
+        rhdata = server.RaceContext.rhdata
+        progress = []
+        ticks = []
+        ticker = gevent.spawn(lambda: [ticks.append(1) or gevent.sleep(0) for _i in range(1000)])
+        bkp_names = [rhdata.backup_db_file(True, 'testBkp_', progress_fn=progress.append),
+            rhdata.backup_db_file(True, 'testBkp_', compress=True, progress_fn=progress.append)]
+        ticker.kill()
+        self.assertEqual(progress[-1], 100.0)
+        self.assertGreater(len(ticks), 0) # other greenlets ran during the backup
+        self.assertTrue(bkp_names[1].endswith('.db.gz'))
+
+        try:
+            for bkp_name in bkp_names:
+                db_name = rhdata.extract_db_backup(bkp_name)
+                conn = sqlite3.connect(db_name)
+                self.assertEqual(conn.execute('SELECT COUNT(*) FROM pilot').fetchone()[0], len(rhdata.get_pilots()))
+                conn.close()
+                if db_name != bkp_name:
+                    os.remove(db_name)
+
+            rhdata.delete_old_db_autoBkp_files(1, 'testBkp_', 'DB_AUTOBKP_NUM_KEEP')
+            self.assertEqual([os.path.exists(bkp_name) for bkp_name in bkp_names], [False, True])
+        finally:
+            for bkp_name in bkp_names:
+                if os.path.exists(bkp_name):
+                    os.remove(bkp_name)
+
+    def test_database_backup_failure(self):
+        class FailingGzip:
+            def open(self, name, mode):
+                return FailingGzipFile(name)
+
+        class FailingGzipFile(io.FileIO):
+            def __init__(self, name):
+                super().__init__(name, 'wb')
+            def write(self, data):
+                super().write(data[:100])
+                raise IOError('disk full')
+
+        rhdata = server.RaceContext.rhdata
+        bkp_dir = server.DB_BKP_DIR_NAME
+        if not os.path.exists(bkp_dir):
+            os.makedirs(bkp_dir)
+        bkp_files = set(os.listdir(bkp_dir))
+        self.client.get_received()
+
+        gzip_module = RHData.gzip
+        compress_flag = server.Config.GENERAL['DB_BKP_COMPRESS']
+        RHData.gzip = FailingGzip()
+        server.Config.GENERAL['DB_BKP_COMPRESS'] = True
+        try:
+            self.assertIsNone(rhdata.backup_db_file(True, 'testBkp_', compress=True))
+            self.client.emit('backup_database')
+        finally:
+            RHData.gzip = gzip_module
+            server.Config.GENERAL['DB_BKP_COMPRESS'] = compress_flag
+
+        self.assertEqual(set(os.listdir(bkp_dir)), bkp_files) # no partial backups left behind
+        events = [resp['name'] for resp in self.client.get_received()]
+        self.assertIn('database_bkp_failed', events) # lets the page re-enable its backup button
+        self.assertNotIn('database_bkp_done', events)
+
+    def test_clock_offset_estimator(self):
+        rng = random.Random(3)
+        estimator = ClockOffsetEstimator()
+        self.assertEqual(estimator.toLocalMs(5000), 5000)
+
+        # remote clock 1500 ms ahead and running 40 ppm fast; asymmetric, jittery network delays
+        remote_time = lambda local_ms: local_ms + 1500 + 40e-6 * local_ms
+        for local_ms in range(0, 300000, 2000):
+            out_ms = 2 + rng.expovariate(1 / 15.0)
+            back_ms = 2 + rng.expovariate(1 / 15.0)
+            estimator.addSample(local_ms, remote_time(local_ms + out_ms), local_ms + out_ms + back_ms)
+
+        stats = estimator.getStats(300000)
+        self.assertEqual(stats['numSamples'], 128)
+        self.assertAlmostEqual(stats['offsetMs'], 1512, delta=3)
+        self.assertAlmostEqual(stats['driftPpm'], 40, delta=20)
+        self.assertLess(stats['minRttMs'], 6)
+        self.assertAlmostEqual(estimator.toLocalMs(remote_time(310000)), 310000, delta=3)
+
+    def test_event_dispatch_pool(self):
+        events = EventManager(server.RHAPI, pool_size=2)
+        events.events = {}  # keep clear of the server's handlers
+        events.dispatchTable = {}
+        calls = []
+        events.on('testSync', 'second', lambda args: calls.append(('second', args.get('value'))), priority=50)
+        events.on('testSync', 'first', lambda args: calls.append(('first', args['value'])), {'value': 0}, priority=20)
+        events.trigger('testSync')
+        events.trigger('testSync', {'value': 1})
+        self.assertEqual(calls, [('first', 0), ('second', None), ('first', 1), ('second', 1)])
+
+        events.off('testSync', 'first')
+        events.trigger('testSync', {'value': 2})
+        self.assertEqual(calls[-1], ('second', 2))
+        self.assertEqual(len(calls), 5)
+
+        def slow_handler(args):
+            gevent.sleep(0.05)
+            calls.append(args['tag'])
+        for name in ('slow1', 'slow2', 'slow3'):
+            events.on('testAsync', name, slow_handler, {'tag': name})
+        events.trigger('testAsync')
+        self.assertEqual(events.get_pool_status(), {'running': 2, 'waiting': 1, 'size': 2})
+        gevent.sleep(0.01)
+        events.trigger('testAsync')  # restarts running handlers and replaces the waiting one
+        gevent.sleep(0.3)
+        self.assertEqual(sorted(calls[5:]), ['slow1', 'slow2', 'slow3'])
+        self.assertEqual(events.get_pool_status()['running'], 0)
+
+        stats = {(item['event'], item['name']): item for item in events.get_handler_stats()}
+        self.assertEqual(stats[('testSync', 'second')]['count'], 3)
+        self.assertEqual(stats[('testAsync', 'slow1')]['count'], 2)
+        self.assertEqual(stats[('testAsync', 'slow1')]['cancelled'], 1)
+        self.assertGreaterEqual(stats[('testAsync', 'slow1')]['max_ms'], 40)
+
+        for name in ('slow1', 'slow2', 'slow3'):
+            events.off('testAsync', name)
+        events.off('testSync', 'second')
+        events.reset_handler_stats()
+        self.assertEqual(events.get_handler_stats(), [])
+
+    def test_event_profiling(self):
+        events = EventManager(server.RHAPI, pool_size=1)
+        events.events = {}  # keep clear of the server's handlers
+        events.dispatchTable = {}
+        events.set_latency_budget(20)
+        self.assertEqual(events.get_latency_budget(), 20)
+
+        def failing_handler(_args):
+            raise ValueError('test')
+        def busy_handler(_args):
+            endTime = monotonic() + 0.03
+            while monotonic() < endTime:
+                pass
+        events.on('testProfile', 'fast', lambda args: None, priority=50)
+        events.on('testProfile', 'failing', failing_handler, priority=60)
+        events.on('testProfile', 'slow1', busy_handler)
+        events.on('testProfile', 'slow2', busy_handler)
+        with self.assertLogs('eventmanager', 'WARNING') as logs:
+            events.trigger('testProfile')
+            gevent.sleep(0.1)
+        self.assertEqual(len([line for line in logs.output if 'Slow handler' in line]), 2)
+
+        stats = {item['name']: item for item in events.get_handler_stats()}
+        self.assertEqual(stats['failing']['errors'], 1)
+        self.assertEqual(stats['fast']['queue_delay']['count'], 0)
+        self.assertEqual(stats['slow1']['over_budget'], 1)
+        self.assertEqual(sum(stats['slow1']['histogram']), 1)
+        self.assertEqual(stats['slow1']['p50_ms'], stats['slow1']['max_ms'])
+        self.assertGreaterEqual(stats['slow1']['loop_time']['max_ms'], 25)
+        self.assertLess(stats['slow1']['queue_delay']['max_ms'], 10)
+        self.assertGreaterEqual(stats['slow2']['queue_delay']['max_ms'], 25)  # waited for the pool
+
+        event_stats = events.get_event_stats()
+        self.assertEqual(event_stats[0]['event'], 'testProfile')
+        self.assertEqual(event_stats[0]['triggers'], 1)
+        self.assertEqual(event_stats[0]['handler_runs'], 4)
+        self.assertEqual(event_stats[0]['errors'], 1)
+        self.assertEqual(event_stats[0]['over_budget'], 2)
+
+        for name in ('fast', 'failing', 'slow1', 'slow2'):
+            events.off('testProfile', name)
+
+        server.RHAPI.events.trigger('testStatsEndpoint', {})
+        with server.APP.test_client() as tc:
+            resp = tc.get('/api/events/stats')
+        payload = json.loads(resp.data)['event_stats']
+        self.assertEqual(payload['latency_budget_ms'], server.RHAPI.events.latency_budget)
+        self.assertEqual(len(payload['histogram_bounds_ms']) + 1, len(payload['events'][0]['histogram']))
+        self.assertIn('pool', payload)
+        self.assertEqual(len(payload['events']), len(server.RHAPI.events.event_stats))
+
+    def test_event_budget_ignores_waiting(self):
+        events = EventManager(server.RHAPI)
+        events.events = {}  # keep clear of the server's handlers
+        events.dispatchTable = {}
+        events.set_latency_budget(100)
+
+        events.on('testWaiting', 'sleeper', lambda args: gevent.sleep(1))
+        events.on('testWaiting', 'blockingSleeper', lambda args: gevent.sleep(0.2), priority=50)
+        with self.assertLogs('eventmanager', 'INFO') as logs:
+            events.trigger('testWaiting')
+            gevent.sleep(1.2)
+            logging.getLogger('eventmanager').info('done')  # assertLogs requires at least one record
+        self.assertEqual([line for line in logs.output if 'Slow' in line], [])
+
+        stats = {item['name']: item for item in events.get_handler_stats()}
+        for name, waitMs in (('sleeper', 1000), ('blockingSleeper', 200)):
+            self.assertEqual(stats[name]['count'], 1)
+            self.assertEqual(stats[name]['over_budget'], 0)
+            self.assertGreaterEqual(stats[name]['max_ms'], waitMs)  # wall time
+            self.assertLess(stats[name]['loop_time']['max_ms'], 50)
+        self.assertEqual(events.get_event_stats()[0]['over_budget'], 0)
+
+    def test_log_queue_overflow(self):
+        for policy, expected in [(log.OVERFLOW_DROP_OLDEST, list(range(15, 20))), (log.OVERFLOW_DROP_NEWEST, list(range(5)))]:
+            stream = io.StringIO()
+            dest_hndlr = logging.StreamHandler(stream)
+            dest_hndlr.setFormatter(logging.Formatter(log.CONSOLE_FORMAT_STR))
+            queued_hndlr = log.QueuedLogEventHandler(dest_hndlr, queue_size=5, overflow_policy=policy)
+            for index in range(20):
+                queued_hndlr.handle(logging.makeLogRecord({'msg': 'record %d', 'args': (index,), 'levelno': logging.INFO}))
+            queued_hndlr.waitForQueueEmpty()
+
+            lines = stream.getvalue().splitlines()
+            self.assertEqual(lines[:5], ['record {}'.format(index) for index in expected])
+            self.assertEqual(lines[5], 'Log queue full; 15 record(s) dropped (total 15)')
+            stats = queued_hndlr.getStats()
+            self.assertEqual(stats['dropped'], 15)
+            self.assertEqual(stats['max_queued'], 5)
+            self.assertEqual(stats['queued'], 0)
+
+        with self.assertRaises(ValueError):
+            log.QueuedLogEventHandler(overflow_policy='DROP_ALL')
+        self.assertEqual(log.get_queue_options({'QUEUE_SIZE': 'x', 'OVERFLOW_POLICY': 'block'}, None)[:2],
+                         (log.DEF_QUEUE_SIZE, log.OVERFLOW_BLOCK))
+
+    def test_led_panel_framebuffer(self):
+        np_module = led_event_manager.np
+
+        class FakeImage:
+            mode = 'RGB'
+            def __init__(self, rows):
+                self.pixels = rows
+                self.height = len(rows)
+                self.width = len(rows[0])
+            def getdata(self):
+                return [px for row in self.pixels for px in row]
+            def __array__(self, dtype=None, copy=None):
+                return np_module.array(self.pixels, dtype=dtype)
+
+        class FakeStrip:
+            def __init__(self, count):
+                self.pixels = [0] * count
+            def numPixels(self):
+                return len(self.pixels)
+            def setPixelColor(self, i, color):
+                self.pixels[i] = color
+
+        class FakeBulkStrip(FakeStrip):
+            def setPixels(self, colors, start=0):
+                self.pixels[start:start + len(colors)] = colors
+
+        img = FakeImage([[(row, col, 7) for col in range(3)] for row in range(3)])
+        expected = [Color(0, 2, 7), Color(0, 1, 7), Color(0, 0, 7), Color(1, 0, 7), Color(1, 1, 7), Color(1, 2, 7),
+                    Color(2, 2, 7), Color(2, 1, 7)]  # serpentine rows, truncated to the strip length
+        try:
+            for np_value in (np_module, None):
+                led_event_manager.np = np_value
+                PanelFramebuffer._indexMaps.clear()
+                for strip in (FakeStrip(8), FakeBulkStrip(8)):
+                    PanelFramebuffer(strip, invertedRows=True).blit(img)
+                    self.assertEqual(strip.pixels, expected)
+                    self.assertTrue(all(type(color) is int for color in strip.pixels))
+                strip = FakeStrip(9)
+                PanelFramebuffer(strip).blit(img)
+                self.assertEqual(strip.pixels[3:6], [Color(1, 0, 7), Color(1, 1, 7), Color(1, 2, 7)])
+
+                # rotation (quarter turns counterclockwise) is part of the index map
+                wide_img = FakeImage([[(row, col, 7) for col in range(3)] for row in range(2)])
+                strip = FakeStrip(6)
+                PanelFramebuffer(strip, rotate=1).blit(wide_img)
+                self.assertEqual(strip.pixels, [Color(0, 2, 7), Color(1, 2, 7), Color(0, 1, 7), Color(1, 1, 7),
+                                                Color(0, 0, 7), Color(1, 0, 7)])
+                PanelFramebuffer(strip, rotate=2).blit(wide_img)
+                self.assertEqual(strip.pixels, [Color(1, 2, 7), Color(1, 1, 7), Color(1, 0, 7), Color(0, 2, 7),
+                                                Color(0, 1, 7), Color(0, 0, 7)])
+                PanelFramebuffer(strip, invertedRows=True, rotate=3).blit(wide_img)
+                self.assertEqual(strip.pixels, [Color(0, 0, 7), Color(1, 0, 7), Color(1, 1, 7), Color(0, 1, 7),
+                                                Color(0, 2, 7), Color(1, 2, 7)])
+        finally:
+            led_event_manager.np = np_module
+
+    def test_led_renderer(self):
+        class FakeStrip:
+            def __init__(self, count):
+                self.pixels = [0] * count
+                self.shown = []
+            def numPixels(self):
+                return len(self.pixels)
+            def setPixelColor(self, i, color):
+                self.pixels[i] = color
+            def show(self):
+                self.shown.append(list(self.pixels))
+
+        strip = FakeStrip(4)
+        renderer = LEDRenderer(strip, maxFps=20)
+
+        def effect(color):
+            renderer.beginEffect()
+            for i in range(4):
+                renderer.setPixelColor(i, color)
+                renderer.show()
+                gevent.sleep(0.001)
+            gevent.sleep(0.2)
+
+        first = gevent.spawn(effect, ColorVal.RED)
+        gevent.sleep(0.01)
+        self.assertEqual(len(strip.shown), 1)  # first frame pushed straight away, then held to the frame rate
+        second = gevent.spawn(effect, ColorVal.BLUE)  # preempts the first effect's frames
+        gevent.joinall([first, second])
+        self.assertLessEqual(len(strip.shown), 4)
+        self.assertEqual(strip.shown[-1], [ColorVal.BLUE] * 4)
+        self.assertNotIn([ColorVal.RED] * 4, strip.shown)  # first effect's later frames never shown
+
+        pushed = renderer.numPushed
+        renderer.beginEffect()
+        renderer.setPixelColor(0, ColorVal.GREEN)
+        renderer.show()
+        renderer.flush()
+        self.assertEqual(renderer.numPushed, pushed + 1)
+        self.assertEqual(strip.pixels[0], ColorVal.GREEN)
+        renderer.show()  # unchanged frame
+        renderer.flush()
+        self.assertEqual(renderer.numPushed, pushed + 1)
+        self.assertEqual(renderer.numSkipped, 1)
+        renderer.renderThread.kill()
+
+    def test_callout_templates(self):
+        class Obj:
+            def __init__(self, **kwargs):
+                self.__dict__.update(kwargs)
+
+        queries = []
+        pilots = {1: Obj(spoken_callsign='Alpha', display_callsign='ALPHA'), 2: Obj(spoken_callsign='Bravo', display_callsign='BRAVO')}
+        def option(name, default=None):
+            queries.append(name)
+            return {'timeFormatPhonetic': '{m} {s}.{d}', 'consecutivesCount': '3'}.get(name, default)
+        def result_row(node, pilot_id, position):
+            return {'node': node, 'pilot_id': pilot_id, 'position': position, 'laps': 5 - node,
+                    'last_lap': '20.{}00'.format(node), 'last_lap_raw': 20000 + node * 100}
+        rhapi = Obj(
+            db=Obj(heat_by_id=lambda heat_id: Obj(display_name='Heat {}'.format(heat_id)), pilot_by_id=pilots.get, option=option),
+            race=Obj(heat=3, pilots=[1, 2], results={'meta': {'primary_leaderboard': 'by_race_time'},
+                                                     'by_race_time': [result_row(1, 2, 1), result_row(0, 1, 2)]}))
+        setattr(rhapi, '__', lambda text: text)
+
+        text = '%PILOT% lap %LAP_COUNT%, %LAST_LAP%, position %POSITION%'
+        self.assertEqual(RHUtils.doReplace(rhapi, text, {'node_index': 0}), 'ALPHA lap 5, 20.000, position 2')
+        self.assertEqual(RHUtils.doReplace(rhapi, text, {'node_index': 1}, True), 'Bravo lap 4,  20.1, position 1')
+        self.assertEqual(queries, ['timeFormatPhonetic'])  # only options the tokens need; once per event
+        self.assertIs(RHUtils.compileCallout(text), RHUtils.compileCallout(text))
+
+        # tokens that cannot be resolved are left in place
+        self.assertEqual(RHUtils.doReplace(rhapi, '100% %HEAT% %PILOT% %UNKNOWN% %LAP_COUNT%', {'heat_id': 7}),
+                         '100% Heat 7 %PILOT% %UNKNOWN% %LAP_COUNT%')
+        self.assertEqual(RHUtils.doReplace(rhapi, 'No tokens', {}), 'No tokens')
+
+    def test_language_translator(self):
+        options = {'currentLanguage': ''}
+        class FakeRHData:
+            def get_option(self, option, default_value=None):
+                return options.get(option, default_value)
+
+        language = Language.Language(FakeRHData())
+        language._Languages = {
+            'de': {'name': 'Deutsch', 'values': {'Heat': 'Lauf', 'Pilot': 'Pilot'}},
+            'es': {'name': 'Español', 'values': {'Heat': 'Serie'}}
+        }
+        self.assertEqual(language.__('Heat'), 'Heat')
+        options['currentLanguage'] = 'de'
+        translator = language.getTranslator()
+        self.assertEqual(translator.lang, 'de')
+        self.assertEqual(language.__('Heat'), 'Lauf')
+        self.assertEqual(language.__('Unknown'), 'Unknown')
+        self.assertIs(language.getTranslator(), translator)
+        self.assertEqual(language.__('Heat', 'es'), 'Serie')
+        self.assertIs(language.getTranslator(), translator)  # explicit language doesn't swap current
+        options['currentLanguage'] = 'xx'
+        self.assertEqual(language.__('Heat'), 'Heat')
+
+        self.assertEqual(language.getLanguages(), [{'id': 'de', 'name': 'Deutsch'}, {'id': 'es', 'name': 'Español'}])
+        bundle = language.getLanguageBundle()
+        self.assertIs(language.getLanguageBundle(), bundle)
+        self.assertEqual(json.loads(bundle.decode('utf-8')), language.getAllLanguages())
+        self.assertEqual(json.loads(language.getLanguageBundle('es').decode('utf-8')), {'es': language._Languages['es']})
+        self.assertEqual(language.getLanguageBundle('xx'), b'{}')
+
+        self.client.get_received()
+        self.client.emit('load_data', {'load_types': ['all_languages']})
+        responses = [resp for resp in self.client.get_received() if resp['name'] == 'all_languages']
+        self.assertEqual(json.loads(responses[0]['args'][0].decode('utf-8')), server.RaceContext.language.getAllLanguages())
+
+    def test_batch_send_queue(self):
+        received = []
+        sent_seqs = []
+        lost_seqs = [1] # first send of batch 1 is lost
+        receiver = BatchReceiver(lambda msg_type, payload: received.append(payload), \
+            lambda ack: queue.ack(ack['seq'], ack['sid']), server.logger, 'test')
+
+        def deliver(_event, frame):
+            sent_seqs.append(frame['seq'])
+            if frame['seq'] in lost_seqs:
+                lost_seqs.remove(frame['seq'])
+            else:
+                gevent.spawn(receiver.receive, frame)
+
+        queue = BatchSendQueue(deliver, server.logger, 'test', windowSize=2, maxBatchSize=4)
+        queue.RETRY_INTERVAL_SECS = 0.1
+        try:
+            for index in range(10):
+                queue.put('pass_record', index)
+            for _i in range(100):
+                if len(received) == 10:
+                    break
+                gevent.sleep(0.01)
+            self.assertEqual(received, list(range(10)))
+            self.assertEqual(max(sent_seqs), 3) # 10 messages in 3 batches
+            self.assertEqual(queue.getStats()['queueDepth'], 0)
+            self.assertEqual(queue.getStats()['inFlight'], 0)
+        finally:
+            queue.stop()
+
+    def test_cluster_batch_from_primary(self):
+        frame = {'sid': 'test', 'seq': 1, 'base': 1, 'msgs': [['check_secondary_query', {'timestamp': 5}]]}
+        self.client.emit('cluster_batch', frame)
+        self.client.emit('cluster_batch', frame) # duplicate is not processed again
+        responses = self.client.get_received()
+        self.assertEqual([resp['args'][0]['query_timestamp'] for resp in responses \
+            if resp['name'] == 'check_secondary_response'], [5])
+        self.assertEqual([resp['args'][0] for resp in responses if resp['name'] == 'cluster_batch_ack'], \
+            [{'sid': 'test', 'seq': 1}] * 2)
+
+    def test_secondary_reconnect_backoff(self):
+        attempts = []
+        ticks = []
+        secondary = server.SecondaryNode(0, {'address': '127.0.0.1:9', 'timeout': 1.0}, server.RaceContext, \
+            server.monotonic_to_epoch_millis, server.RELEASE_VERSION)
+        secondary.RECONNECT_MIN_SECS = 0.05
+        secondary.RECONNECT_MAX_SECS = 0.4
+        sio_connect = secondary.sio.connect
+        secondary.sio.connect = lambda *args, **kwargs: attempts.append(server.monotonic()) or sio_connect(*args, **kwargs)
+
+        ticker = gevent.spawn(lambda: [ticks.append(1) or gevent.sleep(0.01) for _i in range(200)])
+        secondary.workerThread.join(timeout=3)
+        ticker.kill()
+        self.assertFalse(secondary.runningFlag) # gave up after timeout, having never connected
+        self.assertGreater(len(ticks), 50) # event loop kept running
+        intervals = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+        self.assertGreaterEqual(len(intervals), 3)
+        self.assertGreater(max(intervals), 0.15) # delays grew
+        self.assertLess(intervals[0], max(intervals) / 2)
+
+    def test_database_deferred_commits(self):
+        rhdata = server.RaceContext.rhdata
+        db_file = server.DB_FILE_NAME
+
+        def stored_option(option):
+            conn = sqlite3.connect(db_file)
+            row = conn.execute('SELECT option_value FROM global_settings WHERE option_name=?', (option,)).fetchone()
+            conn.close()
+            return row[0] if row else None
+
+        rhdata.set_durability_mode(True, 0.05)
+        try:
+            self.assertEqual(server.Database.DB.session.execute('PRAGMA journal_mode').scalar(), 'wal')
+
+            # values differ per run; the options persist in the test database
+            value_a = 'one-{:08x}'.format(random.getrandbits(32))
+            value_b = 'two-{:08x}'.format(random.getrandbits(32))
+
+            rhdata.set_option('testDeferredA', value_a)
+            self.assertEqual(rhdata.get_option('testDeferredA'), value_a)
+            self.assertNotEqual(stored_option('testDeferredA'), value_a)
+            gevent.sleep(0.1)
+            self.assertEqual(stored_option('testDeferredA'), value_a)
+
+            # synchronous commits complete deferred ones too
+            rhdata.set_option('testDeferredB', value_b)
+            rhdata.add_pilot()
+            self.assertEqual(stored_option('testDeferredB'), value_b)
+        finally:
+            rhdata.set_durability_mode(False)
+        self.assertEqual(server.Database.DB.session.execute('PRAGMA journal_mode').scalar(), 'delete')
+
+    def test_page_cache_incremental(self):
+        rhdata = server.RaceContext.rhdata
+        pagecache = server.RaceContext.pagecache
+        pilot_id = server.RHAPI.db.pilot_add().id
+        heat_a = server.RHAPI.db.heat_add()
+        heat_b = server.RHAPI.db.heat_add()
+        self.save_test_race(heat_a.id, pilot_id, [1000, 20000, 21000])
+        self.save_test_race(heat_b.id, pilot_id, [1500, 22000])
+
+        pagecache.set_valid(False)
+        cache = pagecache.get_cache()
+        heat_a_entry = cache['heats'][heat_a.id]
+        self.assertEqual(len(cache['heats'][heat_b.id]['rounds']), 1)
+
+        race = self.save_test_race(heat_b.id, pilot_id, [1200, 19000, 19500, 20000])
+        rhdata.clear_results_heat(heat_b.id)
+        rhdata.clear_results_event()
+        pagecache.invalidate_race(race.id)
+        self.assertFalse(pagecache.get_valid())
+        cache = pagecache.get_cache()
+        self.assertTrue(pagecache.get_valid())
+        self.assertIs(cache['heats'][heat_a.id], heat_a_entry)
+        self.assertEqual(len(cache['heats'][heat_b.id]['rounds']), 2)
+        self.assertEqual(cache['heats'][heat_b.id]['leaderboard']['by_race_time'][0]['laps'], 4)
+        self.assertEqual(cache['event_leaderboard']['by_race_time'][0]['laps'], 6)
+
+        # renaming a heat rebuilds only that heat's entry
+        rhdata.alter_heat({'heat': heat_b.id, 'name': 'Renamed Heat'})
+        self.assertFalse(pagecache.get_valid())
+        cache = pagecache.get_cache()
+        self.assertIs(cache['heats'][heat_a.id], heat_a_entry)
+        self.assertEqual(cache['heats'][heat_b.id]['displayname'], 'Renamed Heat')
+
+        rhdata.clear_race_data()
+        pagecache.set_valid(False)
+
+    @unittest.skipIf(Results.np is None, 'NumPy not installed')
+    def test_leaderboard_columnar(self):
+        rhdata = server.RaceContext.rhdata
+        pilot_ids = [server.RHAPI.db.pilot_add().id for _i in range(2)]
+        heat = server.RHAPI.db.heat_add()
+        self.save_test_race(heat.id, pilot_ids[0], [1000, 20000, 21000, 19000, 20000])
+        self.save_test_race(heat.id, pilot_ids[1], [1500, 22000, 19000])
+        self.save_test_race(heat.id, pilot_ids[0], [1200, 19000, 19000, 18500])
+
+        columnar = Results.calc_leaderboard(rhdata, heat_id=heat.id)
+        numpy_module = Results.np
+        Results.np = None
+        try:
+            legacy = Results.calc_leaderboard(rhdata, heat_id=heat.id)
+        finally:
+            Results.np = numpy_module
+
+        self.assertEqual(columnar, legacy)
+        leader = columnar['by_race_time'][0]
+        self.assertEqual(leader['pilot_id'], pilot_ids[0])
+        self.assertEqual(leader['laps'], 7)
+        self.assertEqual(leader['starts'], 2)
+        self.assertEqual(leader['fastest_lap_raw'], 18500)
+        self.assertEqual(leader['consecutives_raw'], 56500)
+        self.assertEqual(leader['consecutive_lap_start'], 1)
+
+        rhdata.clear_race_data()
+
+    def test_consecutives(self):
+        self.assertEqual(Results.calc_consecutives([20000, 21000, 19000, 20000, 18000], 3), (3, 57000, 3))
+        self.assertEqual(Results.calc_consecutives([20000, 21000], 3), (2, 41000, None))
+        self.assertEqual(Results.calc_consecutives([0, 0, 0, 20000], 3), (3, 20000, 2))
+        self.assertEqual(Results.calc_consecutives([], 3), (0, 0, None))
+
+        race = server.RaceContext.race
+        laps = [{'lap_time': lap_time} for lap_time in [20000, 21000, 19000]]
+        self.assertEqual(race.get_consecutives(0, laps, 3), (3, 60000, 1))
+        laps.append({'lap_time': 18000})
+        self.assertEqual(race.get_consecutives(0, laps, 3), (3, 58000, 2))
+        tracker = race.node_consecutives[0]
+        laps.append({'lap_time': 25000})
+        race.get_consecutives(0, laps, 3)
+        self.assertIs(race.node_consecutives[0], tracker)
+        self.assertEqual(len(tracker.lap_times), 5)
+
+        # edited laps are rebuilt from scratch
+        del laps[1]
+        self.assertEqual(race.get_consecutives(0, laps, 3), (3, 57000, 1))
+        race.clear_consecutives()
+
+    def test_live_leaderboard(self):
+        race = server.RaceContext.race
+        rhdata = server.RaceContext.rhdata
+        race.current_heat = RHUtils.HEAT_ID_NONE
+        race.node_laps = {node_index: [] for node_index in range(race.num_nodes)}
+        race.clear_results()
+        results = race.get_results()
+
+        lap_times = {0: [1000, 21000, 19000, 22000], 1: [1500, 20000, 20500], 2: [900, 25000, 18000, 18000]}
+        for lap_number in range(4):
+            for node_index, node_lap_times in lap_times.items():
+                if lap_number < len(node_lap_times):
+                    laps = race.node_laps[node_index]
+                    laps.append({
+                        'lap_number': lap_number,
+                        'lap_time_stamp': sum(node_lap_times[:lap_number + 1]),
+                        'lap_time': node_lap_times[lap_number],
+                        'lap_time_formatted': '',
+                        'source': 0,
+                        'deleted': False
+                    })
+                    race.update_results(node_index)
+                    previous = results
+                    results = race.get_results()
+                    self.assertEqual(results, Results.calc_leaderboard(rhdata, current_race=race, current_profile=race.profile))
+
+                    # applying the update to the previous leaderboard gives the new one
+                    update = Results.calc_leaderboard_update(previous, results)
+                    for ranking in ['by_race_time', 'by_fastest_lap', 'by_consecutives']:
+                        rows = {row['node']: dict(row) for row in previous[ranking]}
+                        for node, changes in update.get(ranking, {}).get('rows', {}).items():
+                            rows.setdefault(node, {}).update(changes)
+                        order = update.get(ranking, {}).get('order', [row['node'] for row in previous[ranking]])
+                        self.assertEqual([rows[node] for node in order], results[ranking])
+                        for node in update.get(ranking, {}).get('rows', {}):
+                            self.assertIn(node, [node_index] + order)
+
+        race.node_laps = {node_index: [] for node_index in range(race.num_nodes)}
+        race.clear_results()
+
+    def test_pass_snapshot(self):
+        race = server.RaceContext.race
+        rhdata = server.RaceContext.rhdata
+        heat = rhdata.get_first_heat() or rhdata.add_heat()
+        race.current_heat = heat.id
+        snapshot = race.build_pass_snapshot()
+        for node_index in range(race.num_nodes):
+            self.assertEqual(snapshot.seat_pilots.get(node_index), rhdata.get_pilot_from_heatNode(heat.id, node_index))
+        for pilot_id, pilot in snapshot.pilots.items():
+            self.assertEqual(pilot.callsign, rhdata.get_pilot(pilot_id).callsign)
+        self.assertEqual(snapshot.min_lap, rhdata.get_optionInt('MinLapSec'))
+
+        # reused until settings used by pass records change
+        self.assertIs(race.get_pass_snapshot(), snapshot)
+        min_lap = rhdata.get_option('MinLapSec')
+        rhdata.set_option('MinLapSec', 7)
+        self.assertEqual(race.get_pass_snapshot().min_lap, 7)
+        rhdata.set_option('MinLapSec', min_lap)
+        race.current_heat = RHUtils.HEAT_ID_NONE
+        self.assertEqual(race.get_pass_snapshot().seat_pilots, {})
+
+        race.pass_latency.reset()
+        race.pass_latency.add(2.0, 1.0)
+        race.pass_latency.add(4.0, 3.0)
+        self.assertEqual(race.pass_latency.summary(), {'count': 2, 'wait_avg': 3.0, 'wait_max': 4.0,
+            'process_avg': 2.0, 'process_max': 3.0})
+
+    def test_compact_heartbeat(self):
+        stream = HeartbeatStream.HeartbeatStream()
+        heartbeat = {'current_rssi': [40, 120, 0, 300], 'frequency': [5658, 5695, 0, 5880],
+            'loop_time': [1000, 1010, 0, 1200], 'crossing_flag': [False, True, False, False]}
+        stream.subscribe('a', 20)
+        stream.subscribe('b', 2)
+
+        frames = dict(stream.get_frames(heartbeat, 100.0))
+        self.assertEqual(set(frames), {'a', 'b'})
+        keyframe = frames['a']
+        decoded = HeartbeatStream.decode_frame(keyframe)
+        self.assertEqual(decoded, heartbeat)
+
+        # only changed values are sent; 'b' is rate capped
+        heartbeat = dict(heartbeat, current_rssi=[42, 120, 0, 290])
+        frames = dict(stream.get_frames(heartbeat, 100.1))
+        self.assertEqual(set(frames), {'a'})
+        self.assertLess(len(frames['a']), len(keyframe) / 3)
+        decoded = HeartbeatStream.decode_frame(frames['a'], decoded)
+        self.assertEqual(decoded, heartbeat)
+
+        frames = dict(stream.get_frames(heartbeat, 100.5))
+        self.assertEqual(set(frames), {'a', 'b'})
+        stream.unsubscribe('a')
+        self.assertEqual(stream.sids, ['b'])
+
+    def test_lap_stats_layout(self):
+        class LayoutNode(Node):
+            def __init__(self, api_level, blocks):
+                Node.__init__(self)
+                self.api_level = api_level
+                self.blocks = blocks
+                self.commands = []
+                self.init()
+
+            def read_block(self, interface, command, size, max_retries=0):
+                self.commands.append(command)
+                return self.blocks[command][:size]
+
+        pass_stats = [3, 0x01, 0x2C, 90, 150, 140, 0x03, 0xE8]
+        extremums = [RHInterface.LAPSTATS_FLAG_PEAK, 45, 30, 130, 0x00, 0x64, 0x00, 0x14]
+        blocks = {
+            RHInterface.READ_LAP_STATS: pass_stats + extremums
+        }
+
+        # pass stats and extremums are read in one transaction
+        node = LayoutNode(35, blocks)
+        layout = RHInterface.get_lap_stats_layout(node)
+        data = layout.read(None, node)
+        self.assertEqual(node.commands, [RHInterface.READ_LAP_STATS])
+        self.assertEqual(data, pass_stats + extremums)
+
+        values = layout.unpack(data)
+        self.assertEqual(values['lap_id'], 3)
+        self.assertEqual(values['ms_since_lap'], 300)
+        self.assertEqual(values['loop_time'], 1000)
+        self.assertEqual(values['extremum_rssi'], 130)
+        self.assertEqual(values['extremum_first_time'], 100)
+        self.assertEqual(values['extremum_duration'], 20)
+        self.assertIsNone(layout.unpack(data[:12]))
+
+    def test_topic_rooms(self):
+        topic_client = server.SOCKET_IO.test_client(server.APP)
+        topic_client.emit('subscribe_topics', {'topics': ['event']})
+        gevent.sleep(0.1)
+        topic_client.get_received()
+        self.client.get_received()
+
+        rhui = server.RaceContext.rhui
+        rhui.emit_node_data()
+        rhui.emit_pilot_data()
+        rhui.emit_frequency_data()
+
+        topic_events = [resp['name'] for resp in topic_client.get_received()]
+        self.assertNotIn('node_data', topic_events)
+        self.assertIn('pilot_data', topic_events)
+        self.assertIn('frequency_data', topic_events)
+
+        events = [resp['name'] for resp in self.client.get_received()]
+        for event in ['node_data', 'pilot_data', 'frequency_data']:
+            self.assertIn(event, events)
+
+        topic_client.disconnect()
+
+    def test_page_topics_heartbeat(self):
+        # pages that listen for the JSON heartbeat must subscribe to its topic
+        with io.open('../server/templates/current.html', encoding='utf-8') as f:
+            match = re.search(r"var data_topics = (\[.*\]);", f.read())
+        topics = json.loads(match.group(1).replace("'", '"'))
+
+        page_client = server.SOCKET_IO.test_client(server.APP)
+        page_client.emit('subscribe_topics', {'topics': topics})
+        gevent.sleep(0.1)
+        page_client.get_received()
+
+        server.RaceContext.rhui.emit_heartbeat({'current_rssi': [0], 'frequency': [5658], 'loop_time': [1000], 'crossing_flag': [False]})
+        events = [resp['name'] for resp in page_client.get_received()]
+        self.assertIn('heartbeat', events)
+
+        page_client.disconnect()
+
+    def test_payload_cache(self):
+        rhui = server.RaceContext.rhui
+        rhdata = server.RaceContext.rhdata
+
+        generation = rhdata.get_generation('pilot')
+        payload = rhui.get_cached_payload('test_data', generation, lambda: {'pilots': [1]})
+        self.assertIs(rhui.get_cached_payload('test_data', generation, lambda: {'pilots': [2]}), payload)
+        self.assertEqual(RHUI.PayloadJSON.dumps(['test_data', payload], separators=(',', ':')), '["test_data",{"pilots":[1]}]')
+
+        server.RHAPI.db.pilot_add()
+        self.assertNotEqual(rhdata.get_generation('pilot'), generation)
+        self.assertEqual(rhui.get_cached_payload('test_data', rhdata.get_generation('pilot'), lambda: {'pilots': [2]}), {'pilots': [2]})
+
+        self.client.emit('load_data', {'load_types': ['pilot_data']})
+        num_pilots = len(self.get_response('pilot_data')['pilots'])
+        self.assertEqual(num_pilots, len(rhdata.get_pilots()))
+
+    def test_ensure_indexes(self):
+        rhdata = server.RaceContext.rhdata
+        engine = server.Database.DB.engine
+        index_names = lambda: [index['name'] for index in inspect(engine).get_indexes('saved_race_lap')]
+        index = next(index for index in server.Database.SavedRaceLap.__table__.indexes \
+            if index.name == 'ix_saved_race_lap_pilotrace_id')
+
+        self.assertIn(index.name, index_names())
+        index.drop(bind=engine)
+        self.assertNotIn(index.name, index_names())
+        self.assertTrue(rhdata.ensure_indexes())
+        self.assertIn(index.name, index_names())
+
 if __name__ == '__main__':
     unittest.main()